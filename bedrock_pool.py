@@ -0,0 +1,141 @@
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
+from botocore.exceptions import ClientError, HTTPClientError
+from botocore.exceptions import ConnectionError as EndpointError
+
+THROTTLING_ERRORS = {"ThrottlingException", "TooManyRequestsException"}
+RETRYABLE_ERRORS = THROTTLING_ERRORS | {
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelTimeoutException",
+    "ModelNotReadyException",
+}
+
+# Errors of a call that got no answer: connection and read timeouts, refused or closed
+# connections. The client makes one attempt only, so they are retried here like the codes above
+CONNECTION_ERRORS = (EndpointError, HTTPClientError)
+
+
+def error_code(error):
+    """
+    This gets the AWS error code out of an exception, or None if it isn't an AWS error.
+
+    :param error: The exception raised by the boto3 call.
+    """
+    if isinstance(error, ClientError):
+        return error.response.get("Error", {}).get("Code")
+    return None
+
+
+class AdaptiveLimiter:
+    """
+    This limits how many calls run at the same time. The limit is halved every time a call is
+    throttled and grows back by about one for every limit's worth of successful calls.
+    """
+
+    def __init__(self, max_concurrency, min_concurrency=1):
+        """
+        :param max_concurrency: The highest number of calls allowed at the same time.
+        :param min_concurrency: The limit never goes below this number.
+        """
+        self.max_concurrency = max(max_concurrency, 1)
+        self.min_concurrency = max(min(min_concurrency, self.max_concurrency), 1)
+        self.limit = float(self.max_concurrency)
+        self.in_flight = 0
+        self.throttle_count = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        This blocks until another call is allowed to start.
+        """
+        with self._condition:
+            while self.in_flight >= int(self.limit):
+                self._condition.wait()
+            self.in_flight += 1
+
+    def release(self, throttled=False):
+        """
+        This marks a call as finished and adjusts the limit.
+
+        :param throttled: Whether the call was rejected with a throttling error.
+        """
+        with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self.throttle_count += 1
+                self.limit = max(self.min_concurrency, self.limit / 2)
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+
+def call_with_retries(func, limiter, max_retries=5, base_delay=0.5, max_delay=20.0):
+    """
+    This calls func under the limiter, retrying throttled and transient errors, and calls that
+    got no answer, with full jitter exponential backoff. Any other error, or the last failed
+    attempt, is raised.
+
+    :param func: The function to call, it takes no arguments.
+    :param limiter: The AdaptiveLimiter shared by all the calls.
+    :param max_retries: How many times a failed call is retried.
+    :param base_delay: The backoff in seconds before the first retry.
+    :param max_delay: The longest backoff in seconds between two attempts.
+    """
+    attempt = 0
+    while True:
+        limiter.acquire()
+        throttled = False
+        try:
+            return func()
+        except Exception as e:
+            code = error_code(e)
+            throttled = code in THROTTLING_ERRORS
+            retryable = code in RETRYABLE_ERRORS or isinstance(e, CONNECTION_ERRORS)
+            if not retryable or attempt >= max_retries:
+                raise
+        finally:
+            limiter.release(throttled)
+
+        time.sleep(random.uniform(0, min(max_delay, base_delay * 2**attempt)))
+        attempt += 1
+
+
+def map_with_retries(items, func, concurrency=4, max_retries=5):
+    """
+    This calls func on every item at the same time, up to the concurrency limit, and yields a
+    tuple of (item, result, error) for each one as soon as it finishes. error is None on success.
+    Items are read from the iterable only as fast as they are finished, so a generator stays lazy.
+
+    :param items: The items to process.
+    :param func: The function to call with each item.
+    :param concurrency: The maximum number of calls running at the same time.
+    :param max_retries: How many times a failed call is retried.
+    """
+    concurrency = max(concurrency, 1)
+    limiter = AdaptiveLimiter(concurrency)
+    pending = dict()
+
+    def finished(futures):
+        for future in futures:
+            item = pending.pop(future)
+            error = future.exception()
+            yield item, None if error else future.result(), error
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for item in items:
+            if len(pending) >= concurrency * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                yield from finished(done)
+
+            future = executor.submit(
+                call_with_retries, partial(func, item), limiter, max_retries
+            )
+            pending[future] = item
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            yield from finished(done)
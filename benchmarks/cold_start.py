@@ -0,0 +1,108 @@
+"""
+Measures the Lambda cold start: the time to import lambda_handler in a fresh interpreter, and the
+latency of the first and second (warm) invocations. Each run uses a new process so nothing is
+shared between runs. The results are printed as JSON.
+
+Usage: python benchmarks/cold_start.py --runs 5 --event '{"incremental": true}'
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+# Runs inside the fresh interpreter
+CHILD_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import lambda_handler
+imported = time.perf_counter()
+event = json.loads(sys.argv[1])
+invoke = sys.argv[2] == "1"
+first = second = None
+if invoke:
+    response = lambda_handler.lambda_handler(event, None)
+    first = time.perf_counter() - imported
+    warm = time.perf_counter()
+    lambda_handler.lambda_handler(event, None)
+    second = time.perf_counter() - warm
+print(json.dumps({
+    "import_seconds": imported - start,
+    "first_invocation_seconds": first,
+    "warm_invocation_seconds": second,
+    "first_status_code": response["statusCode"] if invoke else None,
+}))
+"""
+
+
+def run_once(event, invoke):
+    """
+    This starts a new interpreter, imports and invokes the handler, and returns its timings.
+
+    :param event: The event passed to the handler.
+    :param invoke: Whether to invoke the handler or only measure the import.
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD_SCRIPT, json.dumps(event), "1" if invoke else "0"],
+        cwd=REPO_ROOT,
+        env=dict(os.environ, PYTHONDONTWRITEBYTECODE="1"),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def summarize(values):
+    """
+    This returns the min, median and max of the values that were measured.
+
+    :param values: The measured values, None entries are skipped.
+    """
+    values = [value for value in values if value is not None]
+    if not values:
+        return None
+    return {
+        "min": min(values),
+        "median": statistics.median(values),
+        "max": max(values),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--event", default="{}", help="JSON event for the handler")
+    parser.add_argument(
+        "--import-only",
+        action="store_true",
+        help="Only measure the import, without invoking the handler",
+    )
+    args = parser.parse_args()
+
+    runs = [run_once(json.loads(args.event), not args.import_only) for _ in range(args.runs)]
+    print(
+        json.dumps(
+            {
+                "runs": args.runs,
+                "import_seconds": summarize(r["import_seconds"] for r in runs),
+                "first_invocation_seconds": summarize(
+                    r["first_invocation_seconds"] for r in runs
+                ),
+                "warm_invocation_seconds": summarize(
+                    r["warm_invocation_seconds"] for r in runs
+                ),
+                "status_codes": [r["first_status_code"] for r in runs],
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+"""
+Records eCFR responses of one part to a fixtures directory, and serves them back from a local
+HTTP server that looks like the eCFR versioner API, so the pipeline can be benchmarked offline.
+
+A fixtures directory has titles.json, structure.json, versions.json, one subpart-<letter>.xml per
+sub part and fixture.json, which says where the responses came from. The full title download is
+answered with title.xml, which is joined from the sub parts the first time it is asked for.
+
+Usage:
+    python benchmarks/fixtures.py record --part 482 --output benchmarks/fixtures/title-42-part-482
+    python benchmarks/fixtures.py synthetic --output /tmp/fixtures --sections 20
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+# Where the recorded fixtures of the default part are kept
+DEFAULT_FIXTURES = Path(__file__).resolve().parent / "fixtures" / "title-42-part-482"
+
+ECFR_BASE_URL = "https://www.ecfr.gov"
+
+# Routes of the versioner API the pipeline calls, the path after /api/versioner/v1
+ROUTES = [
+    (re.compile(r"^/titles\.json$"), "titles"),
+    (re.compile(r"^/structure/[^/]+/title-\d+\.json$"), "structure"),
+    (re.compile(r"^/versions/title-\d+\.json$"), "versions"),
+    (re.compile(r"^/full/[^/]+/title-\d+\.xml$"), "full"),
+]
+
+
+def find_node(node, node_type, identifier):
+    """
+    This returns a node of the eCFR structure by its type and identifier, or None.
+
+    :param node: The structure JSON, or a node of it.
+    :param node_type: The type of the node, e.g. "part".
+    :param identifier: The identifier of the node, e.g. "482".
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.get("type") == node_type and node.get("identifier") == str(identifier):
+            return node
+        stack.extend(node.get("children") or [])
+    return None
+
+
+def record_fixtures(output, title=42, part=482, date=None):
+    """
+    This downloads the responses the pipeline needs for one part from eCFR and writes them to
+    the fixtures directory. The structure is trimmed to the part, and titles.json to the title.
+
+    :param output: The fixtures directory.
+    :param title: The title number.
+    :param part: The part number.
+    :param date: The eCFR date to record, the latest if None.
+    """
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    api = f"{ECFR_BASE_URL}/api/versioner/v1"
+    session = requests.Session()
+
+    def get(url, accept, **params):
+        response = session.get(url, headers={"Accept": accept}, params=params, timeout=120)
+        response.raise_for_status()
+        return response
+
+    titles = get(f"{api}/titles.json", "application/json").json()
+    metadata = next(entry for entry in titles["titles"] if entry["number"] == title)
+    date = date or metadata["up_to_date_as_of"]
+    metadata = dict(metadata, up_to_date_as_of=date)
+    write_json(output / "titles.json", {"titles": [metadata]})
+
+    structure = get(f"{api}/structure/{date}/title-{title}.json", "application/json").json()
+    part_node = find_node(structure, "part", part)
+    if part_node is None:
+        raise SystemExit(f"Part {part} was not found in title {title}")
+    write_json(output / "structure.json", dict(structure, children=[part_node]))
+
+    versions = get(f"{api}/versions/title-{title}.json", "application/json", part=part)
+    write_json(output / "versions.json", versions.json())
+
+    sub_parts = [
+        child["identifier"]
+        for child in part_node.get("children") or []
+        if child.get("type") == "subpart" and not child.get("reserved")
+    ]
+    for sub_part in sub_parts:
+        print("Recording sub part", sub_part)
+        response = get(
+            f"{api}/full/{date}/title-{title}.xml",
+            "application/xml",
+            part=part,
+            subpart=sub_part,
+        )
+        (output / f"subpart-{sub_part}.xml").write_bytes(response.content)
+
+    write_fixture_info(output, "recorded", title, part, date, sub_parts)
+
+
+def write_json(path, data):
+    with open(path, "w") as f:
+        json.dump(data, f, indent=2)
+
+
+def write_fixture_info(output, source, title, part, date, sub_parts):
+    # The title.xml of older fixtures is joined again from the new sub parts
+    (Path(output) / "title.xml").unlink(missing_ok=True)
+    write_json(
+        Path(output) / "fixture.json",
+        {
+            "source": source,
+            "title": title,
+            "part": str(part),
+            "date": date,
+            "sub_parts": sub_parts,
+            "created": datetime.now(timezone.utc).isoformat(),
+        },
+    )
+
+
+def write_title_fixture(directory):
+    """
+    This joins the sub part files of a fixtures directory into title.xml, the answer of the full
+    endpoint without a part query. The part is nested in the title and chapter elements like in
+    the real title, so the sub parts are not at the start of the document.
+
+    :param directory: The fixtures directory.
+    """
+    directory = Path(directory)
+    info = json.loads((directory / "fixture.json").read_text())
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        "<ECFR>",
+        f'<DIV1 N="{info["title"]}" TYPE="TITLE">',
+        f"<HEAD>Title {info['title']}</HEAD>",
+        '<DIV3 N="IV" TYPE="CHAPTER">',
+        f'<DIV5 N="{info["part"]}" TYPE="PART">',
+        f"<HEAD>PART {info['part']}</HEAD>",
+    ]
+    for sub_part in info["sub_parts"]:
+        xml = (directory / f"subpart-{sub_part}.xml").read_text(encoding="utf-8")
+        # Drop the XML declaration of the sub part document
+        lines.append(re.sub(r"^\s*<\?xml[^>]*\?>\s*", "", xml))
+    lines += ["</DIV5>", "</DIV3>", "</DIV1>", "</ECFR>"]
+
+    path = directory / "title.xml"
+    path.write_text("\n".join(lines), encoding="utf-8")
+    return path
+
+
+# Sub parts of the synthetic part and how many sections each has, relative to the --sections
+# value. The shape follows Part 482: a short A and B, a long C, then D and E.
+SYNTHETIC_SUB_PARTS = {
+    "A": ("General Provisions", 0.25),
+    "B": ("Administration", 0.5),
+    "C": ("Basic Hospital Functions", 2.0),
+    "D": ("Optional Hospital Services", 1.0),
+    "E": ("Requirements for Specialty Hospitals", 0.75),
+}
+
+SYNTHETIC_TEXT = (
+    "The hospital must have policies and procedures that are reviewed and approved by the "
+    "governing body, and that ensure the health and safety of the patients it serves."
+)
+
+
+def synthetic_section(section_id, paragraphs, date):
+    """
+    This returns the DIV8 XML of a synthetic section, with paragraphs on every level the
+    requirement parser reads: (a), (1), (i) and (A), and italic standard headings.
+
+    :param section_id: The section number, e.g. 482.12.
+    :param paragraphs: The number of (a) level paragraphs.
+    :param date: The eCFR date used in the hierarchy metadata.
+    """
+    metadata = json.dumps(
+        {
+            "path": f"/on/{date}/title-42/section-{section_id}",
+            "citation": f"42 CFR {section_id}",
+        }
+    ).replace('"', "&quot;")
+    lines = [
+        f'<DIV8 N="{section_id}" TYPE="SECTION" hierarchy_metadata="{metadata}">',
+        f"<HEAD>§ {section_id} Condition of participation: Synthetic requirement.</HEAD>",
+    ]
+    for index in range(paragraphs):
+        letter = chr(ord("a") + index % 26)
+        lines.append(
+            f"<P>({letter}) <I>Standard: Requirement {index + 1}.</I> {SYNTHETIC_TEXT}</P>"
+        )
+        for number in range(1, 4):
+            lines.append(f"<P>({number}) {SYNTHETIC_TEXT}</P>")
+        for roman in ("i", "ii"):
+            lines.append(f"<P>({roman}) {SYNTHETIC_TEXT}</P>")
+        lines.append(f"<P>(A) {SYNTHETIC_TEXT}</P>")
+    lines.append("</DIV8>")
+    return "\n".join(lines)
+
+
+def write_synthetic_fixtures(output, sections=20, paragraphs=4, date="2025-09-29"):
+    """
+    This writes a fixtures directory with generated content in the shape of Part 482, for when
+    no recorded fixtures are available. Benchmarks run on it are marked as synthetic.
+
+    :param output: The fixtures directory.
+    :param sections: The number of sections of an average sub part.
+    :param paragraphs: The number of (a) level paragraphs of a section.
+    :param date: The eCFR date of the fixtures.
+    """
+    output = Path(output)
+    output.mkdir(parents=True, exist_ok=True)
+    metadata = {
+        "number": 42,
+        "name": "Public Health",
+        "latest_amended_on": date,
+        "latest_issue_date": date,
+        "up_to_date_as_of": date,
+        "reserved": False,
+    }
+    write_json(output / "titles.json", {"titles": [metadata]})
+
+    part_node = {"type": "part", "identifier": "482", "children": []}
+    versions = []
+    number = 1
+    for sub_part, (name, share) in SYNTHETIC_SUB_PARTS.items():
+        # At least two sections, main.py reads a single DIV8 as a dict
+        count = max(int(sections * share), 2)
+        section_ids = [f"482.{number + index}" for index in range(count)]
+        number += count
+        body = "\n".join(synthetic_section(s, paragraphs, date) for s in section_ids)
+        (output / f"subpart-{sub_part}.xml").write_text(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<DIV6 N="{sub_part}" TYPE="SUBPART">\n'
+            f"<HEAD>Subpart {sub_part}—{name}</HEAD>\n{body}\n</DIV6>\n",
+            encoding="utf-8",
+        )
+        part_node["children"].append(
+            {
+                "type": "subpart",
+                "identifier": sub_part,
+                "children": [
+                    {"type": "section", "identifier": s, "size": 1} for s in section_ids
+                ],
+            }
+        )
+        versions += [
+            {
+                "type": "section",
+                "identifier": s,
+                "date": date,
+                "amendment_date": date,
+                "part": "482",
+                "subpart": sub_part,
+            }
+            for s in section_ids
+        ]
+
+    write_json(
+        output / "structure.json",
+        {"type": "title", "identifier": "42", "children": [part_node]},
+    )
+    write_json(output / "versions.json", {"content_versions": versions})
+    write_fixture_info(output, "synthetic", 42, 482, date, list(SYNTHETIC_SUB_PARTS))
+
+
+class FixtureServer:
+    """
+    This serves a fixtures directory on a local port like the eCFR versioner API. Set
+    ECFR_BASE_URL to its url so the pipeline downloads from it.
+    """
+
+    def __init__(self, directory, latency_ms=0, bytes_per_second=None):
+        """
+        :param directory: The fixtures directory.
+        :param latency_ms: The time each response waits before it is sent.
+        :param bytes_per_second: The speed the bodies are sent at, unlimited if None.
+        """
+        self.directory = Path(directory)
+        self.latency = latency_ms / 1000
+        self.bytes_per_second = bytes_per_second
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def find_file(self, path, query):
+        """
+        This returns the fixture file of a request path, or None.
+
+        :param path: The request path.
+        :param query: The parsed query string.
+        """
+        prefix = "/api/versioner/v1"
+        if not path.startswith(prefix):
+            return None
+        path = path[len(prefix) :]
+        for pattern, name in ROUTES:
+            if not pattern.match(path):
+                continue
+            if name == "full":
+                sub_part = (query.get("subpart") or [None])[0]
+                if sub_part:
+                    return self.directory / f"subpart-{sub_part}.xml"
+                if query.get("part"):
+                    return None
+                with self._lock:
+                    path = self.directory / "title.xml"
+                    return path if path.exists() else write_title_fixture(self.directory)
+            return self.directory / f"{name}.json"
+        return None
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                url = urlparse(self.path)
+                path = server.find_file(url.path, parse_qs(url.query))
+                if server.latency:
+                    time.sleep(server.latency)
+                if path is None or not path.exists():
+                    self.send_error(404)
+                    return
+
+                body = path.read_bytes()
+                content_type = "application/xml" if path.suffix == ".xml" else "application/json"
+                self.send_response(200)
+                self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                chunk_size = 64 * 1024
+                for start in range(0, len(body), chunk_size):
+                    chunk = body[start : start + chunk_size]
+                    self.wfile.write(chunk)
+                    if server.bytes_per_second:
+                        time.sleep(len(chunk) / server.bytes_per_second)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    record = commands.add_parser("record", help="Records the fixtures from eCFR")
+    record.add_argument("--title", type=int, default=42)
+    record.add_argument("--part", type=int, default=482)
+    record.add_argument("--date", help="The eCFR date, the latest if not given")
+    record.add_argument("--output", default=str(DEFAULT_FIXTURES))
+
+    synthetic = commands.add_parser("synthetic", help="Generates Part 482 shaped fixtures")
+    synthetic.add_argument("--output", required=True)
+    synthetic.add_argument("--sections", type=int, default=20)
+    synthetic.add_argument("--paragraphs", type=int, default=4)
+
+    serve = commands.add_parser("serve", help="Serves a fixtures directory")
+    serve.add_argument("--fixtures", default=str(DEFAULT_FIXTURES))
+    serve.add_argument("--latency-ms", type=float, default=0)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record_fixtures(args.output, args.title, args.part, args.date)
+    elif args.command == "synthetic":
+        write_synthetic_fixtures(args.output, args.sections, args.paragraphs)
+    else:
+        with FixtureServer(args.fixtures, args.latency_ms) as server:
+            print("Serving", args.fixtures, "on", server.url)
+            print(f"Run with ECFR_BASE_URL={server.url}")
+            try:
+                threading.Event().wait()
+            except KeyboardInterrupt:
+                pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,550 @@
+"""
+Benchmarks the whole pipeline offline: lambda_handler and main.main download from a local server
+that replays the eCFR fixtures, and write to in-memory S3 and Bedrock stand-ins with the latency
+asked for. It reports the time spent in each stage (fetch, parse, transform, summarize, upload),
+the throughput in sections per second and the peak memory. Each run uses a new process.
+
+The results are printed as JSON, or written with --output, and can be compared with an earlier
+result with --baseline.
+
+Stage times are summed over every thread, so with concurrency they can add up to more than the
+wall time. In the stream parse mode the sub part body is read while it is parsed, so the parse
+stage includes reading it from the network.
+
+Usage:
+    python benchmarks/pipeline.py --runs 3 --bedrock-latency-ms 300 --output before.json
+    python benchmarks/pipeline.py --runs 3 --bedrock-latency-ms 300 --baseline before.json
+"""
+
+import argparse
+import contextlib
+import functools
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+
+BENCHMARKS = Path(__file__).resolve().parent
+REPO_ROOT = BENCHMARKS.parent
+sys.path.insert(0, str(BENCHMARKS))
+
+from cold_start import summarize  # noqa: E402
+from fixtures import DEFAULT_FIXTURES, FixtureServer, write_synthetic_fixtures  # noqa: E402
+
+TARGETS = ("lambda_handler", "main")
+STAGES = ("fetch", "parse", "transform", "summarize", "upload")
+
+# Metrics compared with the baseline, and whether a higher value is better
+COMPARED_METRICS = {
+    "wall_seconds": False,
+    "sections_per_second": True,
+    "peak_rss_mb": False,
+}
+
+
+class StageTimer:
+    """
+    This adds up the time spent in each stage of the pipeline, over all threads. A call made
+    while the thread is already in a stage is counted in that stage only.
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @contextlib.contextmanager
+    def measure(self, stage):
+        if getattr(self._local, "stage", None) is not None:
+            yield
+            return
+        self._local.stage = stage
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self._local.stage = None
+            with self._lock:
+                self.seconds[stage] += elapsed
+                self.calls[stage] += 1
+
+    def wrap(self, stage, func):
+        """
+        This returns func with its calls counted in the stage.
+
+        :param stage: The name of the stage.
+        :param func: The function to time.
+        """
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            with self.measure(stage):
+                return func(*args, **kwargs)
+
+        return timed
+
+    def wrap_iterator(self, stage, func):
+        """
+        This returns func with the time spent producing each item of the iterator it returns
+        counted in the stage, leaving out the time the caller spends on the items.
+
+        :param stage: The name of the stage.
+        :param func: The function that returns an iterator.
+        """
+
+        @functools.wraps(func)
+        def timed(*args, **kwargs):
+            iterator = iter(func(*args, **kwargs))
+            while True:
+                with self.measure(stage):
+                    try:
+                        item = next(iterator)
+                    except StopIteration:
+                        return
+                yield item
+
+        return timed
+
+    def report(self):
+        with self._lock:
+            return {
+                stage: {"seconds": self.seconds[stage], "calls": self.calls[stage]}
+                for stage in STAGES
+                if stage in self.calls
+            }
+
+
+class ModuleProxy:
+    """
+    This stands in for a module in another module's namespace, with some of its functions
+    replaced.
+    """
+
+    def __init__(self, module, **overrides):
+        self._module = module
+        self.__dict__.update(overrides)
+
+    def __getattr__(self, name):
+        return getattr(self._module, name)
+
+
+def rss_mb():
+    """
+    This returns the peak resident memory of the process so far, in MB.
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def bench_lambda_handler(config, timer):
+    """
+    This runs the Lambda handler with the stand-in clients and returns its counters.
+
+    :param config: The child configuration.
+    :param timer: The StageTimer the stages are added to.
+    """
+    import xmltodict
+
+    import lambda_handler
+    import output_bundles
+    import s3_uploader
+    from stand_ins import LocalBedrock, LocalS3
+
+    s3 = LocalS3(config["s3_latency_ms"], config["jitter_ms"])
+    bedrock = LocalBedrock(
+        config["bedrock_latency_ms"],
+        config["jitter_ms"],
+        config["bedrock_throttle_rate"],
+        seed=config["seed"],
+    )
+    lambda_handler._lazy["s3"] = s3
+    lambda_handler._lazy["bedrock"] = bedrock
+
+    for name in ("fetch_title_metadata", "fetch_structure", "fetch_versions", "fetch_sub_part"):
+        setattr(lambda_handler, name, timer.wrap("fetch", getattr(lambda_handler, name)))
+    lambda_handler.iter_response_sections = timer.wrap_iterator(
+        "parse", lambda_handler.iter_response_sections
+    )
+    lambda_handler.xmltodict = ModuleProxy(
+        xmltodict, parse=timer.wrap("parse", xmltodict.parse)
+    )
+    lambda_handler.process_section_content = timer.wrap(
+        "transform", lambda_handler.process_section_content
+    )
+    lambda_handler.invoke_summary = timer.wrap("summarize", lambda_handler.invoke_summary)
+    lambda_handler.extractive_summary = timer.wrap(
+        "summarize", lambda_handler.extractive_summary
+    )
+    s3_uploader.put_if_changed = timer.wrap("upload", s3_uploader.put_if_changed)
+    output_bundles.put_bundle = timer.wrap("upload", output_bundles.put_bundle)
+
+    start = time.perf_counter()
+    response = lambda_handler.lambda_handler(config["event"], None)
+    wall = time.perf_counter() - start
+
+    body = json.loads(response["body"])
+    return wall, {
+        "status_code": response["statusCode"],
+        "error": body.get("error"),
+        "failed_sections": len(body.get("failed_sections", [])),
+        "failed_uploads": len(body.get("failed_uploads", [])),
+        "uploads": body.get("uploads"),
+        "s3_calls": s3.calls,
+        "s3_stored_mb": s3.stored_bytes() / (1024 * 1024),
+        "bedrock_calls": bedrock.calls,
+        "bedrock_throttled": bedrock.throttled,
+        "bedrock_prompt_chars": bedrock.prompt_chars,
+    }
+
+
+def bench_main(config, timer):
+    """
+    This runs main.main, which writes its files to a temporary directory, and returns its
+    counters. With MAIN_WORKERS above 1 (the default is a worker per core) the sections are
+    parsed and transformed in other processes, so only the fetch and upload stages are timed;
+    use --env MAIN_WORKERS=1 to time every stage.
+
+    :param config: The child configuration.
+    :param timer: The StageTimer the stages are added to.
+    """
+    import xmltodict
+
+    import main
+
+    main.cached_get = timer.wrap("fetch", main.cached_get)
+    main.xmltodict = ModuleProxy(xmltodict, parse=timer.wrap("parse", xmltodict.parse))
+    main.process_section_content = timer.wrap("transform", main.process_section_content)
+    # main writes the sections to local files instead of S3
+    main.write_file = timer.wrap("upload", main.write_file)
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        summary = main.main(["--output-dir", directory])
+        wall = time.perf_counter() - start
+        written = sum(1 for _ in (Path(directory) / "processed").iterdir())
+
+    return wall, {
+        "files_written": written,
+        "sections": summary["sections"],
+        "workers": main.MAIN_WORKERS,
+        "failed_sub_parts": len(summary["failed_sub_parts"]),
+    }
+
+
+def run_child(config):
+    """
+    This runs one benchmark in this process and prints its result as the last line.
+
+    :param config: The child configuration made by run_once.
+    """
+    sys.path.insert(0, str(REPO_ROOT))
+    if config["tracemalloc"]:
+        tracemalloc.start()
+    timer = StageTimer()
+
+    rss_before = rss_mb()
+    status = "ok"
+    wall, counters = None, dict()
+    # The pipeline prints a line per section, it would be most of the output
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            if config["target"] == "lambda_handler":
+                wall, counters = bench_lambda_handler(config, timer)
+            else:
+                wall, counters = bench_main(config, timer)
+        except Exception as e:
+            status = f"failed: {e}"
+
+    if counters.get("status_code", 200) != 200:
+        status = f"failed: {counters.get('error')}"
+
+    stages = timer.report()
+    # The transforms of main's worker processes are not timed, it reports its own count
+    sections = counters.get("sections", stages.get("transform", {}).get("calls", 0))
+    result = {
+        "target": config["target"],
+        "status": status,
+        "wall_seconds": wall,
+        "sections": sections,
+        "sections_per_second": sections / wall if wall else None,
+        "stages": stages,
+        "rss_before_run_mb": rss_before,
+        "peak_rss_mb": rss_mb(),
+        "peak_traced_mb": (
+            tracemalloc.get_traced_memory()[1] / (1024 * 1024) if config["tracemalloc"] else None
+        ),
+        "counters": counters,
+    }
+    print(json.dumps(result))
+
+
+def run_once(config, env):
+    """
+    This starts a new interpreter that runs one benchmark, and returns its result.
+
+    :param config: The child configuration.
+    :param env: The environment variables of the child.
+    """
+    result = subprocess.run(
+        [sys.executable, __file__, "--child", json.dumps(config)],
+        cwd=REPO_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    lines = result.stdout.strip().splitlines()
+    if result.returncode != 0 or not lines:
+        return {"target": config["target"], "status": f"crashed: {result.stderr.strip()[-500:]}"}
+    return json.loads(lines[-1])
+
+
+def summarize_runs(runs):
+    """
+    This returns the min, median and max of the metrics of the runs that succeeded.
+
+    :param runs: The results of run_once for one target.
+    """
+    runs = [run for run in runs if run["status"] == "ok"]
+    summary = {
+        "successful_runs": len(runs),
+        "sections": runs[0]["sections"] if runs else None,
+    }
+    for metric in ("wall_seconds", "sections_per_second", "peak_rss_mb", "peak_traced_mb"):
+        summary[metric] = summarize(run.get(metric) for run in runs)
+    summary["stages"] = {
+        stage: {
+            "seconds": summarize(
+                run["stages"][stage]["seconds"] for run in runs if stage in run["stages"]
+            ),
+            "calls": max(run["stages"][stage]["calls"] for run in runs if stage in run["stages"]),
+        }
+        for stage in STAGES
+        if any(stage in run["stages"] for run in runs)
+    }
+    return summary
+
+
+def compare(summary, baseline, tolerance):
+    """
+    This compares the medians of the summary with the ones of the baseline. A metric has
+    regressed if it is worse by more than the tolerance.
+
+    :param summary: The summaries of this benchmark, by target.
+    :param baseline: The summaries of the baseline, by target.
+    :param tolerance: The change allowed before it counts as a regression, e.g. 0.1 for 10%.
+    """
+
+    def change(name, current, before, higher_is_better):
+        if not current or not before:
+            return None
+        ratio = current["median"] / before["median"] if before["median"] else None
+        if ratio is None:
+            return None
+        worse = ratio < 1 - tolerance if higher_is_better else ratio > 1 + tolerance
+        return {
+            "metric": name,
+            "baseline": before["median"],
+            "current": current["median"],
+            "change": ratio - 1,
+            "regression": worse,
+        }
+
+    comparison = dict()
+    for target, current in summary.items():
+        before = baseline.get(target)
+        if before is None:
+            continue
+        changes = [
+            change(name, current.get(name), before.get(name), higher_is_better)
+            for name, higher_is_better in COMPARED_METRICS.items()
+        ]
+        changes += [
+            change(
+                f"stages.{stage}.seconds",
+                current["stages"][stage]["seconds"],
+                before.get("stages", {}).get(stage, {}).get("seconds"),
+                False,
+            )
+            for stage in current["stages"]
+        ]
+        comparison[target] = [c for c in changes if c is not None]
+    return comparison
+
+
+def prepare_fixtures(path, synthetic_sections, require_recorded=False):
+    """
+    This returns the fixtures directory to serve and its fixture.json. If the recorded fixtures
+    are missing, synthetic ones are generated in a temporary directory, unless require_recorded
+    is set.
+
+    :param path: The fixtures directory asked for.
+    :param synthetic_sections: The number of sections of an average synthetic sub part.
+    :param require_recorded: Whether to stop instead of using synthetic fixtures.
+    """
+    path = Path(path)
+    if not (path / "titles.json").exists():
+        if require_recorded:
+            raise SystemExit(
+                f"No recorded fixtures in {path}. "
+                "Record them with: python benchmarks/fixtures.py record"
+            )
+        print(
+            f"No fixtures in {path}, using synthetic fixtures. "
+            "Record real ones with: python benchmarks/fixtures.py record",
+            file=sys.stderr,
+        )
+        path = Path(tempfile.mkdtemp(prefix="ecfr-fixtures-"))
+        write_synthetic_fixtures(path, synthetic_sections)
+
+    info = dict()
+    if (path / "fixture.json").exists():
+        info = json.loads((path / "fixture.json").read_text())
+    return path, dict(info, path=str(path))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    parser.add_argument("--target", choices=TARGETS + ("all",), default="all")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--event", default="{}", help="JSON event for lambda_handler")
+    parser.add_argument("--fixtures", default=str(DEFAULT_FIXTURES))
+    parser.add_argument(
+        "--synthetic-sections",
+        type=int,
+        default=20,
+        help="Sections of an average sub part when the fixtures are generated",
+    )
+    parser.add_argument(
+        "--require-recorded",
+        action="store_true",
+        help="Exits instead of falling back to synthetic fixtures",
+    )
+    parser.add_argument("--ecfr-latency-ms", type=float, default=0)
+    parser.add_argument("--s3-latency-ms", type=float, default=0)
+    parser.add_argument("--bedrock-latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--bedrock-throttle-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        help="KEY=VALUE environment variable of the pipeline, e.g. PARSE_MODE=full",
+    )
+    parser.add_argument(
+        "--tracemalloc",
+        action="store_true",
+        help="Also measure the peak Python heap, it slows the run down",
+    )
+    parser.add_argument("--output", help="Writes the result JSON to this file")
+    parser.add_argument("--baseline", help="A result JSON to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    parser.add_argument(
+        "--fail-on-regression",
+        action="store_true",
+        help="Exits with status 1 if a metric regressed against the baseline",
+    )
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(json.loads(args.child))
+        return
+
+    fixtures, fixture_info = prepare_fixtures(
+        args.fixtures, args.synthetic_sections, args.require_recorded
+    )
+    targets = TARGETS if args.target == "all" else (args.target,)
+    config = {
+        "event": json.loads(args.event),
+        "s3_latency_ms": args.s3_latency_ms,
+        "bedrock_latency_ms": args.bedrock_latency_ms,
+        "jitter_ms": args.jitter_ms,
+        "bedrock_throttle_rate": args.bedrock_throttle_rate,
+        "seed": args.seed,
+        "tracemalloc": args.tracemalloc,
+    }
+    pipeline_env = dict(arg.split("=", 1) for arg in args.env)
+
+    results = dict()
+    with FixtureServer(fixtures, args.ecfr_latency_ms) as server:
+        env = dict(
+            os.environ,
+            PYTHONDONTWRITEBYTECODE="1",
+            AWS_DEFAULT_REGION=os.environ.get("AWS_DEFAULT_REGION", "us-east-1"),
+            ECFR_BASE_URL=server.url,
+            # Every run downloads and summarizes everything
+            HTTP_CACHE="off",
+            SUMMARY_CACHE="off",
+            # The fixture server gets the concurrency limit of ecfr.gov
+            HOST_CONCURRENCY="127.0.0.1=4,bedrock-runtime=16",
+        )
+        env.update(pipeline_env)
+        for target in targets:
+            runs = []
+            for run in range(args.runs):
+                print(f"Running {target} {run + 1}/{args.runs}", file=sys.stderr)
+                # ECFR_SOURCE=title downloads the title again on every run too
+                with tempfile.TemporaryDirectory() as titles:
+                    runs.append(
+                        run_once(dict(config, target=target), dict(env, TITLE_CACHE_DIR=titles))
+                    )
+            results[target] = {"summary": summarize_runs(runs), "runs": runs}
+
+    output = {
+        "created": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "fixtures": fixture_info,
+        "config": dict(config, runs=args.runs, ecfr_latency_ms=args.ecfr_latency_ms, env=pipeline_env),
+        "results": results,
+    }
+
+    regressed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        output["baseline"] = {"path": args.baseline, "created": baseline.get("created")}
+        # Synthetic and recorded fixtures, or two recordings, don't make comparable timings
+        baseline_fixtures = baseline.get("fixtures", {})
+        if any(baseline_fixtures.get(name) != fixture_info.get(name) for name in ("source", "date")):
+            output["baseline"]["fixtures_differ"] = True
+            print(
+                "The baseline ran on other fixtures:",
+                baseline_fixtures.get("source"),
+                baseline_fixtures.get("date"),
+                file=sys.stderr,
+            )
+        output["comparison"] = compare(
+            {target: result["summary"] for target, result in results.items()},
+            {target: result["summary"] for target, result in baseline["results"].items()},
+            args.tolerance,
+        )
+        regressed = any(c["regression"] for changes in output["comparison"].values() for c in changes)
+
+    text = json.dumps(output, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+    if regressed and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
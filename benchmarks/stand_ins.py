@@ -0,0 +1,174 @@
+"""
+In-memory stand-ins for the boto3 S3 and Bedrock runtime clients, with the methods the pipeline
+calls. Each call waits a configurable latency, so a benchmark can run with the delays of the real
+services without reaching them.
+"""
+
+import io
+import json
+import random
+import threading
+import time
+from types import SimpleNamespace
+
+from botocore.exceptions import ClientError
+
+
+class NoSuchKey(ClientError):
+    """
+    This is raised by get_object for a missing key, like the boto3 S3 client's exception.
+    """
+
+    def __init__(self, key):
+        super().__init__(
+            {"Error": {"Code": "NoSuchKey", "Message": f"{key} does not exist"}}, "GetObject"
+        )
+
+
+def wait(latency_ms, jitter_ms=0):
+    """
+    This sleeps for the latency, plus a random part up to the jitter.
+
+    :param latency_ms: The fixed part of the delay in milliseconds.
+    :param jitter_ms: The largest random part of the delay in milliseconds.
+    """
+    delay = latency_ms + (random.uniform(0, jitter_ms) if jitter_ms else 0)
+    if delay > 0:
+        time.sleep(delay / 1000)
+
+
+class LocalS3:
+    """
+    This keeps objects in memory, with their metadata, and counts the calls made to it.
+    """
+
+    def __init__(self, latency_ms=0, jitter_ms=0):
+        """
+        :param latency_ms: The time every call takes.
+        :param jitter_ms: The largest random time added to a call.
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.exceptions = SimpleNamespace(NoSuchKey=NoSuchKey)
+        self.objects = dict()
+        self.calls = dict()
+        self._lock = threading.Lock()
+
+    def _call(self, name):
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        wait(self.latency_ms, self.jitter_ms)
+
+    def put_object(self, Bucket, Key, Body, Metadata=None, ContentType=None, **kwargs):
+        self._call("put_object")
+        if isinstance(Body, str):
+            Body = Body.encode("utf-8")
+        elif hasattr(Body, "read"):
+            Body = Body.read()
+        with self._lock:
+            self.objects[(Bucket, Key)] = (bytes(Body), dict(Metadata or {}), ContentType)
+        return {}
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, ExtraArgs=None):
+        extra_args = ExtraArgs or {}
+        self.put_object(
+            Bucket,
+            Key,
+            Fileobj.read(),
+            extra_args.get("Metadata"),
+            extra_args.get("ContentType"),
+        )
+
+    def get_object(self, Bucket, Key, **kwargs):
+        self._call("get_object")
+        with self._lock:
+            stored = self.objects.get((Bucket, Key))
+        if stored is None:
+            raise NoSuchKey(Key)
+        body, metadata, content_type = stored
+        return {
+            "Body": io.BytesIO(body),
+            "Metadata": metadata,
+            "ContentType": content_type,
+            "ContentLength": len(body),
+        }
+
+    def head_object(self, Bucket, Key, **kwargs):
+        self._call("head_object")
+        with self._lock:
+            stored = self.objects.get((Bucket, Key))
+        if stored is None:
+            raise ClientError({"Error": {"Code": "404", "Message": "Not Found"}}, "HeadObject")
+        return {"Metadata": stored[1], "ContentLength": len(stored[0])}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self._call("delete_object")
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def stored_bytes(self):
+        """
+        This returns the total size of the objects that are stored.
+        """
+        with self._lock:
+            return sum(len(body) for body, _, _ in self.objects.values())
+
+
+class LocalBedrock:
+    """
+    This answers invoke_model with a short description made from the prompt, like the Titan
+    text models. A share of the calls can be throttled to exercise the retries.
+    """
+
+    def __init__(self, latency_ms=0, jitter_ms=0, throttle_rate=0.0, seed=None):
+        """
+        :param latency_ms: The time every call takes.
+        :param jitter_ms: The largest random time added to a call.
+        :param throttle_rate: The share of calls, from 0 to 1, that raise ThrottlingException.
+        :param seed: The seed of the random throttling, so runs can be repeated.
+        """
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self.meta = SimpleNamespace(endpoint_url="https://bedrock-runtime.local")
+        self.calls = 0
+        self.throttled = 0
+        self.prompt_chars = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def invoke_model(self, body, modelId, accept=None, contentType=None, **kwargs):
+        request = json.loads(body)
+        prompt = request.get("inputText", "")
+        with self._lock:
+            self.calls += 1
+            self.prompt_chars += len(prompt)
+            throttled = self._random.random() < self.throttle_rate
+            if throttled:
+                self.throttled += 1
+        wait(self.latency_ms, self.jitter_ms)
+        if throttled:
+            raise ClientError(
+                {"Error": {"Code": "ThrottlingException", "Message": "Rate exceeded"}},
+                "InvokeModel",
+            )
+
+        output = f"Summary of {len(prompt)} characters of section data."
+        return {
+            "body": io.BytesIO(
+                json.dumps(
+                    {
+                        "inputTextTokenCount": len(prompt) // 4,
+                        "results": [
+                            {
+                                "tokenCount": len(output) // 4,
+                                "outputText": output,
+                                "completionReason": "FINISH",
+                            }
+                        ],
+                    }
+                ).encode("utf-8")
+            ),
+            "contentType": "application/json",
+        }
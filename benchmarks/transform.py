@@ -0,0 +1,190 @@
+"""
+Measures the per-section transform: serializing the section for the prompt and the manifest hash,
+building the processed document, and serializing it for S3. It compares the old path, which deep
+copied every section with a JSON round trip and serialized the section and the document twice,
+with the current one. Time and peak memory are printed as JSON.
+
+Usage: python benchmarks/transform.py --section 482.12 --xml title-42-part-482.xml
+"""
+
+import argparse
+import contextlib
+import hashlib
+import io
+import json
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import requests
+import xmltodict
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import lambda_handler  # noqa: E402
+from run_manifest import section_content_hash  # noqa: E402
+from s3_uploader import VOLATILE_METADATA, document_hash  # noqa: E402
+
+
+def find_section(node, section_id):
+    """
+    This returns the DIV8 of a section from anywhere in the parsed XML, or None.
+
+    :param node: The parsed XML, or a part of it.
+    :param section_id: The section number, e.g. 482.12.
+    """
+    if isinstance(node, list):
+        for item in node:
+            found = find_section(item, section_id)
+            if found is not None:
+                return found
+    elif isinstance(node, dict):
+        if node.get("@TYPE") == "SECTION" and node.get("@N") == section_id:
+            return node
+        for value in node.values():
+            found = find_section(value, section_id)
+            if found is not None:
+                return found
+    return None
+
+
+def load_section(section_id, xml_path=None, date=None):
+    """
+    This loads a section from a local eCFR XML file, or from the eCFR API.
+
+    :param section_id: The section number, e.g. 482.12.
+    :param xml_path: A local XML file of the title, part or sub part.
+    :param date: The date of the version to fetch, the latest if None.
+    """
+    if xml_path:
+        with open(xml_path, "rb") as f:
+            data = xmltodict.parse(f)
+    else:
+        date = date or lambda_handler.fetch_title_metadata()["up_to_date_as_of"]
+        response = requests.get(
+            f"{lambda_handler.ECFR_BASE_URL}/full/{date}/title-{lambda_handler.TITLE}.xml",
+            params={"part": lambda_handler.PART, "section": section_id},
+            timeout=60,
+        )
+        response.raise_for_status()
+        data = xmltodict.parse(response.content)
+
+    section = find_section(data, section_id)
+    if section is None:
+        raise SystemExit(f"Section {section_id} was not found")
+    return section
+
+
+def build_document(section):
+    """
+    This builds the processed document of a section the way the handler does.
+
+    :param section: The JSON section.
+    """
+    with contextlib.redirect_stdout(io.StringIO()):
+        return lambda_handler.process_section_content(
+            "Hospital",
+            "PART 482",
+            "42",
+            "2025-10-01",
+            "2025-10-01",
+            "",
+            "https://www.ecfr.gov",
+            "A",
+            "General Provisions",
+            section,
+            "description",
+        )
+
+
+def legacy_transform(section):
+    """
+    This is the old path: a JSON round trip copy of the section, a separate sorted serialization
+    for each hash, and the document serialized again for its hash.
+
+    :param section: The JSON section.
+    """
+    prompt_text = json.dumps(section)
+    content_hash = hashlib.sha256(
+        json.dumps(section, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    section_copy = json.loads(json.dumps(section, ensure_ascii=False))
+    document = build_document(section_copy)
+    body = json.dumps(document, ensure_ascii=False, indent=2)
+    stable = dict(document)
+    stable["metadata"] = {
+        name: value
+        for name, value in document["metadata"].items()
+        if name not in VOLATILE_METADATA
+    }
+    body_hash = hashlib.sha256(
+        json.dumps(stable, ensure_ascii=False, sort_keys=True).encode("utf-8")
+    ).hexdigest()
+    return prompt_text, content_hash, body, body_hash
+
+
+def current_transform(section):
+    """
+    This is the current path: the section is serialized once and the document once.
+
+    :param section: The JSON section.
+    """
+    prompt_text = json.dumps(section)
+    content_hash = section_content_hash(prompt_text)
+    document = build_document(section)
+    body = json.dumps(document, ensure_ascii=False, indent=2)
+    return prompt_text, content_hash, body, document_hash(body, document)
+
+
+def measure(transform, section, iterations):
+    """
+    This returns the mean seconds per call and the peak memory of one call of a transform.
+
+    :param transform: The transform function.
+    :param section: The JSON section.
+    :param iterations: The number of calls that are timed.
+    """
+    transform(section)
+    start = time.perf_counter()
+    for _ in range(iterations):
+        transform(section)
+    seconds = (time.perf_counter() - start) / iterations
+
+    tracemalloc.start()
+    transform(section)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"seconds_per_call": seconds, "peak_bytes": peak}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--section", default="482.12")
+    parser.add_argument("--xml", help="Local eCFR XML file instead of fetching the section")
+    parser.add_argument("--date", help="Version date to fetch, the latest if not given")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    section = load_section(args.section, args.xml, args.date)
+    legacy = measure(legacy_transform, section, args.iterations)
+    current = measure(current_transform, section, args.iterations)
+    print(
+        json.dumps(
+            {
+                "section": args.section,
+                "section_bytes": len(json.dumps(section)),
+                "iterations": args.iterations,
+                "legacy": legacy,
+                "current": current,
+                "speedup": legacy["seconds_per_call"] / current["seconds_per_call"],
+                "peak_bytes_saved": legacy["peak_bytes"] - current["peak_bytes"],
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
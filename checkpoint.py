@@ -0,0 +1,170 @@
+import json
+import time
+
+
+class Deadline:
+    """
+    This watches the time left in a Lambda invocation, so a run can stop cleanly before the
+    timeout instead of being killed in the middle of a section.
+    """
+
+    def __init__(self, context, margin_seconds, stop_at=None):
+        """
+        :param context: The Lambda context, or None when there is no timeout.
+        :param margin_seconds: How many seconds before the timeout the run stops taking new work,
+            enough to finish the sections in flight and save the checkpoint.
+        :param stop_at: The time.time() the run must be done by even if its own timeout is later,
+            e.g. when the orchestrator that invoked a worker stops waiting for it, or None.
+        """
+        self.context = context
+        self.margin_seconds = margin_seconds
+        self.stop_at = stop_at
+        self.reached = False
+
+    def remaining_seconds(self):
+        """
+        This returns the seconds left before the timeout or stop_at, or None if there is neither.
+        """
+        remaining = None
+        if self.context is not None and hasattr(self.context, "get_remaining_time_in_millis"):
+            remaining = self.context.get_remaining_time_in_millis() / 1000
+        if self.stop_at is not None:
+            until_stop = self.stop_at - time.time()
+            remaining = until_stop if remaining is None else min(remaining, until_stop)
+        return remaining
+
+    def near_at(self):
+        """
+        This returns the time.time() at which the deadline is near, or None if there is no
+        timeout. It is the stop_at of the workers an orchestrator starts, so they are done when
+        it stops waiting for them.
+        """
+        remaining = self.remaining_seconds()
+        if remaining is None:
+            return None
+        return time.time() + remaining - self.margin_seconds
+
+    def wait_seconds(self):
+        """
+        This returns the seconds until the deadline is near, at least 0, or None if there is no
+        timeout.
+        """
+        remaining = self.remaining_seconds()
+        if remaining is None:
+            return None
+        return max(remaining - self.margin_seconds, 0.0)
+
+    def near(self):
+        """
+        This tells if the run should stop taking new work. Once it is near it stays near.
+        """
+        if not self.reached:
+            remaining = self.remaining_seconds()
+            self.reached = remaining is not None and remaining < self.margin_seconds
+        return self.reached
+
+
+def until_deadline(items, deadline):
+    """
+    This yields the items until the deadline is near.
+
+    :param items: The items to go through.
+    :param deadline: The Deadline of the invocation, or None to yield them all.
+    """
+    for item in items:
+        if deadline is not None and deadline.near():
+            return
+        yield item
+
+
+class RunCheckpoint:
+    """
+    This records the progress of a run that stopped before the Lambda timeout: the part and the
+    titles.json metadata it was started with, the sub parts still to do, the sections already
+    processed in them, and what the finished invocations reported. The next invocation resumes
+    from it.
+    """
+
+    def __init__(
+        self,
+        target=None,
+        sub_parts=None,
+        sections=None,
+        summary=None,
+        removed_sections=None,
+        continuations=0,
+    ):
+        """
+        :param target: The CrawlTarget of the part as a dict, its metadata pins the eCFR date
+            for every invocation.
+        :param sub_parts: The sub part letters that are not finished yet.
+        :param sections: A dict of section id to its hash, key and sub part, for the sections
+            already processed in the unfinished sub parts.
+        :param summary: The failed sections, failed uploads, failed units, upload counts, bundles
+            and batch records so far.
+        :param removed_sections: The ids of the sections removed so far.
+        :param continuations: How many times the run has been continued.
+        """
+        self.target = target
+        self.sub_parts = sub_parts or []
+        self.sections = sections or dict()
+        self.summary = summary or {
+            "failed_sections": [],
+            "failed_uploads": [],
+            "uploads": {"written": 0, "skipped": 0, "failed": 0},
+            "bundles": [],
+            "failed_units": [],
+            "batch_records": 0,
+        }
+        self.removed_sections = removed_sections or []
+        self.continuations = continuations
+
+    @classmethod
+    def load(cls, s3, bucket, key):
+        """
+        This reads the checkpoint from S3, or returns None if there is none.
+
+        :param s3: The boto3 S3 client.
+        :param bucket: The bucket the checkpoint is stored in.
+        :param key: The key of the checkpoint object.
+        """
+        try:
+            response = s3.get_object(Bucket=bucket, Key=key)
+        except s3.exceptions.NoSuchKey:
+            return None
+        return cls(**json.loads(response["Body"].read()))
+
+    def save(self, s3, bucket, key):
+        """
+        This writes the checkpoint to S3.
+
+        :param s3: The boto3 S3 client.
+        :param bucket: The bucket the checkpoint is stored in.
+        :param key: The key of the checkpoint object.
+        """
+        s3.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=json.dumps(
+                {
+                    "target": self.target,
+                    "sub_parts": self.sub_parts,
+                    "sections": self.sections,
+                    "summary": self.summary,
+                    "removed_sections": self.removed_sections,
+                    "continuations": self.continuations,
+                }
+            ),
+            ContentType="application/json",
+        )
+
+    @staticmethod
+    def delete(s3, bucket, key):
+        """
+        This deletes the checkpoint once the run is finished.
+
+        :param s3: The boto3 S3 client.
+        :param bucket: The bucket the checkpoint is stored in.
+        :param key: The key of the checkpoint object.
+        """
+        s3.delete_object(Bucket=bucket, Key=key)
@@ -0,0 +1,204 @@
+import argparse
+import json
+import threading
+from contextlib import nullcontext
+from urllib.parse import urlparse
+
+
+class CrawlTarget:
+    """
+    This is one CFR part to crawl: its title and part numbers, the sub parts to process, the
+    titles.json metadata of the title and the size of each sub part, used to order the work.
+    """
+
+    def __init__(self, title, part, sub_parts, metadata=None, sizes=None):
+        """
+        :param title: The title number, e.g. 42.
+        :param part: The part number, e.g. 482.
+        :param sub_parts: The sub part letters to process, in order.
+        :param metadata: The titles.json entry of the title, it pins the eCFR date of the crawl.
+        :param sizes: A dict of sub part letter to its size in the eCFR structure.
+        """
+        self.title = int(title)
+        self.part = str(part)
+        self.sub_parts = list(sub_parts)
+        self.metadata = metadata
+        self.sizes = sizes or dict()
+
+    @property
+    def name(self):
+        """
+        This returns the name of the target, e.g. title-42/part-482.
+        """
+        return f"title-{self.title}/part-{self.part}"
+
+    def to_dict(self):
+        """
+        This returns the target as a dict that can be sent in an event.
+        """
+        return {
+            "title": self.title,
+            "part": self.part,
+            "sub_parts": self.sub_parts,
+            "metadata": self.metadata,
+            "sizes": self.sizes,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        This creates a target from the dict to_dict returned.
+
+        :param data: The dict of the target.
+        """
+        return cls(**data)
+
+
+def parse_crawl_request(entries):
+    """
+    This reads the "crawl" list of an event. Each entry has a title and a part or a list of
+    parts, and optionally the sub parts to limit the crawl to. It returns (title, part,
+    sub_parts) tuples, one per part, sub_parts is None when every sub part is crawled.
+
+    :param entries: The crawl entries, e.g. [{"title": 42, "parts": [482, 483]}].
+    """
+    wanted = dict()
+    for entry in entries:
+        parts = entry.get("parts") or [entry["part"]]
+        for part in parts:
+            key = (int(entry["title"]), str(part))
+            sub_parts = entry.get("sub_parts")
+            # A part listed twice is crawled once, with the sub parts of both entries
+            if key in wanted and (wanted[key] is None or sub_parts is None):
+                wanted[key] = None
+            elif key in wanted:
+                wanted[key] = wanted[key] + [s for s in sub_parts if s not in wanted[key]]
+            else:
+                wanted[key] = list(sub_parts) if sub_parts else None
+    return [(title, part, sub_parts) for (title, part), sub_parts in wanted.items()]
+
+
+def find_part(node, part):
+    """
+    This returns the node of a part in the eCFR structure of a title, or None.
+
+    :param node: The structure JSON of the title, or a node of it.
+    :param part: The part number.
+    """
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.get("type") == "part" and node.get("identifier") == str(part):
+            return node
+        stack.extend(node.get("children") or [])
+    return None
+
+
+def node_size(node):
+    """
+    This returns the size of a structure node, or the number of sections under it when the
+    structure has no sizes.
+
+    :param node: The structure node.
+    """
+    if node.get("size"):
+        return node["size"]
+    count = 0
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node.get("type") == "section":
+            count += 1
+        stack.extend(node.get("children") or [])
+    return count
+
+
+def discover_sub_parts(part_node):
+    """
+    This returns a dict of the sub parts of a part to their size, in document order.
+    Reserved sub parts have no sections and are left out.
+
+    :param part_node: The structure node of the part.
+    """
+    return {
+        child["identifier"]: node_size(child)
+        for child in part_node.get("children") or []
+        if child.get("type") == "subpart" and not child.get("reserved")
+    }
+
+
+def schedule_jobs(work):
+    """
+    This returns every (target, sub part) of the crawl, largest first, so the long jobs start
+    early and the small ones fill the gaps at the end.
+
+    :param work: (target, sub_parts) tuples, the CrawlTargets and the sub parts to process.
+    """
+    jobs = [(target, sub_part) for target, sub_parts in work for sub_part in sub_parts]
+    return sorted(jobs, key=lambda job: job[0].sizes.get(job[1], 0), reverse=True)
+
+
+class HostLimits:
+    """
+    This limits how many requests go to each host at the same time, shared by every worker of
+    the process.
+    """
+
+    def __init__(self, limits):
+        """
+        :param limits: A dict of host name, or the start of one, to its maximum concurrency.
+        """
+        self._semaphores = {
+            host: threading.BoundedSemaphore(max(int(limit), 1))
+            for host, limit in limits.items()
+        }
+
+    @classmethod
+    def from_string(cls, text):
+        """
+        This creates the limits from a string like "www.ecfr.gov=4,bedrock-runtime=16".
+
+        :param text: The comma separated host=limit pairs.
+        """
+        limits = dict()
+        for pair in text.split(","):
+            if "=" in pair:
+                host, limit = pair.split("=", 1)
+                limits[host.strip()] = limit
+        return cls(limits)
+
+    def slot(self, url_or_host):
+        """
+        This returns a context manager that holds one request slot of the host.
+
+        :param url_or_host: The URL of the request, or its host.
+        """
+        host = urlparse(url_or_host).netloc or url_or_host
+        for name, semaphore in self._semaphores.items():
+            if host.startswith(name):
+                return semaphore
+        return nullcontext()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Crawls CFR parts locally with the Lambda handler."
+    )
+    parser.add_argument("--title", type=int, default=42)
+    parser.add_argument("--part", action="append", required=True, help="Can be repeated")
+    parser.add_argument("--sub-part", action="append", help="Limits the crawl to these sub parts")
+    parser.add_argument("--incremental", action="store_true")
+    args = parser.parse_args()
+
+    import lambda_handler
+
+    event = {
+        "crawl": [{"title": args.title, "parts": args.part, "sub_parts": args.sub_part}],
+        "incremental": args.incremental,
+    }
+    response = lambda_handler.lambda_handler(event, None)
+    print(json.dumps(json.loads(response["body"]), indent=2))
+
+
+if __name__ == "__main__":
+    main()
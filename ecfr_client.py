@@ -0,0 +1,385 @@
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import requests
+
+# Answers that are retried, eCFR sends 429 when it is asked too often and 5xx when it is busy
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# Errors of a request that never got an answer or whose body broke off, they are retried too
+RETRYABLE_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+
+# The headers that must not change for a body that broke off to be picked up where it stopped
+BODY_VERSION_HEADERS = ("ETag", "Last-Modified", "Content-Length")
+
+# The headers that tell the version of a body, one of them is needed to pick it up again
+BODY_VALIDATORS = ("ETag", "Last-Modified")
+
+
+def retry_after_seconds(response):
+    """
+    This returns the seconds a Retry-After header asks to wait, or None if there is none. The
+    header is a number of seconds or an HTTP date.
+
+    :param response: The requests response.
+    """
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max((date - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+
+def same_body(first, second):
+    """
+    This tells whether a new answer has the same body as the first one, so a body that broke
+    off can be read on from the new one: both are 200 and have the same BODY_VERSION_HEADERS.
+    Without an ETag or a Last-Modified nothing tells the two bodies are the same, so it is
+    False.
+
+    :param first: The response whose body broke off.
+    :param second: The response of the request sent again.
+    """
+    if second.status_code != 200:
+        return False
+    if not any(first.headers.get(name) for name in BODY_VALIDATORS):
+        return False
+    return all(first.headers.get(name) == second.headers.get(name) for name in BODY_VERSION_HEADERS)
+
+
+class LatencyStats:
+    """
+    This keeps the latencies of the last requests, the time until the answer's headers came, to
+    tell how slow a request is compared to the others. It also counts the retries and hedged
+    requests. Shared by the threads of the process.
+    """
+
+    def __init__(self, window=200):
+        """
+        :param window: How many of the last latencies are kept.
+        """
+        self._latencies = deque(maxlen=max(window, 1))
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.retries = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+
+    def add(self, milliseconds):
+        with self._lock:
+            self._latencies.append(milliseconds)
+
+    def count(self, name, value=1):
+        """
+        This adds to one of the counts: requests, errors, retries, hedged or hedge_wins.
+
+        :param name: The name of the count.
+        :param value: The number to add.
+        """
+        with self._lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def percentile(self, fraction, min_samples=1):
+        """
+        This returns the latency in milliseconds a fraction of the kept ones are below, or None
+        if fewer than min_samples are kept.
+
+        :param fraction: The percentile as a fraction, e.g. 0.95.
+        :param min_samples: The fewest latencies the percentile is taken from.
+        """
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies or len(latencies) < min_samples:
+            return None
+        index = min(int(fraction * len(latencies)), len(latencies) - 1)
+        return latencies[index]
+
+    def to_dict(self):
+        """
+        This returns the counts and the p50, p90 and p99 of the kept latencies.
+        """
+        with self._lock:
+            counts = {
+                "requests": self.requests,
+                "errors": self.errors,
+                "retries": self.retries,
+                "hedged": self.hedged,
+                "hedge_wins": self.hedge_wins,
+                "samples": len(self._latencies),
+            }
+        for name, fraction in (("p50_ms", 0.5), ("p90_ms", 0.9), ("p99_ms", 0.99)):
+            counts[name] = self.percentile(fraction)
+        return counts
+
+
+class EcfrClient:
+    """
+    This sends the GET requests to eCFR with connect and read timeouts, so a hung response
+    fails instead of stalling the run. Connection errors, timeouts, 429 and 5xx answers are
+    retried with full jitter exponential backoff, and a 429 or 503 waits what its Retry-After
+    asks for. With hedge_percentile, a request with no answer after that percentile of the recent
+    latencies gets a second, identical request, and whichever answers first is used. A body
+    that breaks off or times out while it is read is retried too, see read_body.
+
+    It has the get of a requests session, so it can be given to cached_get.
+    """
+
+    def __init__(
+        self,
+        session=None,
+        connect_timeout=5.0,
+        read_timeout=60.0,
+        max_retries=4,
+        backoff_seconds=0.5,
+        max_wait_seconds=30.0,
+        hedge_percentile=None,
+        hedge_max_fraction=0.1,
+        hedge_min_samples=20,
+        stats=None,
+        observer=None,
+    ):
+        """
+        :param session: The requests session to send with, a new one if None.
+        :param connect_timeout: The seconds to wait for the connection.
+        :param read_timeout: The seconds to wait for the answer, and between two reads of it.
+        :param max_retries: How many times a failed request is retried.
+        :param backoff_seconds: The backoff before the first retry, doubled for every retry.
+        :param max_wait_seconds: The longest wait between two attempts, also for Retry-After.
+        :param hedge_percentile: The percentile of the recent latencies after which a second
+            request is sent, e.g. 0.95, or None to never send one.
+        :param hedge_max_fraction: The largest part of the requests that may be hedged, so a
+            slow eCFR doesn't get twice the requests.
+        :param hedge_min_samples: How many latencies are needed before a request is hedged.
+        :param stats: The LatencyStats the requests are added to, shared by every client of the
+            process so the percentiles outlive the client. A new one if None.
+        :param observer: A function called after every request with the milliseconds, the status
+            code (None if there was no answer), the attempt (0 for the first) and whether it was
+            a hedged request, e.g. to add it to the metrics.
+        """
+        self.session = session if session is not None else requests.Session()
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max(max_retries, 0)
+        self.backoff_seconds = backoff_seconds
+        self.max_wait_seconds = max_wait_seconds
+        self.hedge_percentile = hedge_percentile
+        self.hedge_max_fraction = hedge_max_fraction
+        self.hedge_min_samples = hedge_min_samples
+        self.stats = stats if stats is not None else LatencyStats()
+        self.observer = observer
+        self._hedge_executor = None
+        self._hedge_lock = threading.Lock()
+
+    def get(self, url, headers=None, stream=False, **kwargs):
+        """
+        This sends a GET request, retrying it if it fails. The last answer is returned even if
+        it is an error status, so the caller's raise_for_status raises it; the error of the last
+        attempt is raised if there was no answer. The response has the number of attempts it
+        took in attempts. Without stream the body is read with the answer, so it is retried with
+        it; with stream, the iter_content of a 200 answer is read_body, which also covers its
+        content, text and json.
+
+        :param url: The URL to get.
+        :param headers: The request headers.
+        :param stream: Whether the body is read later in chunks, as in requests.
+        :param kwargs: Other arguments of requests' get.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        response = self._get(url, headers, stream, kwargs)
+        if stream and response.status_code == 200:
+            read = response.iter_content
+            response.iter_content = lambda chunk_size=1, decode_unicode=False: self.read_body(
+                url, headers, kwargs, response, read, chunk_size, decode_unicode
+            )
+        return response
+
+    def _get(self, url, headers, stream, kwargs):
+        """
+        This sends a GET request until it gets an answer that isn't retried, see get.
+        """
+        attempt = 0
+        while True:
+            response = None
+            try:
+                response = self._send(url, headers, stream, kwargs, attempt)
+                retry = response.status_code in RETRYABLE_STATUSES
+            except RETRYABLE_ERRORS:
+                retry = True
+                if attempt >= self.max_retries:
+                    raise
+            if not retry or attempt >= self.max_retries:
+                response.attempts = attempt + 1
+                return response
+
+            wait_seconds = random.uniform(0, self.backoff_seconds * 2**attempt)
+            if response is not None:
+                if response.status_code in (429, 503):
+                    wait_seconds = retry_after_seconds(response) or wait_seconds
+                response.close()
+            time.sleep(min(wait_seconds, self.max_wait_seconds))
+            attempt += 1
+            self.stats.count("retries")
+
+    def read_body(self, url, headers, kwargs, response, read, chunk_size=1, decode_unicode=False):
+        """
+        This reads the body of a streamed answer in chunks, as requests' iter_content does. If
+        the connection breaks or times out while it is read, the request is sent again after a
+        backoff, up to max_retries times, and the bytes already read are skipped. The new answer
+        is only read on if same_body says it is the same body, otherwise the error is raised.
+
+        :param url: The URL of the request.
+        :param headers: The request headers.
+        :param kwargs: Other arguments of requests' get, with the timeout.
+        :param response: The streamed response.
+        :param read: The iter_content of the response.
+        :param chunk_size: The bytes of a chunk.
+        :param decode_unicode: Whether the chunks are decoded to text, as in requests.
+        """
+        chunks = self._read_chunks(url, headers, kwargs, response, read, chunk_size)
+        if decode_unicode:
+            return requests.utils.stream_decode_response_unicode(chunks, response)
+        return chunks
+
+    def _read_chunks(self, url, headers, kwargs, response, read, chunk_size):
+        current = response
+        position = 0
+        attempt = 0
+        try:
+            while True:
+                skip = position
+                try:
+                    for chunk in read(chunk_size):
+                        if skip >= len(chunk):
+                            skip -= len(chunk)
+                            continue
+                        chunk = chunk[skip:]
+                        skip = 0
+                        position += len(chunk)
+                        yield chunk
+                    return
+                except RETRYABLE_ERRORS:
+                    if attempt >= self.max_retries:
+                        raise
+                    current.close()
+                    wait_seconds = random.uniform(0, self.backoff_seconds * 2**attempt)
+                    time.sleep(min(wait_seconds, self.max_wait_seconds))
+                    attempt += 1
+                    self.stats.count("retries")
+                    current = self._get(url, headers, True, kwargs)
+                    if not same_body(response, current):
+                        raise
+                    read = current.iter_content
+        finally:
+            if current is not response:
+                current.close()
+
+    def _request(self, url, headers, stream, kwargs, attempt, hedged=False):
+        """
+        This sends one request and measures it.
+        """
+        start = time.perf_counter()
+        status = None
+        try:
+            response = self.session.get(url, headers=headers, stream=stream, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            milliseconds = (time.perf_counter() - start) * 1000
+            self.stats.count("requests")
+            if status is None or status >= 500:
+                self.stats.count("errors")
+            else:
+                self.stats.add(milliseconds)
+            if self.observer is not None:
+                self.observer(milliseconds, status, attempt, hedged)
+
+    def hedge_after(self):
+        """
+        This returns the seconds after which a request gets a second one, or None if it
+        shouldn't.
+        """
+        if self.hedge_percentile is None:
+            return None
+        if self.stats.hedged >= self.hedge_max_fraction * max(self.stats.requests, 1):
+            return None
+        threshold = self.stats.percentile(self.hedge_percentile, self.hedge_min_samples)
+        return None if threshold is None else threshold / 1000
+
+    def _executor(self):
+        with self._hedge_lock:
+            if self._hedge_executor is None:
+                self._hedge_executor = ThreadPoolExecutor(
+                    max_workers=8, thread_name_prefix="ecfr-hedge"
+                )
+            return self._hedge_executor
+
+    def _send(self, url, headers, stream, kwargs, attempt):
+        """
+        This sends a request, and a hedged one if the first is slower than hedge_after. The
+        answer that comes first is returned, the other one is closed when it comes.
+        """
+        delay = self.hedge_after()
+        if delay is None:
+            return self._request(url, headers, stream, kwargs, attempt)
+
+        executor = self._executor()
+        first = executor.submit(self._request, url, headers, stream, kwargs, attempt)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            return first.result()
+
+        self.stats.count("hedged")
+        second = executor.submit(self._request, url, headers, stream, kwargs, attempt, True)
+        pending = {first, second}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    error = future.exception()
+                    continue
+                for other in pending:
+                    other.add_done_callback(close_response)
+                if future is second:
+                    self.stats.count("hedge_wins")
+                return future.result()
+        raise error
+
+    def close(self):
+        if self._hedge_executor is not None:
+            self._hedge_executor.shutdown(wait=False)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def close_response(future):
+    """
+    This closes the response of a request whose answer isn't used, e.g. the slower of a hedged
+    pair, so its connection goes back to the pool.
+
+    :param future: The future of the request.
+    """
+    if future.exception() is None:
+        future.result().close()
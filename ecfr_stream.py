@@ -0,0 +1,81 @@
+import xml.etree.ElementTree as ET
+import xmltodict
+
+SUB_PART_TAG = "DIV6"
+SUB_GROUP_TAG = "DIV7"
+SECTION_TAG = "DIV8"
+
+# Size of the pieces the HTTP response body is read in
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def element_to_dict(element):
+    """
+    This converts one finished XML element to the same dict xmltodict.parse would have built for it.
+
+    :param element: The ElementTree element to convert.
+    """
+    # The tail is the text after the closing tag, it doesn't belong to the element
+    tail = element.tail
+    element.tail = None
+    try:
+        return xmltodict.parse(ET.tostring(element, encoding="unicode"))[element.tag]
+    finally:
+        element.tail = tail
+
+
+def iter_sections(chunks):
+    """
+    This parses a sub part XML document piece by piece and yields every section as soon as its
+    closing tag is read. Only the section being read is kept in memory, never the whole document.
+
+    Each item is a tuple of the sub part HEAD, the sub group HEAD (None when the section is not
+    in a DIV7) and the section as the dict process_section_content expects.
+
+    :param chunks: An iterable of bytes or str pieces of the XML document.
+    """
+    parser = ET.XMLPullParser(events=("start", "end"))
+    stack = []
+    heads = dict()
+
+    def read_events():
+        for event, element in parser.read_events():
+            if event == "start":
+                stack.append(element)
+                continue
+
+            stack.pop()
+            parent = stack[-1] if stack else None
+
+            if element.tag == SECTION_TAG:
+                yield heads.get(SUB_PART_TAG), heads.get(SUB_GROUP_TAG), element_to_dict(
+                    element
+                )
+            elif element.tag == "HEAD" and parent is not None:
+                if parent.tag in (SUB_PART_TAG, SUB_GROUP_TAG):
+                    heads[parent.tag] = element_to_dict(element)
+            elif element.tag == SUB_GROUP_TAG:
+                heads.pop(SUB_GROUP_TAG, None)
+
+            # Drop everything that has been read out of the sub part and sub groups
+            if parent is not None and parent.tag in (SUB_PART_TAG, SUB_GROUP_TAG):
+                element.clear()
+                parent.remove(element)
+
+    for chunk in chunks:
+        if chunk:
+            parser.feed(chunk)
+            yield from read_events()
+
+    parser.close()
+    yield from read_events()
+
+
+def iter_response_sections(response, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    This streams the sections out of a requests response that was opened with stream=True.
+
+    :param response: The streamed requests response of a sub part XML download.
+    :param chunk_size: The number of bytes read from the response at a time.
+    """
+    return iter_sections(response.iter_content(chunk_size=chunk_size))
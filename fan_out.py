@@ -0,0 +1,240 @@
+import functools
+import json
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+
+
+def plan_units(sub_parts, unit_size=1):
+    """
+    This splits the sub parts of a run into work units, each one processed by its own worker.
+
+    :param sub_parts: The sub part letters to process, in order.
+    :param unit_size: How many sub parts a worker processes.
+    """
+    unit_size = max(unit_size, 1)
+    return [
+        sub_parts[start : start + unit_size]
+        for start in range(0, len(sub_parts), unit_size)
+    ]
+
+
+def read_response(response):
+    """
+    This returns the body of a worker's handler response, or raises if the worker failed.
+
+    :param response: The dict the handler returned.
+    """
+    body = json.loads(response["body"])
+    if response.get("statusCode") != 200:
+        raise RuntimeError(body.get("error", "The worker failed"))
+    return body
+
+
+def unfinished_result(event):
+    """
+    This is the result of a worker that didn't answer before the orchestrator's deadline: none
+    of its sub parts are finished, so they are all remaining.
+
+    :param event: The worker event.
+    """
+    return {
+        "sub_parts": event["sub_parts"],
+        "remaining_sub_parts": event["sub_parts"],
+        "failed_sections": [],
+        "failed_uploads": [],
+        "uploads": {},
+        "bundles": [],
+    }
+
+
+def map_events(pool, call, events, timeout=None):
+    """
+    This runs call on every event on the pool and yields (event, result, error) as each one
+    finishes. result is the body of the worker's response, error is None if it succeeded. The
+    workers that haven't answered after timeout seconds are not waited for, they are yielded
+    with unfinished_result.
+
+    :param pool: The concurrent.futures executor the calls run on.
+    :param call: The function that returns the handler response of an event.
+    :param events: The worker events.
+    :param timeout: The seconds to wait for all the workers, or None to wait for them all.
+    """
+    futures = {pool.submit(call, event): event for event in events}
+    answered = set()
+    try:
+        for future in as_completed(futures, timeout):
+            answered.add(future)
+            yield answered_event(futures[future], future)
+    except FuturesTimeoutError:
+        for future, event in futures.items():
+            if future in answered:
+                continue
+            if future.done():
+                yield answered_event(event, future)
+                continue
+            future.cancel()
+            print("Worker didn't finish before the deadline", event.get("sub_parts"))
+            yield event, unfinished_result(event), None
+
+
+def answered_event(event, future):
+    """
+    This returns the (event, result, error) of a worker that answered.
+
+    :param event: The worker event.
+    :param future: The done future of the worker.
+    """
+    try:
+        return event, read_response(future.result()), None
+    except Exception as e:
+        print("Worker failed for", event.get("sub_parts"), e)
+        return event, None, str(e)
+
+
+def run_pool(pool, call, events, timeout=None):
+    """
+    This runs map_events on a pool and shuts it down without waiting, so workers that didn't
+    answer before the timeout don't hold the orchestrator.
+
+    :param pool: The concurrent.futures executor the calls run on.
+    :param call: The function that returns the handler response of an event.
+    :param events: The worker events.
+    :param timeout: The seconds to wait for all the workers, or None to wait for them all.
+    """
+    try:
+        yield from map_events(pool, call, events, timeout)
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+class LambdaExecutor:
+    """
+    This runs every worker event as a synchronous invocation of a Lambda function, usually the
+    same function the orchestrator is running in.
+    """
+
+    def __init__(self, lambda_client, function_name, concurrency=10):
+        """
+        :param lambda_client: The boto3 Lambda client, its read timeout must outlast a worker.
+        :param function_name: The name or ARN of the function to invoke.
+        :param concurrency: The number of workers running at the same time.
+        """
+        self.lambda_client = lambda_client
+        self.function_name = function_name
+        self.concurrency = max(concurrency, 1)
+
+    def invoke(self, event):
+        """
+        This invokes the function with a worker event and returns the handler response.
+
+        :param event: The worker event.
+        """
+        response = self.lambda_client.invoke(
+            FunctionName=self.function_name,
+            InvocationType="RequestResponse",
+            Payload=json.dumps(event).encode("utf-8"),
+        )
+        payload = json.loads(response["Payload"].read())
+        if response.get("FunctionError"):
+            raise RuntimeError(payload.get("errorMessage", response["FunctionError"]))
+        return payload
+
+    def map(self, events, timeout=None):
+        """
+        This runs the worker events and yields (event, result, error) as each one finishes.
+
+        :param events: The worker events.
+        :param timeout: The seconds to wait for all the workers, or None to wait for them all.
+        """
+        pool = ThreadPoolExecutor(max_workers=self.concurrency)
+        yield from run_pool(pool, self.invoke, events, timeout)
+
+
+class LocalExecutor:
+    """
+    This runs every worker event through the handler in a pool of local processes, so a fan out
+    plan can be run and tested on one machine.
+    """
+
+    def __init__(self, handler, processes=None):
+        """
+        :param handler: The Lambda handler function, it must be importable by the processes.
+        :param processes: The number of processes, the number of CPUs if None.
+        """
+        self.handler = handler
+        self.processes = processes
+
+    def map(self, events, timeout=None):
+        """
+        This runs the worker events and yields (event, result, error) as each one finishes.
+
+        :param events: The worker events.
+        :param timeout: The seconds to wait for all the workers, or None to wait for them all.
+        """
+        pool = ProcessPoolExecutor(max_workers=self.processes)
+        call = functools.partial(self.handler, context=None)
+        yield from run_pool(pool, call, events, timeout)
+
+
+class ThreadExecutor:
+    """
+    This runs every worker event through the handler on threads of this process, so the workers
+    share its clients, caches and host limits.
+    """
+
+    def __init__(self, handler, threads, context=None):
+        """
+        :param handler: The Lambda handler function.
+        :param threads: The number of workers running at the same time.
+        :param context: The Lambda context passed on to the workers, so they stop before the
+            timeout of this invocation.
+        """
+        self.handler = handler
+        self.threads = max(threads, 1)
+        self.context = context
+
+    def map(self, events, timeout=None):
+        """
+        This runs the worker events and yields (event, result, error) as each one finishes.
+
+        :param events: The worker events.
+        :param timeout: The seconds to wait for all the workers, or None to wait for them all.
+        """
+        pool = ThreadPoolExecutor(max_workers=self.threads)
+        call = functools.partial(self.handler, context=self.context)
+        yield from run_pool(pool, call, events, timeout)
+
+
+def gather_results(outcomes):
+    """
+    This joins the results of the workers into one run summary.
+
+    :param outcomes: The (event, result, error) tuples of the workers.
+    """
+    summary = {
+        "failed_sections": [],
+        "failed_uploads": [],
+        "uploads": {"written": 0, "skipped": 0, "failed": 0},
+        "bundles": [],
+        "failed_units": [],
+        "remaining_sub_parts": [],
+        "batch_records": 0,
+        "results": [],
+    }
+    for event, result, error in outcomes:
+        if error:
+            summary["failed_units"].append({"sub_parts": event["sub_parts"], "error": error})
+            continue
+        summary["results"].append(result)
+        summary["failed_sections"] += result["failed_sections"]
+        summary["failed_uploads"] += result["failed_uploads"]
+        # The units that failed in the earlier invocations of a resumed run
+        summary["failed_units"] += result.get("failed_units", [])
+        summary["bundles"] += result["bundles"]
+        summary["remaining_sub_parts"] += result.get("remaining_sub_parts", [])
+        summary["batch_records"] += result.get("batch_records", 0)
+        for name, count in result["uploads"].items():
+            summary["uploads"][name] = summary["uploads"].get(name, 0) + count
+    # The workers finish in any order, the bundles are listed the same way every run
+    summary["bundles"].sort()
+    return summary
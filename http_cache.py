@@ -0,0 +1,367 @@
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+# Size of the pieces response bodies are copied in
+CHUNK_SIZE = 64 * 1024
+
+
+def copy_chunks(source, destination):
+    """
+    This copies a file object to another one in chunks.
+
+    :param source: The file object read from.
+    :param destination: The file object written to.
+    """
+    while True:
+        chunk = source.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        destination.write(chunk)
+
+
+class CachedResponse:
+    """
+    This is the response returned by cached_get. It has the parts of a requests response the ETL
+    uses, and its body is read from a file so a large download is never held in memory.
+    """
+
+    def __init__(self, url, headers, fileobj, from_cache):
+        """
+        :param url: The URL that was requested.
+        :param headers: A dict with the etag, last_modified, content_type and content_length
+            of the body.
+        :param fileobj: A file object positioned at the start of the body.
+        :param from_cache: Whether the body was served from the cache.
+        """
+        self.url = url
+        self.status_code = 200
+        self.headers = headers
+        self.from_cache = from_cache
+        self._fileobj = fileobj
+        self._content = None
+
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        """
+        This yields the body in chunks.
+
+        :param chunk_size: The number of bytes in each chunk.
+        """
+        while True:
+            chunk = self._fileobj.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = self._fileobj.read()
+        return self._content
+
+    @property
+    def text(self):
+        content_type = self.headers.get("content_type") or ""
+        encoding = "utf-8"
+        if "charset=" in content_type:
+            encoding = content_type.split("charset=", 1)[1].split(";")[0].strip()
+        return self.content.decode(encoding)
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        pass
+
+    def close(self):
+        self._fileobj.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TeeResponse(CachedResponse):
+    """
+    This is the response of a download that isn't cached yet. The body is read from the network
+    as the caller reads it, so a streaming parser starts on the first chunk, and copied to a
+    temporary file on the way. Once the body has been read to the end it is put in the cache; a
+    body that is closed before that is not cached.
+    """
+
+    def __init__(self, url, headers, response, store):
+        """
+        :param url: The URL that was requested.
+        :param headers: A dict with the etag, last_modified, content_type and content_length
+            of the body. The content_length is set to the bytes read once the body is read.
+        :param response: The open requests response, with stream=True.
+        :param store: The function that puts the body in the cache, given the file positioned
+            at the start of it.
+        """
+        super().__init__(url, headers, tempfile.TemporaryFile(), False)
+        self._response = response
+        self._store = store
+        self._read = False
+
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        """
+        This yields the body in chunks as they are downloaded.
+
+        :param chunk_size: The number of bytes in each chunk.
+        """
+        if self._read:
+            raise RuntimeError("The body of the response was already read")
+        self._read = True
+        size = 0
+        for chunk in self._response.iter_content(chunk_size):
+            self._fileobj.write(chunk)
+            size += len(chunk)
+            yield chunk
+        self._response.close()
+        self.headers["content_length"] = size
+
+        try:
+            self._fileobj.seek(0)
+            self._store(self._fileobj)
+        except Exception as e:
+            print("HTTP cache write failed", e)
+
+    @property
+    def content(self):
+        if self._content is None:
+            self._content = b"".join(self.iter_content())
+        return self._content
+
+    def close(self):
+        self._response.close()
+        super().close()
+
+
+class LocalHttpCache:
+    """
+    This keeps the cached responses in a local directory, a body file and a JSON file of validators.
+    """
+
+    def __init__(self, directory):
+        """
+        :param directory: The directory the cached responses are written to.
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key):
+        """
+        This returns the validators and an open body file of a cached response, or None.
+
+        :param key: The cache key.
+        """
+        try:
+            meta = json.loads((self.directory / f"{key}.json").read_text())
+            body = open(self.directory / f"{key}.body", "rb")
+        except FileNotFoundError:
+            return None
+        meta["content_length"] = os.fstat(body.fileno()).st_size
+        return meta, body
+
+    def put(self, key, meta, fileobj):
+        """
+        This stores a response body and its validators.
+
+        :param key: The cache key.
+        :param meta: A dict with the etag, last_modified, content_type and content_length of
+            the body.
+        :param fileobj: A file object positioned at the start of the body.
+        """
+        # The body goes in before its validators. A reader between the two renames gets the new
+        # body with the old validators, so at worst it downloads the body again; the other way
+        # round a 304 to the new validators would serve the old body.
+        self._replace(self.directory / f"{key}.body", lambda f: copy_chunks(fileobj, f))
+        self._replace(
+            self.directory / f"{key}.json", lambda f: f.write(json.dumps(meta).encode("utf-8"))
+        )
+
+    def _replace(self, path, write):
+        """
+        This writes a file through a temporary file of its own and renames it into place, so a
+        failed write never leaves half a file and writers of the same key, e.g. the processes of
+        main.py, don't write over each other's temporary file.
+
+        :param path: The path of the file.
+        :param write: The function that writes the content to the open temporary file.
+        """
+        with tempfile.NamedTemporaryFile(
+            dir=self.directory, prefix=path.name, suffix=".tmp", delete=False
+        ) as f:
+            try:
+                write(f)
+            except BaseException:
+                f.close()
+                os.unlink(f.name)
+                raise
+        try:
+            os.replace(f.name, path)
+        except BaseException:
+            os.unlink(f.name)
+            raise
+
+
+class S3HttpCache:
+    """
+    This keeps the cached responses as objects under a prefix of the S3 bucket, the validators
+    are stored as the object's metadata.
+    """
+
+    def __init__(self, s3, bucket, prefix="http-cache/"):
+        """
+        :param s3: The boto3 S3 client.
+        :param bucket: The bucket the cache lives in.
+        :param prefix: The key prefix of the cache objects.
+        """
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def get(self, key):
+        """
+        This returns the validators and the streaming body of a cached response, or None.
+
+        :param key: The cache key.
+        """
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self.prefix + key)
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        meta = {name.replace("-", "_"): value for name, value in response["Metadata"].items()}
+        meta["content_type"] = response.get("ContentType")
+        meta["content_length"] = response.get("ContentLength")
+        return meta, response["Body"]
+
+    def put(self, key, meta, fileobj):
+        """
+        This stores a response body and its validators.
+
+        :param key: The cache key.
+        :param meta: A dict with the etag, last_modified, content_type and content_length of
+            the body.
+        :param fileobj: A file object positioned at the start of the body.
+        """
+        extra_args = {
+            "Metadata": {
+                name.replace("_", "-"): value
+                for name, value in meta.items()
+                if value and name not in ("content_type", "content_length")
+            }
+        }
+        if meta.get("content_type"):
+            extra_args["ContentType"] = meta["content_type"]
+        self.s3.upload_fileobj(fileobj, self.bucket, self.prefix + key, ExtraArgs=extra_args)
+
+
+def http_cache_key(url, headers):
+    """
+    This creates the cache key of a request from its URL and Accept header.
+
+    :param url: The requested URL.
+    :param headers: The request headers.
+    """
+    accept = (headers or {}).get("Accept", "")
+    return hashlib.sha256(f"{accept} {url}".encode("utf-8")).hexdigest()
+
+
+def cached_get(session, url, headers=None, cache=None, immutable=False, stream=False):
+    """
+    This makes a GET request through the cache. An immutable URL that is already cached is
+    returned without any network call. Otherwise the cached ETag and Last-Modified are sent as
+    If-None-Match and If-Modified-Since, and a 304 answer is served from the cache. A new body
+    is read from the network as the caller reads it and cached once it is read to the end.
+
+    :param session: The requests session (or the requests module) to download with.
+    :param url: The URL to get.
+    :param headers: The request headers.
+    :param cache: A LocalHttpCache or S3HttpCache, or None to not cache.
+    :param immutable: Whether the content of the URL never changes, e.g. it is dated.
+    :param stream: Passed to requests when there is no cache.
+    """
+    headers = dict(headers or {})
+    if cache is None:
+        response = session.get(url, headers=headers, stream=stream)
+        response.raise_for_status()
+        return response
+
+    key = http_cache_key(url, headers)
+    entry = None
+    try:
+        entry = cache.get(key)
+    except Exception as e:
+        print("HTTP cache read failed", e)
+
+    if entry is not None:
+        meta, body = entry
+        if immutable:
+            return CachedResponse(url, meta, body, True)
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    try:
+        response = session.get(url, headers=headers, stream=True)
+    except Exception:
+        if entry is not None:
+            body.close()
+        raise
+    if response.status_code == 304 and entry is not None:
+        response.close()
+        return CachedResponse(url, meta, body, True)
+
+    if entry is not None:
+        body.close()
+
+    try:
+        response.raise_for_status()
+    except Exception:
+        response.close()
+        raise
+    meta = {
+        "etag": response.headers.get("ETag"),
+        "last_modified": response.headers.get("Last-Modified"),
+        "content_type": response.headers.get("Content-Type"),
+        "content_length": response.headers.get("Content-Length"),
+    }
+    return TeeResponse(url, meta, response, lambda fileobj: cache.put(key, meta, fileobj))
+
+
+def content_length(response):
+    """
+    This returns the size in bytes of the body of a response cached_get returned, or None if it
+    isn't known. A cached response has it in its validators, a requests response in its
+    Content-Length header.
+
+    :param response: The response.
+    """
+    if isinstance(response, CachedResponse):
+        length = response.headers.get("content_length")
+    else:
+        length = response.headers.get("Content-Length")
+    return None if length is None else int(length)
+
+
+def create_http_cache(s3=None, bucket=None, default_backend="s3"):
+    """
+    This creates the eCFR response cache chosen with the HTTP_CACHE environment variable:
+    "s3", "local" or "off".
+
+    :param s3: The boto3 S3 client used by the S3 cache.
+    :param bucket: The bucket used by the S3 cache.
+    :param default_backend: The backend used when HTTP_CACHE is not set.
+    """
+    backend = os.environ.get("HTTP_CACHE", default_backend)
+    if backend == "s3" and s3 is not None:
+        return S3HttpCache(s3, bucket, os.environ.get("HTTP_CACHE_PREFIX", "http-cache/"))
+    if backend == "local":
+        return LocalHttpCache(os.environ.get("HTTP_CACHE_DIR", "http_cache"))
+    return None
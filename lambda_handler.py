@@ -1,75 +1,611 @@
+import gzip
 import json
+import os
+import tempfile
+import threading
+import time
 import boto3
+from botocore.config import Config
 from datetime import datetime, timezone
+from collections import defaultdict
 import requests
+from requests.adapters import HTTPAdapter
 import xmltodict
-import re
+from ecfr_stream import iter_response_sections
+from requirement_parser import build_contents
+from bedrock_pool import AdaptiveLimiter, call_with_retries, map_with_retries
+from summary_cache import create_summary_cache, summary_cache_key
+from summary_prompts import fit_to_budget, section_text
+from summarizers import BedrockSummarizer, ExtractiveSummarizer
+from summary_batch import (
+    BATCH_DONE_STATUSES,
+    BATCH_RUNNING_STATUSES,
+    BatchPrompts,
+    LocalBatchJobs,
+    batch_output_key,
+    batch_record,
+    read_records,
+    write_records,
+)
+from run_manifest import RunManifest, plan_incremental_run, section_content_hash
+from http_cache import cached_get, content_length, create_http_cache
+from ecfr_client import EcfrClient, LatencyStats
+from title_index import open_title, write_title
+from warm_cache import WarmCache, cache_budget
+from s3_uploader import S3Uploader
+from output_bundles import BundleWriter, join_bundles
+from requirements_table import bundle_rows, table_supported, write_table
+from fan_out import (
+    LambdaExecutor,
+    LocalExecutor,
+    ThreadExecutor,
+    gather_results,
+    plan_units,
+)
+from checkpoint import Deadline, RunCheckpoint, until_deadline
+from run_metrics import metrics
+from stage_pipeline import Stage, run_pipeline
+from crawl_scheduler import (
+    CrawlTarget,
+    HostLimits,
+    discover_sub_parts,
+    find_part,
+    parse_crawl_request,
+    schedule_jobs,
+)
+
+# How many Bedrock summaries are requested at the same time, and how often a failed one is retried
+SUMMARY_CONCURRENCY = int(os.environ.get("SUMMARY_CONCURRENCY", "4"))
+SUMMARY_MAX_RETRIES = int(os.environ.get("SUMMARY_MAX_RETRIES", "5"))
 
-s3 = boto3.client("s3")
-bedrock = boto3.client("bedrock-runtime")
 BUCKET_NAME = "medlaunch-regulations-data"
 
+SUMMARY_MODEL_ID = "amazon.titan-text-express-v1"
+SUMMARY_PROMPT_TEMPLATE = "Summarize this regulation section in one sentence. Don't mention any data source in the answer, just go to straight to the summary. Be concise and informative:\n{text}"
+
+# Prompts of sections longer than the token budget, each chunk is summarized and the summaries
+# are combined
+SUMMARY_CHUNK_PROMPT_TEMPLATE = "This is part of the regulation section \"{heading}\". Summarize it in one sentence, be concise and informative:\n{text}"
+SUMMARY_COMBINE_PROMPT_TEMPLATE = "These are summaries of the parts of the regulation section \"{heading}\". Combine them into one sentence. Don't mention any data source in the answer, just go to straight to the summary:\n{text}"
+
+# The most tokens of section text in one prompt, the most tokens of an answer, and the most chunks
+# a long section is split into
+SUMMARY_INPUT_TOKENS = int(os.environ.get("SUMMARY_INPUT_TOKENS", "2000"))
+SUMMARY_OUTPUT_TOKENS = int(os.environ.get("SUMMARY_OUTPUT_TOKENS", "100"))
+SUMMARY_MAX_CHUNKS = int(os.environ.get("SUMMARY_MAX_CHUNKS", "8"))
+
+# "bedrock" describes the sections with the model above, "extractive" with their most informative
+# sentences picked locally with no network call, for development runs and large backfills
+SUMMARIZER = os.environ.get("SUMMARIZER", "bedrock")
+
+# "extractive" describes a section whose Bedrock summary failed with its own sentences, "off"
+# leaves it without a description. Either way the next incremental run summarizes it again.
+SUMMARY_FALLBACK = os.environ.get("SUMMARY_FALLBACK", "extractive")
+
+# How many sentences an extractive description has at most
+SUMMARY_EXTRACTIVE_SENTENCES = int(os.environ.get("SUMMARY_EXTRACTIVE_SENTENCES", "1"))
+
+# "realtime" gets every description with invoke_model during the run. "batch" writes the prompts
+# to S3 for a Bedrock batch inference job and merges the descriptions in once the job is done.
+SUMMARY_MODE = os.environ.get("SUMMARY_MODE", "realtime")
+
+# "bedrock" runs the batch jobs on Bedrock, "local" runs them right away in this process
+SUMMARY_BATCH_BACKEND = os.environ.get("SUMMARY_BATCH_BACKEND", "bedrock")
+
+# The service role Bedrock reads the prompts and writes the answers with
+SUMMARY_BATCH_ROLE_ARN = os.environ.get("SUMMARY_BATCH_ROLE_ARN", "")
+
+# Bedrock needs this many records in a job, smaller runs are summarized with invoke_model
+SUMMARY_BATCH_MIN_RECORDS = int(os.environ.get("SUMMARY_BATCH_MIN_RECORDS", "100"))
+
+# The summary error of a section waiting for a batch job, it is saved without a description
+SUMMARY_PENDING = "pending"
+
+# The part processed when the event doesn't list a crawl
 TITLE = 42
 PART = 482
 SUB_PARTS = ["A", "B", "C", "D", "E"]
 
+# How many subparts are downloaded from eCFR at the same time
+FETCH_CONCURRENCY = int(os.environ.get("FETCH_CONCURRENCY", "5"))
+
+# "subpart" downloads each sub part with the part and subpart query of eCFR's full endpoint.
+# "title" downloads the whole title once per eCFR date into TITLE_CACHE_DIR, indexes where every
+# part, sub part and section starts, and reads the sub parts from the memory-mapped file.
+ECFR_SOURCE = os.environ.get("ECFR_SOURCE", "subpart")
+TITLE_CACHE_DIR = os.environ.get(
+    "TITLE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ecfr-titles")
+)
+
+# "stream" parses each section as it is downloaded, "full" parses the whole sub part at once
+PARSE_MODE = os.environ.get("PARSE_MODE", "stream")
+
+# A warm Lambda keeps the parsed sub parts and processed sections of an eCFR date in memory, so a
+# retry or rerun of the same date skips the download, parse, summary and transform of what it has
+# already done. They take at most WARM_CACHE_FRACTION of the function's memory, or WARM_CACHE_MB
+# if it is set; WARM_CACHE_MB=0 turns the cache off.
+WARM_CACHE_FRACTION = float(os.environ.get("WARM_CACHE_FRACTION", "0.25"))
+WARM_CACHE_MB = os.environ.get("WARM_CACHE_MB")
+
+# Only reprocess sections that changed since the last run, an event can override it with "incremental"
+INCREMENTAL = os.environ.get("INCREMENTAL", "false").lower() == "true"
+OUTPUT_ROOT = "niaho-mapper-output/cms-cop"
+
+# Can be pointed at a local server for testing
+ECFR_BASE_URL = os.environ.get("ECFR_BASE_URL", "https://www.ecfr.gov")
+
+# Seconds an eCFR request waits for the connection, and for the answer and between two reads of it
+ECFR_CONNECT_TIMEOUT = float(os.environ.get("ECFR_CONNECT_TIMEOUT", "5"))
+ECFR_READ_TIMEOUT = float(os.environ.get("ECFR_READ_TIMEOUT", "60"))
+
+# How often an eCFR request that failed with a connection error, a timeout, 429 or 5xx is retried,
+# with exponential backoff from ECFR_BACKOFF_SECONDS. A 429 or 503 waits its Retry-After instead,
+# no wait is longer than ECFR_MAX_RETRY_WAIT seconds.
+ECFR_MAX_RETRIES = int(os.environ.get("ECFR_MAX_RETRIES", "4"))
+ECFR_BACKOFF_SECONDS = float(os.environ.get("ECFR_BACKOFF_SECONDS", "0.5"))
+ECFR_MAX_RETRY_WAIT = float(os.environ.get("ECFR_MAX_RETRY_WAIT", "30"))
+
+# An eCFR request with no answer after this percentile of the recent latencies, e.g. 0.95, gets a
+# second identical request and the first answer is used. "off" never hedges. At most
+# ECFR_HEDGE_MAX_FRACTION of the requests are hedged, and only once ECFR_HEDGE_MIN_SAMPLES
+# latencies of the last ECFR_LATENCY_WINDOW requests are known.
+ECFR_HEDGE_PERCENTILE = os.environ.get("ECFR_HEDGE_PERCENTILE", "off")
+ECFR_HEDGE_MAX_FRACTION = float(os.environ.get("ECFR_HEDGE_MAX_FRACTION", "0.1"))
+ECFR_HEDGE_MIN_SAMPLES = int(os.environ.get("ECFR_HEDGE_MIN_SAMPLES", "20"))
+ECFR_LATENCY_WINDOW = int(os.environ.get("ECFR_LATENCY_WINDOW", "200"))
+
+# How many processed sections are written to S3 at the same time
+UPLOAD_CONCURRENCY = int(os.environ.get("UPLOAD_CONCURRENCY", "8"))
+
+# Sections go through read, summarize, transform and upload stages that run at the same time. This
+# is how many sections wait between two stages, and how many are transformed at the same time; the
+# other stages use FETCH_CONCURRENCY, SUMMARY_CONCURRENCY and UPLOAD_CONCURRENCY.
+PIPELINE_QUEUE_SIZE = int(os.environ.get("PIPELINE_QUEUE_SIZE", "16"))
+TRANSFORM_CONCURRENCY = int(os.environ.get("TRANSFORM_CONCURRENCY", "1"))
+
+# Comma separated output formats: "json" (indented, one object per section), "compact" (one object
+# per section with no indentation), "bundle" (gzip NDJSON per sub part and for the whole part) and
+# "table" (a Parquet file with one row per requirement, built from the part bundle)
+OUTPUT_FORMATS = os.environ.get("OUTPUT_FORMATS", "json").split(",")
+
+# How long the titles.json metadata is reused by a warm Lambda before it is downloaded again
+TITLES_TTL_SECONDS = float(os.environ.get("TITLES_TTL_SECONDS", "3600"))
+
+# "single" processes every sub part in this invocation, "fan_out" plans the run and sends each unit
+# of sub parts to a worker. An event can override it with "mode".
+EXECUTION_MODE = os.environ.get("EXECUTION_MODE", "single")
+
+# Where fan out workers run: "lambda" invokes this function again, "local" uses a process pool
+FAN_OUT_BACKEND = os.environ.get("FAN_OUT_BACKEND", "lambda")
+
+# How many workers run at the same time, and how many sub parts each one processes
+FAN_OUT_CONCURRENCY = int(os.environ.get("FAN_OUT_CONCURRENCY", "10"))
+FAN_OUT_UNIT_SIZE = int(os.environ.get("FAN_OUT_UNIT_SIZE", "1"))
+
+# A run stops taking new sections this many seconds before the Lambda timeout and saves a checkpoint
+CHECKPOINT_MARGIN_SECONDS = float(os.environ.get("CHECKPOINT_MARGIN_SECONDS", "120"))
+
+# "invoke" continues a stopped run in a new asynchronous invocation, "return" only returns the
+# continuation so the caller can send it back as {"resume": ...}
+CHECKPOINT_CONTINUE = os.environ.get("CHECKPOINT_CONTINUE", "invoke")
+CHECKPOINT_MAX_CONTINUATIONS = int(os.environ.get("CHECKPOINT_MAX_CONTINUATIONS", "10"))
+
+# How many sub parts of a crawl are processed at the same time in this invocation
+CRAWL_CONCURRENCY = int(os.environ.get("CRAWL_CONCURRENCY", "4"))
+
+# Comma separated host=limit pairs, the most requests sent to a host at the same time by all the
+# workers of this invocation. A host matches a limit if its name starts with it.
+host_limits = HostLimits.from_string(
+    os.environ.get("HOST_CONCURRENCY", "www.ecfr.gov=4,bedrock-runtime=16")
+)
+
+# The batch records of the sections processed this invocation, until they are written to S3
+batch_prompts = BatchPrompts()
+
+# Clients, caches and the titles metadata are created on first use, not at import, so a cold
+# start doesn't wait on the network. They are kept here for the next warm invocations.
+_lazy = dict()
+_lazy_lock = threading.RLock()
+
+# The latencies of the eCFR requests of this process, kept for the next warm invocations so the
+# hedge threshold doesn't start over
+ecfr_latency = LatencyStats(ECFR_LATENCY_WINDOW)
+
+# Held while a title is downloaded, so the workers that need it wait for one download
+_title_lock = threading.Lock()
+
+
+def lazy(name, create):
+    """
+    This returns the object stored under name, creating it with create the first time.
+
+    :param name: The name the object is kept under.
+    :param create: The function that creates the object.
+    """
+    if name not in _lazy:
+        with _lazy_lock:
+            if name not in _lazy:
+                _lazy[name] = create()
+    return _lazy[name]
+
 
-titles_url = "https://www.ecfr.gov/api/versioner/v1/titles.json"
-headers = {"Accept": "application/json"}
+def get_s3():
+    """
+    This returns the S3 client.
+    """
+    return lazy("s3", lambda: boto3.client("s3"))
 
-response = requests.get(titles_url, headers=headers)
-response.raise_for_status()
 
-data = response.json()
-titles = data["titles"]
-title_42 = next(title for title in titles if title["number"] == TITLE)
+def get_bedrock():
+    """
+    This returns the Bedrock runtime client.
+    """
+    # Retries are done by bedrock_pool so throttling can also slow down the other workers
+    return lazy(
+        "bedrock",
+        lambda: boto3.client(
+            "bedrock-runtime",
+            config=Config(
+                retries={"total_max_attempts": 1, "mode": "standard"},
+                max_pool_connections=max(SUMMARY_CONCURRENCY, 10),
+            ),
+        ),
+    )
 
 
-def create_a_sub_requirement(text, standard_code):
+def get_lambda():
     """
-    This creates a section requirement.
+    This returns the Lambda client workers are invoked with.
+    """
+    # A worker can run for the whole Lambda timeout, and is not retried so it never runs twice
+    return lazy(
+        "lambda",
+        lambda: boto3.client(
+            "lambda",
+            config=Config(
+                read_timeout=910,
+                retries={"total_max_attempts": 1, "mode": "standard"},
+                max_pool_connections=max(FAN_OUT_CONCURRENCY, 10),
+            ),
+        ),
+    )
+
 
-    :param text: The text part of the section requirement.
-    :param standard_code: The standard code to be part of the section requirement.
+def get_batch_jobs():
     """
-    try:
-        sub = dict()
-        text = text.strip()
-        code_number = ""
-
-        sub["code"] = ""  # Just to make it come first
-        sub["text"] = text.strip()
-
-        while sub["text"][0] == "(" and len(sub["text"].split(" ", 1)) > 1:
-            code_number = sub["text"].split()[0].strip()
-            sub["code"] = standard_code + (
-                ""
-                if standard_code
-                and len(standard_code) > 1
-                and code_number
-                and len(code_number) > 1
-                and code_number[1] == standard_code[-2]
-                else code_number
+    This returns the client batch inference jobs are submitted and looked up with.
+    """
+    if SUMMARY_BATCH_BACKEND == "local":
+        return lazy(
+            "batch_jobs", lambda: LocalBatchJobs(get_s3(), BUCKET_NAME, invoke_model_input)
+        )
+    return lazy("batch_jobs", lambda: boto3.client("bedrock"))
+
+
+def get_summarizer(name):
+    """
+    This returns the summarizer of a name: "bedrock" or "extractive".
+
+    :param name: The name of the summarizer.
+    """
+    if name == "extractive":
+        return lazy(
+            "extractive_summarizer",
+            lambda: ExtractiveSummarizer(SUMMARY_EXTRACTIVE_SENTENCES),
+        )
+    return lazy(
+        "bedrock_summarizer",
+        lambda: BedrockSummarizer(
+            invoke_model,
+            SUMMARY_PROMPT_TEMPLATE,
+            SUMMARY_CHUNK_PROMPT_TEMPLATE,
+            SUMMARY_COMBINE_PROMPT_TEMPLATE,
+            SUMMARY_INPUT_TOKENS,
+            SUMMARY_MAX_CHUNKS,
+        ),
+    )
+
+
+def get_summary_cache():
+    """
+    This returns the cache descriptions of unchanged sections are taken from instead of Bedrock.
+    """
+    return lazy("summary_cache", lambda: create_summary_cache(get_s3(), BUCKET_NAME))
+
+
+def get_warm_cache():
+    """
+    This returns the in-memory cache kept for the next warm invocations.
+    """
+    return lazy(
+        "warm_cache",
+        lambda: WarmCache(
+            cache_budget(
+                # Set by Lambda, the memory_size of the function
+                int(os.environ.get("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", "512")),
+                WARM_CACHE_FRACTION,
+                WARM_CACHE_MB,
             )
-            sub["text"] = sub["text"].split(" ", 1)[1].strip()
+        ),
+    )
 
-        return sub
 
-    except Exception as e:
-        print(e)
+def warm_get(kind, key):
+    """
+    This returns a value of the warm cache, or None. Hits and misses are counted in the
+    warm_cache metrics, e.g. sub_part_hits.
+
+    :param kind: What the value is, "sub_part" or "section".
+    :param key: The key of the value.
+    """
+    cache = get_warm_cache()
+    if not cache.enabled:
+        return None
+    with metrics.time("warm_cache") as measurement:
+        value = cache.get(key)
+        measurement.count(f"{kind}_{'hits' if value is not None else 'misses'}", 1)
+    return value
 
 
-def is_number(s):
+def sub_part_cache_key(target, sub_part):
     """
-    Checks if a string is a number.
+    This creates the warm cache key of a parsed sub part, its sections only change with the date.
 
-    :param s: The string to check.
+    :param target: The CrawlTarget of the part.
+    :param sub_part: The sub part letter.
     """
-    try:
-        float(s)
-        return True
-    except ValueError:
-        return False
+    return (target.title, target.part, sub_part, target.metadata["up_to_date_as_of"])
+
+
+def section_cache_key(target, item):
+    """
+    This creates the warm cache key of a processed section.
+
+    :param target: The CrawlTarget of the part.
+    :param item: The section item from section_items.
+    """
+    return sub_part_cache_key(target, item["sub_part"]) + (item["section"]["@N"],)
+
+
+def get_http_cache():
+    """
+    This returns the cache eCFR responses are kept in and revalidated with ETag/Last-Modified.
+    """
+    return lazy("http_cache", lambda: create_http_cache(get_s3(), BUCKET_NAME))
+
+
+def record_ecfr_request(milliseconds, status, attempt, hedged):
+    """
+    This adds an eCFR request to the ecfr_request metrics, with retry and hedged counts. Unlike
+    the fetch metrics they leave out the cache and the reading of the body, they are the
+    latencies the hedge threshold is taken from.
+
+    :param milliseconds: How long the request took until the answer's headers.
+    :param status: The status code of the answer, or None if there was none.
+    :param attempt: The attempt of the request, 0 for the first.
+    :param hedged: Whether it was the second request of a hedged pair.
+    """
+    metrics.record(
+        "ecfr_request",
+        milliseconds,
+        error=status is None or status >= 400,
+        counters={"retry": int(attempt > 0), "hedged": int(hedged)},
+    )
+
+
+def create_ecfr_client(session=None):
+    """
+    This creates the EcfrClient the eCFR requests are sent with, with timeouts, retries and
+    hedging as configured above.
+
+    :param session: The requests session to send with, a new one if None.
+    """
+    return EcfrClient(
+        session,
+        ECFR_CONNECT_TIMEOUT,
+        ECFR_READ_TIMEOUT,
+        ECFR_MAX_RETRIES,
+        ECFR_BACKOFF_SECONDS,
+        ECFR_MAX_RETRY_WAIT,
+        hedge_percentile=(
+            None if ECFR_HEDGE_PERCENTILE == "off" else float(ECFR_HEDGE_PERCENTILE)
+        ),
+        hedge_max_fraction=ECFR_HEDGE_MAX_FRACTION,
+        hedge_min_samples=ECFR_HEDGE_MIN_SAMPLES,
+        stats=ecfr_latency,
+        observer=record_ecfr_request,
+    )
+
+
+def get_ecfr_client():
+    """
+    This returns the EcfrClient of the requests made outside a pipeline run, e.g. titles.json.
+    """
+    return lazy("ecfr_client", create_ecfr_client)
+
+
+def ecfr_get(session, url, headers, immutable=False, stream=False):
+    """
+    This makes a cached GET request to eCFR, holding one of the host's request slots.
+
+    :param session: The EcfrClient, or a requests session.
+    :param url: The URL to download.
+    :param headers: The request headers.
+    :param immutable: Whether a cached copy never needs to be checked again.
+    :param stream: If True, the open response is returned so its body can be read in chunks.
+    """
+    with host_limits.slot(url), metrics.time("fetch") as measurement:
+        response = cached_get(
+            session, url, headers, get_http_cache(), immutable=immutable, stream=stream
+        )
+        measurement.size = content_length(response)
+        return response
+
+
+def fetch_title_metadata(title_number=TITLE):
+    """
+    This downloads the titles.json metadata of a title.
+
+    :param title_number: The title number, e.g. 42.
+    """
+    titles_url = f"{ECFR_BASE_URL}/api/versioner/v1/titles.json"
+    headers = {"Accept": "application/json"}
+
+    with ecfr_get(get_ecfr_client(), titles_url, headers) as response:
+        data = response.json()
+
+    titles = data["titles"]
+    return next(title for title in titles if title["number"] == title_number)
+
+
+def get_title_metadata(title_number=TITLE, max_age=None):
+    """
+    This returns the titles.json metadata of a title, downloading it the first time.
+    The handler refreshes it once per invocation, so the date can't change in the middle of a run.
+
+    :param title_number: The title number, e.g. 42.
+    :param max_age: Download it again if the kept copy is older than this many seconds.
+    """
+    name = f"title_{title_number}"
+    with _lazy_lock:
+        cached = _lazy.get(name)
+        if cached is None or (
+            max_age is not None and time.monotonic() - cached[0] > max_age
+        ):
+            cached = (time.monotonic(), fetch_title_metadata(title_number))
+            _lazy[name] = cached
+        return cached[1]
+
+
+def fetch_structure(title_number, date):
+    """
+    This downloads the eCFR structure of a title, its parts, sub parts and sections.
+
+    :param title_number: The title number, e.g. 42.
+    :param date: The eCFR date of the structure.
+    """
+    structure_url = f"{ECFR_BASE_URL}/api/versioner/v1/structure/{date}/title-{title_number}.json"
+    headers = {"Accept": "application/json"}
+
+    # The URL is dated, so a cached copy never needs to be checked again
+    with ecfr_get(get_ecfr_client(), structure_url, headers, immutable=True) as response:
+        return response.json()
+
+
+def create_http_session(pool_size=FETCH_CONCURRENCY):
+    """
+    This creates the EcfrClient of a run, on a requests session whose connection pool is shared
+    by all the fetch workers, so the TLS connections to ecfr.gov are reused instead of opened for
+    every request.
+
+    :param pool_size: The maximum number of connections kept open to a host.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(pool_size, 1))
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return create_ecfr_client(session)
+
+
+def fetch_sub_part(session, target, sub_part, stream=False):
+    """
+    This downloads the XML of one sub part from eCFR.
+
+    :param session: The shared EcfrClient to download with.
+    :param target: The CrawlTarget of the part.
+    :param sub_part: The sub part letter to download.
+    :param stream: If True, the open response is returned so its body can be read in chunks.
+    """
+    content_url = f"{ECFR_BASE_URL}/api/versioner/v1/full/{target.metadata['up_to_date_as_of']}/title-{target.title}.xml?part={target.part}&subpart={sub_part}"
+    headers = {"Accept": "application/xml"}
+
+    # The URL is dated, so a cached copy never needs to be checked again
+    response = ecfr_get(session, content_url, headers, immutable=True, stream=stream)
+    if stream:
+        return response
+    with response:
+        return response.text
+
+
+def download_title(target, path):
+    """
+    This downloads the whole title XML at the run's eCFR date to path.
+
+    :param target: The CrawlTarget of the part, its title and date are downloaded.
+    :param path: The path the XML is written to.
+    """
+    content_url = f"{ECFR_BASE_URL}/api/versioner/v1/full/{target.metadata['up_to_date_as_of']}/title-{target.title}.xml"
+    headers = {"Accept": "application/xml"}
+
+    # The whole download is one fetch. The URL is dated, so the S3 HTTP cache lets the other
+    # containers of a fan out copy it from S3 instead of eCFR.
+    with host_limits.slot(content_url), metrics.time("fetch") as measurement:
+        with cached_get(
+            get_ecfr_client(),
+            content_url,
+            headers,
+            get_http_cache(),
+            immutable=True,
+            stream=True,
+        ) as response:
+            measurement.size = write_title(response.iter_content(1024 * 1024), path)
+
+
+def get_title_index(target):
+    """
+    This returns the TitleIndex of the target's title at the run's eCFR date, downloading the
+    title the first time. A warm Lambda keeps it open for the next invocations.
+
+    :param target: The CrawlTarget of the part.
+    """
+    date = target.metadata["up_to_date_as_of"]
+    name = f"title_index_{target.title}"
+    with _title_lock:
+        entry = _lazy.get(name)
+        if entry is None or entry[0] != date:
+            if entry is not None:
+                entry[1].close()
+            index = open_title(
+                TITLE_CACHE_DIR,
+                target.title,
+                date,
+                lambda path: download_title(target, path),
+            )
+            _lazy[name] = entry = (date, index)
+    return entry[1]
+
+
+def open_sub_part(session, target, sub_part, stream=False):
+    """
+    This returns the XML of one sub part like fetch_sub_part. With ECFR_SOURCE=title it is read
+    from the downloaded title instead of requested from eCFR.
+
+    :param session: The shared EcfrClient to download with.
+    :param target: The CrawlTarget of the part.
+    :param sub_part: The sub part letter.
+    :param stream: If True, an object whose body can be read in chunks is returned.
+    """
+    if ECFR_SOURCE != "title":
+        return fetch_sub_part(session, target, sub_part, stream)
+
+    span = get_title_index(target).open_sub_part(target.part, sub_part)
+    if stream:
+        return span
+    return span.text
+
+
+def fetch_versions(target, session=None):
+    """
+    This downloads the eCFR versioner data, the dates each section of the part changed on.
+
+    :param target: The CrawlTarget of the part.
+    :param session: The EcfrClient to download with, get_ecfr_client if None.
+    """
+    versions_url = f"{ECFR_BASE_URL}/api/versioner/v1/versions/title-{target.title}.json?part={target.part}"
+    headers = {"Accept": "application/json"}
+
+    with ecfr_get(session or get_ecfr_client(), versions_url, headers) as response:
+        return response.json()["content_versions"]
 
 
 def process_section_content(
@@ -86,7 +622,7 @@ def process_section_content(
     description,
 ):
     """
-    This is called by the process_sections function in a loop to process each section.
+    This creates the processed section, it is called by the transform stage of the pipeline.
 
     :param facility_type: This is the type of facility this section is for.
     :param part_label: The label for the section's part.
@@ -101,15 +637,6 @@ def process_section_content(
     :param description: The description of the section, in this case generated with Bedrock.
     """
     try:
-        # Pattern hierarchies lowercase -> number -> roman -> uppercase
-        is_a_upper_pattern = re.compile(r"^\([A-Z]")
-        is_a_roman_pattern = re.compile(r"^\([ivxlcdm]")
-        is_a_lower_case_pattern = re.compile(r"^\([a-hj-uwyz]")
-        is_a_number_pattern = re.compile(r"^\([1-9]")
-
-        section_data = json.dumps(section_data, ensure_ascii=False)
-        section_data = json.loads(section_data)
-
         section_id = section_data["@N"]
         file_name = section_id.replace(".", "_")
         print("Saving", file_name)
@@ -129,7 +656,6 @@ def process_section_content(
         section_dict["description"] = description
         section_dict["subpart"] = sub_part
         section_dict["subpart_name"] = sub_part_name
-        contents_array = []
 
         # Some Ps are just strings
         source_array = (
@@ -138,123 +664,7 @@ def process_section_content(
             else [section_data["P"]]
         )
 
-        # To store the last item in each level of the hierachy so we can use them down the line
-        current_content_dict = dict()
-        last_number_sub_requirement = dict()
-        last_roman_sub_requirement = dict()
-        last_lower_sub_requirement = dict()
-        last_upper_sub_requirement = dict()
-        jump_from_lower_to_numeral = False
-
-        for content in source_array:
-            it_is_a_lower = isinstance(content, str) and bool(
-                is_a_lower_case_pattern.match(content.strip())
-            )
-            if isinstance(content, dict) or it_is_a_lower:
-                if len(current_content_dict.keys()) > 0:
-                    contents_array.append(current_content_dict)
-                current_content_dict = dict()
-
-                text = ""
-                if it_is_a_lower:
-                    text = content.strip()
-                else:
-                    text = content["#text"].strip()
-
-                current_content_dict["standard_code"] = section_id + (
-                    text.split(" ")[0] if text[0] == "(" else ""
-                )
-
-                # Do requirement
-                if it_is_a_lower:
-                    current_content_dict["requirement"] = ""
-                else:
-                    current_content_dict["requirement"] = (
-                        content["I"][0].strip().strip(".")
-                        if isinstance(content["I"], list)
-                        else content["I"].strip().strip(".")
-                    )
-
-                # Create the first sub requirement unit
-                last_lower_sub_requirement = create_a_sub_requirement(
-                    text, current_content_dict["standard_code"]
-                )
-
-                sub_requirements = current_content_dict.get("sub_requirements", [])
-                sub_requirements.append(last_lower_sub_requirement)
-                current_content_dict["sub_requirements"] = sub_requirements
-
-                # To take care of items that have letter and number on one line
-                if len(last_lower_sub_requirement["code"]) > 2 and is_number(
-                    last_lower_sub_requirement["code"][-2]
-                ):
-                    jump_from_lower_to_numeral = True
-                    last_number_sub_requirement = last_lower_sub_requirement
-                else:
-                    jump_from_lower_to_numeral = False
-
-            else:
-                # For number sub requirements
-                if bool(is_a_number_pattern.match(content.strip())):
-                    # To take care of items that have letter and number on one line
-                    lower_or_main = dict()
-                    if jump_from_lower_to_numeral:
-                        lower_or_main = current_content_dict
-                    else:
-                        lower_or_main = last_lower_sub_requirement
-
-                    last_number_sub_requirement = create_a_sub_requirement(
-                        content.strip(),
-                        (
-                            lower_or_main["code"]
-                            if lower_or_main.get("code", False)
-                            else lower_or_main["standard_code"]
-                        ),
-                    )
-
-                    sub_requirements = lower_or_main.get("sub_requirements", [])
-                    sub_requirements.append(last_number_sub_requirement)
-                    lower_or_main["sub_requirements"] = sub_requirements
-
-                # For roman numerals sub requirements
-                elif bool(is_a_roman_pattern.match(content.strip())):
-                    last_roman_sub_requirement = create_a_sub_requirement(
-                        content.strip(), last_number_sub_requirement["code"]
-                    )
-                    sub_requirements = last_number_sub_requirement.get(
-                        "sub_requirements", []
-                    )
-                    sub_requirements.append(last_roman_sub_requirement)
-                    last_number_sub_requirement["sub_requirements"] = sub_requirements
-
-                # For capital letter sub requirements
-                elif bool(is_a_upper_pattern.match(content.strip())):
-                    last_upper_sub_requirement = create_a_sub_requirement(
-                        content.strip(), last_roman_sub_requirement["code"]
-                    )
-                    sub_requirements = last_roman_sub_requirement.get(
-                        "sub_requirements", []
-                    )
-                    sub_requirements.append(last_upper_sub_requirement)
-                    last_roman_sub_requirement["sub_requirements"] = sub_requirements
-                    pass
-
-                # For first level section
-                else:
-                    sub_requirements = current_content_dict.get("sub_requirements", [])
-                    last_level_2_sub_requirement = create_a_sub_requirement(
-                        content.strip(),
-                        current_content_dict.get("standard_code", section_id),
-                    )
-                    sub_requirements.append(last_level_2_sub_requirement)
-                    if not current_content_dict.get("requirement", None):
-                        current_content_dict["requirement"] = ""
-                    current_content_dict["sub_requirements"] = sub_requirements
-
-        if len(current_content_dict.keys()) > 0:
-            contents_array.append(current_content_dict)
-
-        section_dict["content"] = contents_array
+        section_dict["content"] = build_contents(section_id, source_array)
 
         extraction_date = (
             datetime.now(timezone.utc)
@@ -278,83 +688,1511 @@ def process_section_content(
         print(e)
 
 
-def summarize_json(json_text):
+def with_extraction_date(document):
     """
-    This creates a description of the section.
+    This returns a copy of a processed section extracted now, for a section taken from the warm
+    cache. The cached document itself is shared and left as it is.
 
-    :param json_text: The JSON data from which the summary will be derived.
+    :param document: The processed section from process_section_content.
     """
-    try:
-        prompt = f"Summarize this JSON data in one sentence. Don't mention any data source in the answer, just go to straight to the summary. Be concise and informative: {json_text}"
+    extraction_date = (
+        datetime.now(timezone.utc).isoformat(timespec="microseconds").replace("+00:00", "Z")
+    )
+    return dict(document, metadata=dict(document["metadata"], extraction_date=extraction_date))
 
-        body = json.dumps(
-            {
-                "inputText": prompt,
-                "textGenerationConfig": {"maxTokenCount": 100, "temperature": 0.1},
-            }
-        )
 
+def model_input(prompt):
+    """
+    This creates the invoke_model body of a prompt.
+
+    :param prompt: The prompt.
+    """
+    return {
+        "inputText": prompt,
+        "textGenerationConfig": {
+            "maxTokenCount": SUMMARY_OUTPUT_TOKENS,
+            "temperature": 0.1,
+        },
+    }
+
+
+def invoke_model_input(model_input):
+    """
+    This sends one invoke_model body to Bedrock and returns the parsed answer. The input and
+    output token counts are added to the summarize metrics.
+
+    :param model_input: The body from model_input.
+    """
+    body = json.dumps(model_input)
+
+    bedrock = get_bedrock()
+    with host_limits.slot(bedrock.meta.endpoint_url), metrics.time(
+        "summarize", len(body)
+    ) as measurement:
         response = bedrock.invoke_model(
             body=body,
-            modelId="amazon.titan-text-express-v1",
+            modelId=SUMMARY_MODEL_ID,
             accept="application/json",
             contentType="application/json",
         )
-
         result = json.loads(response["body"].read())
-        return result["results"][0]["outputText"].strip()
+        measurement.count("input_tokens", result.get("inputTextTokenCount", 0))
+        measurement.count("output_tokens", result["results"][0].get("tokenCount", 0))
 
+    return result
+
+
+def invoke_model(prompt):
+    """
+    This sends one prompt to Bedrock and returns the answer.
+
+    :param prompt: The prompt.
+    """
+    return invoke_model_input(model_input(prompt))["results"][0]["outputText"].strip()
+
+
+def cached_description(text):
+    """
+    This returns the summary cache key of a section's text and its cached description, or None
+    if it is not cached.
+
+    :param text: The plain text of the section from section_text.
+    """
+    summary_cache = get_summary_cache()
+    if not summary_cache:
+        return None, None
+
+    # The prompts and budget are part of the key, a change to them makes new descriptions
+    cache_key = summary_cache_key(
+        text,
+        SUMMARY_MODEL_ID,
+        "\n".join(
+            [
+                SUMMARY_PROMPT_TEMPLATE,
+                SUMMARY_CHUNK_PROMPT_TEMPLATE,
+                SUMMARY_COMBINE_PROMPT_TEMPLATE,
+                f"{SUMMARY_INPUT_TOKENS} {SUMMARY_OUTPUT_TOKENS} {SUMMARY_MAX_CHUNKS}",
+            ]
+        ),
+    )
+    try:
+        return cache_key, summary_cache.get(cache_key)
+    except Exception as e:
+        print("Summary cache read failed", e)
+        return cache_key, None
+
+
+def cache_description(cache_key, description):
+    """
+    This stores a description in the summary cache.
+
+    :param cache_key: The key from cached_description, None if there is no cache.
+    :param description: The description.
+    """
+    summary_cache = get_summary_cache()
+    if summary_cache and cache_key:
+        try:
+            summary_cache.put(cache_key, description, SUMMARY_MODEL_ID)
+        except Exception as e:
+            print("Summary cache write failed", e)
+
+
+def invoke_summary(text):
+    """
+    This asks Bedrock for a description of the section. Errors are raised so they can be retried.
+    The description is served from the summary cache when the same content was summarized before.
+
+    :param text: The plain text of the section from section_text.
+    """
+    cache_key, description = cached_description(text)
+    if description is not None:
+        return description
+
+    description = get_summarizer("bedrock").summarize(text)
+
+    cache_description(cache_key, description)
+    return description
+
+
+def extractive_summary(text):
+    """
+    This describes the section with its own sentences. It is measured as a summarize call with
+    an extractive count, so the metrics tell it apart from the model's.
+
+    :param text: The plain text of the section from section_text.
+    """
+    with metrics.time("summarize", len(text.encode("utf-8"))) as measurement:
+        measurement.count("extractive", 1)
+        return get_summarizer("extractive").summarize(text)
+
+
+def fallback_summary(text):
+    """
+    This returns the description of a section whose Bedrock summary failed, or None if
+    SUMMARY_FALLBACK is off.
+
+    :param text: The plain text of the section from section_text.
+    """
+    if SUMMARY_FALLBACK != "extractive":
+        return None
+    try:
+        return extractive_summary(text)
     except Exception as e:
         print(e)
 
 
-def process_sections(sections, sub_part, sub_part_name):
+def queue_batch_summary(item, text, target):
     """
-    This processes each section by looping through the sections and it's called by the handler function.
+    This is the batch mode of describe_section. It returns the cached description of the
+    section, or adds a batch record for it and returns None. Sections longer than the token
+    budget are cut to it, a batch job can't chunk them.
 
-    :param sections: The JSON sections for this section.
-    :param sub_part: The sub part letter for this section.
-    :param sub_part_name: The name of the sub part of this section.
+    :param item: The section item from section_items.
+    :param text: The plain text of the section from section_text.
+    :param target: The CrawlTarget of the part.
+    """
+    cache_key, description = cached_description(text)
+    if description is not None:
+        return description
+
+    prompt = SUMMARY_PROMPT_TEMPLATE.format(text=fit_to_budget(text, SUMMARY_INPUT_TOKENS))
+    batch_prompts.add(
+        target.name,
+        item["sub_part"],
+        batch_record(
+            f"{item['sub_part']}:{item['section']['@N']}",
+            model_input(prompt),
+            cache_key,
+            section_content_hash(item["text_json"]),
+        ),
+    )
+    return None
+
+
+def describe_section(item, target, limiter):
     """
+    This is the summarize stage of the pipeline. It sets the description of the section, with
+    SUMMARIZER, from a batch job later, or from Bedrock. A Bedrock call that still fails after
+    its retries sets the error and the fallback_summary. The limiter is shared by the workers of
+    the stage, so throttling slows all of them down. A section a warm invocation already
+    processed gets its description and document from the warm cache.
+
+    :param item: The section item from section_items.
+    :param target: The CrawlTarget of the part.
+    :param limiter: The AdaptiveLimiter of the Bedrock calls.
+    """
+    cached = warm_get("section", section_cache_key(target, item))
+    if cached is not None:
+        # Processed by an earlier invocation, the transform stage only sets the extraction date
+        item["description"], item["document"] = cached
+        yield item
+        return
+
+    text = section_text(item["section"])
     try:
-        for section in sections:
-            # Get summary description of the data with bedrock
-            bedrock_description = summarize_json(json.dumps(section))
-            url_name = section["@N"]
-
-            # Process
-            processed_section = process_section_content(
-                "Hospital",
-                f"Part {PART}",
-                f"{TITLE}",
-                title_42["latest_amended_on"],
-                title_42["latest_issue_date"],
-                "Not specified",
-                f"[https://www.ecfr.gov/current/title-{TITLE}/section-{url_name}](https://www.ecfr.gov/current/title-{TITLE}/section-{url_name})",
-                sub_part,
-                (
-                    sub_part_name.split("—", 1)[1]
-                    if "—" in sub_part_name
-                    else sub_part_name
-                ),
-                section,
-                description=bedrock_description,
+        if SUMMARIZER == "extractive":
+            item["description"] = extractive_summary(text)
+        elif SUMMARY_MODE == "batch":
+            item["description"] = queue_batch_summary(item, text, target)
+            if item["description"] is None:
+                item["error"] = SUMMARY_PENDING
+        else:
+            item["description"] = call_with_retries(
+                lambda: invoke_summary(text), limiter, SUMMARY_MAX_RETRIES
             )
+    except Exception as e:
+        item["error"] = e
+        item["description"] = fallback_summary(text)
+    yield item
 
-            # Save processed
-            # niaho-mapper-output/cms-cop/title-42/part-482/subpart-A/482-1.json
-            file_name = section["@N"].replace(".", "-")
-            s3_key = f"niaho-mapper-output/cms-cop/title-{TITLE}/part-{PART}/subpart-{sub_part}/{file_name}.json"
 
-            s3.put_object(
-                Bucket=BUCKET_NAME,
-                Key=s3_key,
-                Body=json.dumps(processed_section, ensure_ascii=False, indent=2),
-                ContentType="application/json",
-            )
+def output_prefix(target):
+    """
+    This creates the S3 prefix the outputs of a part are saved under.
+
+    :param target: The CrawlTarget of the part.
+    """
+    return f"{OUTPUT_ROOT}/title-{target.title}/part-{target.part}"
+
+
+def manifest_s3_key(target):
+    """
+    This creates the S3 key of the RunManifest of a part.
+
+    :param target: The CrawlTarget of the part.
+    """
+    return f"{output_prefix(target)}/_manifest.json"
+
+
+def checkpoint_s3_key(target):
+    """
+    This creates the S3 key of the RunCheckpoint of a part.
+
+    :param target: The CrawlTarget of the part.
+    """
+    return f"{output_prefix(target)}/_checkpoint.json"
+
+
+def section_s3_key(target, sub_part, section_id):
+    """
+    This creates the S3 key a processed section is saved to.
+
+    :param target: The CrawlTarget of the part.
+    :param sub_part: The sub part letter of the section.
+    :param section_id: The section number, e.g. 482.1.
+    """
+    # niaho-mapper-output/cms-cop/title-42/part-482/subpart-A/482-1.json
+    file_name = section_id.replace(".", "-")
+    return f"{output_prefix(target)}/subpart-{sub_part}/{file_name}.json"
+
+
+def batch_s3_key(target, name):
+    """
+    This creates the S3 key of a file of the batch summaries of a part.
+
+    :param target: The CrawlTarget of the part.
+    :param name: The name of the file, e.g. pending/subpart-A.jsonl.
+    """
+    return f"{output_prefix(target)}/batch/{name}"
+
 
+def bundle_s3_key(target, sub_part=None):
+    """
+    This creates the S3 key of a gzip NDJSON bundle, of a sub part or of the whole part if None.
+
+    :param target: The CrawlTarget of the part.
+    :param sub_part: The sub part letter of the bundle.
+    """
+    name = f"subpart-{sub_part}" if sub_part else f"part-{target.part}"
+    return f"{output_prefix(target)}/bundles/{name}.ndjson.gz"
+
+
+def table_s3_key(target, date, extension):
+    """
+    This creates the S3 key of the requirements table of a run, partitioned by the eCFR date.
+
+    :param target: The CrawlTarget of the part.
+    :param date: The eCFR up_to_date_as_of date of the run.
+    :param extension: The file extension, parquet or arrow.
+    """
+    return f"{output_prefix(target)}/tables/requirements/up_to_date_as_of={date}/requirements.{extension}"
+
+
+def write_requirements_table(s3, target, part_bundle):
+    """
+    This writes the requirements table of a part like export_requirements_table, without
+    failing the run: the sections and bundles are already written by then. It returns the key
+    of the table and the error, either one None.
+
+    :param s3: The boto3 S3 client.
+    :param target: The CrawlTarget of the part.
+    :param part_bundle: The gzip NDJSON bundle of the whole part.
+    """
+    try:
+        return export_requirements_table(s3, target, part_bundle), None
+    except Exception as e:
+        print("Requirements table failed for", target.name, e)
+        return None, str(e)
+
+
+def export_requirements_table(s3, target, part_bundle):
+    """
+    This writes every sub requirement of the part as one row of a columnar file.
+    It returns the key that was written.
+
+    :param s3: The boto3 S3 client.
+    :param target: The CrawlTarget of the part.
+    :param part_bundle: The gzip NDJSON bundle of the whole part.
+    """
+    result = write_table(bundle_rows(part_bundle))
+    if result is None:
+        raise RuntimeError("pyarrow is not installed, the requirements table can't be written")
+
+    body, extension = result
+    key = table_s3_key(target, target.metadata["up_to_date_as_of"], extension)
+    s3.put_object(
+        Bucket=BUCKET_NAME,
+        Key=key,
+        Body=body,
+        ContentType="application/vnd.apache.parquet"
+        if extension == "parquet"
+        else "application/vnd.apache.arrow.file",
+    )
+    return key
+
+
+def check_output_formats():
+    """
+    This raises an error if OUTPUT_FORMATS asks for something this Lambda can't write, so the
+    invocation fails instead of reporting success without it: the "table" format needs pyarrow.
+    """
+    if "table" in OUTPUT_FORMATS and not table_supported():
+        raise ValueError(
+            "OUTPUT_FORMATS has table but pyarrow is not installed, "
+            "add pyarrow to the Lambda layer or remove table"
+        )
+
+
+def create_uploader(s3):
+    """
+    This creates the S3Uploader for the formats in OUTPUT_FORMATS.
+
+    :param s3: The boto3 S3 client.
+    """
+    return S3Uploader(
+        s3,
+        BUCKET_NAME,
+        UPLOAD_CONCURRENCY,
+        compact="compact" in OUTPUT_FORMATS,
+        bundles=(
+            BundleWriter()
+            if "bundle" in OUTPUT_FORMATS or "table" in OUTPUT_FORMATS
+            else None
+        ),
+    )
+
+
+def section_items(sections, sub_part, manifest, uploader, deadline):
+    """
+    This yields the pipeline item of every section until the deadline is near. In an incremental
+    run the sections that didn't change are left out, and added to the bundles from their
+    existing objects.
+
+    :param sections: Tuples of the sub part name and the JSON section.
+    :param sub_part: The sub part letter of the sections.
+    :param manifest: The RunManifest of the last run, or None.
+    :param uploader: The S3Uploader of the run.
+    :param deadline: The Deadline of the invocation.
+    """
+    for sub_part_name, section in until_deadline(sections, deadline):
+        # The text is used for the manifest hash
+        text_json = json.dumps(section)
+        if manifest is not None and manifest.is_unchanged(
+            section["@N"], section_content_hash(text_json)
+        ):
+            uploader.bundle_existing(manifest.sections[section["@N"]]["key"], sub_part)
+            continue
+        yield {
+            "sub_part": sub_part,
+            "sub_part_name": sub_part_name,
+            "section": section,
+            "text_json": text_json,
+            "description": None,
+            "error": None,
+        }
+
+
+def mark_incomplete(sub_part, manifest, uploader):
+    """
+    This marks a sub part that was not fully processed, so its bundle isn't written and the
+    sections that weren't reached aren't taken as removed.
+
+    :param sub_part: The sub part letter.
+    :param manifest: The RunManifest of the run, or None.
+    :param uploader: The S3Uploader of the run.
+    """
+    if manifest is not None:
+        manifest.incomplete_sub_parts.add(sub_part)
+    if uploader.bundles is not None:
+        uploader.bundles.incomplete_sub_parts.add(sub_part)
+
+
+def transform_section(item, target):
+    """
+    This is the transform stage of the pipeline, it creates the processed section and keeps it
+    in the warm cache. A section from the warm cache only gets a new extraction date.
+
+    :param item: The section item from describe_section.
+    :param target: The CrawlTarget of the part.
+    """
+    if "document" in item:
+        item["document"] = with_extraction_date(item["document"])
+        yield item
+        return
+
+    section = item["section"]
+    url_name = section["@N"]
+    sub_part_name = item["sub_part_name"]
+    title = target.metadata
+    with metrics.time("transform"):
+        item["document"] = process_section_content(
+            "Hospital",
+            f"Part {target.part}",
+            f"{target.title}",
+            title["latest_amended_on"],
+            title["latest_issue_date"],
+            "Not specified",
+            f"[https://www.ecfr.gov/current/title-{target.title}/section-{url_name}](https://www.ecfr.gov/current/title-{target.title}/section-{url_name})",
+            item["sub_part"],
+            (
+                sub_part_name.split("—", 1)[1]
+                if "—" in sub_part_name
+                else sub_part_name
+            ),
+            section,
+            description=item["description"],
+        )
+    # Sections whose summary failed or is pending are summarized again by the next run
+    if item["error"] is None and item["document"] is not None:
+        get_warm_cache().put(
+            section_cache_key(target, item), (item["description"], item["document"])
+        )
+    yield item
+
+
+def save_section(item, target, manifest, uploader):
+    """
+    This is the last step of the pipeline. It queues the processed section to be written and
+    records it in the manifest. It returns True if the summary of the section failed.
+
+    :param item: The section item from transform_section.
+    :param target: The CrawlTarget of the part.
+    :param manifest: The RunManifest of an incremental run, or None.
+    :param uploader: The S3Uploader the section is written with.
+    """
+    url_name = item["section"]["@N"]
+    error = item["error"]
+    failed = error is not None and error != SUMMARY_PENDING
+    if failed:
+        print("Summary failed for", url_name, error)
+
+    s3_key = section_s3_key(target, item["sub_part"], url_name)
+    uploader.submit(s3_key, item["document"], url_name, item["sub_part"])
+
+    # Failed summaries are left out so the next run tries them again, pending ones are
+    # recorded when the batch job is merged
+    if manifest is not None and error is None:
+        manifest.record(
+            url_name, section_content_hash(item["text_json"]), s3_key, item["sub_part"]
+        )
+    return failed
+
+
+def parse_sub_part(xml_text):
+    """
+    This converts the XML of a sub part to JSON.
+
+    :param xml_text: The sub part XML.
+    """
+    with metrics.time("parse", len(xml_text)):
+        return xmltodict.parse(xml_text)
+
+
+def sub_part_sections(data):
+    """
+    This yields the sub part name and every section of a parsed sub part, including the ones in
+    subject groups.
+
+    :param data: The sub part XML converted to JSON.
+    """
+    if "DIV6" not in data.keys():
+        return
+    sub_part_data = data["DIV6"]
+    sub_part_name = sub_part_data["HEAD"]
+
+    # xmltodict gives a dict instead of a list when there is only one element
+    as_list = lambda value: [value] if isinstance(value, dict) else value or []
+    for section in as_list(sub_part_data.get("DIV8")):
+        yield sub_part_name, section
+    for sub_group in as_list(sub_part_data.get("DIV7")):
+        for section in as_list(sub_group.get("DIV8")):
+            yield sub_part_name, section
+
+
+def read_sub_part(sub_part, session, target, manifest, uploader, deadline, finished):
+    """
+    This is the read stage of the pipeline. It downloads a sub part and yields the item of every
+    section to process, while the rest of the document is still being read with
+    PARSE_MODE=stream. A sub part read by an earlier warm invocation is taken from the warm
+    cache instead. The sub part is added to finished unless the deadline cut it short.
+
+    :param sub_part: The sub part letter to read.
+    :param session: The shared EcfrClient to download with.
+    :param target: The CrawlTarget of the part.
+    :param manifest: The RunManifest of an incremental run, or None.
+    :param uploader: The S3Uploader the sections are written with.
+    :param deadline: The Deadline of the invocation, the rest of the download is left unread
+        once it is reached.
+    :param finished: The list the sub part is added to once it is read to the end.
+    """
+    if deadline is not None and deadline.near():
+        return
+
+    stream = PARSE_MODE == "stream"
+    cached = warm_get("sub_part", sub_part_cache_key(target, sub_part))
+    download = None
+    if cached is None:
+        download = open_sub_part(session, target, sub_part, stream=stream)
+    # The sections are kept as they are read, and put in the warm cache once all of them are
+    read = [] if download is not None and get_warm_cache().enabled else None
+    try:
+        if download is None:
+            yield from section_items(cached, sub_part, manifest, uploader, deadline)
+        elif stream:
+            with download:
+                sections = metrics.timed_iter("parse", iter_response_sections(download))
+                yield from section_items(
+                    remember(((name, section) for name, _, section in sections), read),
+                    sub_part,
+                    manifest,
+                    uploader,
+                    deadline,
+                )
+        else:
+            yield from section_items(
+                remember(sub_part_sections(parse_sub_part(download)), read),
+                sub_part,
+                manifest,
+                uploader,
+                deadline,
+            )
     except Exception as e:
         print(e)
+        mark_incomplete(sub_part, manifest, uploader)
+        read = None
+
+    if deadline is not None and deadline.reached:
+        # The sub part was cut short, it is finished from the checkpoint
+        mark_incomplete(sub_part, manifest, uploader)
+        return
+    if read is not None:
+        get_warm_cache().put(sub_part_cache_key(target, sub_part), read)
+    finished.append(sub_part)
+
+
+def remember(items, kept):
+    """
+    This yields the items, adding each one to kept unless it is None.
+
+    :param items: The iterable of items.
+    :param kept: The list the items are added to, or None.
+    """
+    for item in items:
+        if kept is not None:
+            kept.append(item)
+        yield item
+
+
+def remove_sections(manifest, section_ids):
+    """
+    This deletes the outputs of sections that no longer exist and removes them from the manifest.
+
+    :param manifest: The RunManifest of the incremental run.
+    :param section_ids: The ids of the sections to remove.
+    """
+    removed = []
+    for section_id in section_ids:
+        entry = manifest.remove(section_id)
+        if entry:
+            print("Removing", entry["key"])
+            get_s3().delete_object(Bucket=BUCKET_NAME, Key=entry["key"])
+            removed.append(section_id)
+    return removed
+
+
+def process_unit(target, sub_parts, manifest=None, uploader=None, deadline=None):
+    """
+    This downloads and processes the given sub parts and writes their bundles. It returns a
+    summary that can be sent back from a worker invocation. If the deadline is reached, the sub
+    parts that weren't finished are listed in remaining_sub_parts.
+
+    :param target: The CrawlTarget of the part.
+    :param sub_parts: The sub part letters to process.
+    :param manifest: The RunManifest of an incremental run.
+    :param uploader: The S3Uploader the sections are written with, created if None.
+    :param deadline: The Deadline of the invocation.
+    """
+    s3 = get_s3()
+    uploader = uploader or create_uploader(s3)
+    failed_sections = []
+    finished = []
+    limiter = AdaptiveLimiter(SUMMARY_CONCURRENCY)
+    try:
+        with create_http_session(FETCH_CONCURRENCY) as session:
+            items = run_pipeline(
+                sub_parts,
+                [
+                    Stage(
+                        "read",
+                        lambda sub_part: read_sub_part(
+                            sub_part, session, target, manifest, uploader, deadline, finished
+                        ),
+                        FETCH_CONCURRENCY,
+                    ),
+                    Stage(
+                        "summarize",
+                        lambda item: describe_section(item, target, limiter),
+                        SUMMARY_CONCURRENCY,
+                    ),
+                    Stage(
+                        "transform",
+                        lambda item: transform_section(item, target),
+                        TRANSFORM_CONCURRENCY,
+                    ),
+                ],
+                PIPELINE_QUEUE_SIZE,
+            )
+            # The uploader is the upload stage, submit waits while too many uploads are queued
+            for item in items:
+                try:
+                    if save_section(item, target, manifest, uploader):
+                        failed_sections.append(item["section"]["@N"])
+                except Exception as e:
+                    print(e)
+                    mark_incomplete(item["sub_part"], manifest, uploader)
+    finally:
+        uploads = uploader.close()
+
+    remaining_sub_parts = [sub_part for sub_part in sub_parts if sub_part not in finished]
+
+    batch_records = 0
+    if SUMMARY_MODE == "batch":
+        for sub_part in sub_parts:
+            records = batch_prompts.pop(target.name, sub_part)
+            # An unfinished sub part is processed again, with its records
+            if sub_part not in remaining_sub_parts:
+                key = batch_s3_key(target, f"pending/subpart-{sub_part}.jsonl")
+                write_records(s3, BUCKET_NAME, key, records)
+                batch_records += len(records)
+
+    bundles = []
+    if uploader.bundles is not None:
+        bundles = uploader.bundles.upload(
+            s3, BUCKET_NAME, lambda sub_part: bundle_s3_key(target, sub_part)
+        )
+
+    result = {
+        "target": target.name,
+        "sub_parts": sub_parts,
+        "remaining_sub_parts": remaining_sub_parts,
+        "failed_sections": failed_sections,
+        "failed_uploads": uploader.failed,
+        "uploads": uploads,
+        "bundles": bundles,
+        "batch_records": batch_records,
+    }
+    if manifest is not None:
+        # Failed uploads are forgotten so the next run writes them again
+        for section_id in uploader.failed:
+            manifest.remove(section_id)
+        result["manifest"] = {
+            "sections": manifest.seen_entries(),
+            "seen": sorted(manifest.seen),
+            "incomplete_sub_parts": sorted(manifest.incomplete_sub_parts),
+        }
+    return result
+
+
+def run_worker(event, context):
+    """
+    This processes the unit of sub parts an orchestrator sent. The manifest is only read, the
+    orchestrator merges what the worker reports and saves it. The sections are recorded even
+    when the run isn't incremental, so a checkpoint of the orchestrator can skip them.
+
+    :param event: The worker event, with target, sub_parts, incremental and optionally stop_at
+        and the sections of a checkpoint.
+    :param context: The Lambda context, the worker stops before its timeout or stop_at.
+    """
+    target = CrawlTarget.from_dict(event["target"])
+    manifest = RunManifest()
+    if event.get("incremental"):
+        manifest = RunManifest.load(get_s3(), BUCKET_NAME, manifest_s3_key(target))
+    manifest.sections.update(event.get("sections") or {})
+    return process_unit(
+        target,
+        event["sub_parts"],
+        manifest,
+        deadline=Deadline(context, CHECKPOINT_MARGIN_SECONDS, event.get("stop_at")),
+    )
+
+
+def worker_event(target, sub_parts, incremental, deadline=None, sections=None):
+    """
+    This creates the event a worker processes a unit of sub parts from.
+
+    :param target: The CrawlTarget of the part, its metadata pins the eCFR date for every worker.
+    :param sub_parts: The sub part letters of the unit.
+    :param incremental: Whether the worker skips the sections the manifest has as unchanged.
+    :param deadline: The Deadline of the orchestrator, the worker is done by the time it is near.
+    :param sections: The sections a checkpoint has as processed, the ones of the unit are sent
+        so the worker skips them.
+    """
+    event = {
+        "mode": "worker",
+        "target": target.to_dict(),
+        "sub_parts": sub_parts,
+        "incremental": incremental,
+    }
+    stop_at = deadline.near_at() if deadline is not None else None
+    if stop_at is not None:
+        event["stop_at"] = stop_at
+    if sections:
+        event["sections"] = {
+            section_id: entry
+            for section_id, entry in sections.items()
+            if entry["subpart"] in sub_parts
+        }
+    return event
+
+
+def create_executor(mode, context):
+    """
+    This creates the executor worker events are run on. Fan out workers run as invocations of
+    this function or in local processes, the others on threads of this invocation.
+
+    :param mode: The execution mode of the run.
+    :param context: The Lambda context, it gives the name of the function to invoke.
+    """
+    if mode != "fan_out":
+        return ThreadExecutor(lambda_handler, CRAWL_CONCURRENCY, context)
+    if FAN_OUT_BACKEND == "local":
+        return LocalExecutor(lambda_handler, FAN_OUT_CONCURRENCY)
+    function_name = (
+        context.function_name if context else os.environ["AWS_LAMBDA_FUNCTION_NAME"]
+    )
+    return LambdaExecutor(get_lambda(), function_name, FAN_OUT_CONCURRENCY)
+
+
+def run_workers(mode, context, events, deadline=None):
+    """
+    This runs the worker events on the executor of the mode and yields (event, result, error)
+    as each one finishes. The metrics a worker measured in its own invocation are added to the
+    ones of this invocation. Workers still running when the deadline is near are not waited
+    for, all their sub parts are remaining.
+
+    :param mode: The execution mode, "fan_out" runs the workers as invocations of this function.
+    :param context: The Lambda context.
+    :param events: The worker events.
+    :param deadline: The Deadline of this invocation, or None to wait for every worker.
+    """
+    timeout = deadline.wait_seconds() if deadline is not None else None
+    for event, result, error in create_executor(mode, context).map(events, timeout):
+        if result is not None and "metrics" in result:
+            metrics.merge(result.pop("metrics"))
+        yield event, result, error
+
+
+def fan_out(target, sub_parts, incremental, context, deadline=None, sections=None):
+    """
+    This sends each unit of sub parts to a worker and returns the (event, result, error) of
+    every unit, for gather_results.
+
+    :param target: The CrawlTarget of the part.
+    :param sub_parts: The sub part letters to process.
+    :param incremental: Whether the workers skip the sections the manifest has as unchanged.
+    :param context: The Lambda context, it gives the name of the function to invoke.
+    :param deadline: The Deadline of this invocation, the workers are done by the time it is
+        near and the ones that aren't are not waited for.
+    :param sections: The sections the checkpoint of a resumed run has as processed.
+    """
+    events = [
+        worker_event(target, unit, incremental, deadline, sections)
+        for unit in plan_units(sub_parts, FAN_OUT_UNIT_SIZE)
+    ]
+    return list(run_workers("fan_out", context, events, deadline))
+
+
+def merge_summary(manifest, summary):
+    """
+    This adds what the workers of a part reported to its manifest. The sub parts of a worker that
+    failed or ran out of time are marked incomplete, so their sections don't look removed.
+
+    :param manifest: The RunManifest of the part.
+    :param summary: The run summary gather_results made of the workers' results.
+    """
+    for result in summary["results"]:
+        if "manifest" in result:
+            manifest.merge(**result["manifest"])
+    for unit in summary["failed_units"]:
+        manifest.incomplete_sub_parts.update(unit["sub_parts"])
+    manifest.incomplete_sub_parts.update(summary["remaining_sub_parts"])
+
+
+def plan_part(target, sub_parts, incremental):
+    """
+    This loads the manifest of a part and plans which of the sub parts to process. It returns the
+    manifest, the sub parts and the removed sections, or None if nothing changed since the last run.
+
+    :param target: The CrawlTarget of the part.
+    :param sub_parts: The sub part letters asked for.
+    :param incremental: Whether only the sub parts with changes are processed.
+    """
+    # Sections are recorded even when the run isn't incremental, so a checkpoint can skip them
+    manifest = RunManifest()
+    removed_sections = []
+    if incremental:
+        manifest = RunManifest.load(get_s3(), BUCKET_NAME, manifest_s3_key(target))
+        if manifest.date == target.metadata["up_to_date_as_of"]:
+            return None
+
+        if manifest.sections:
+            sub_parts, removed_sections = plan_incremental_run(
+                manifest, fetch_versions(target), sub_parts
+            )
+            removed_sections = remove_sections(manifest, removed_sections)
+
+    return manifest, sub_parts, removed_sections
+
+
+def finish_part(
+    target,
+    manifest,
+    summary,
+    sub_parts,
+    removed_sections,
+    incremental,
+    bundle_bodies=None,
+    bundle_hashes=None,
+):
+    """
+    This joins the part bundle, writes the requirements table and saves the manifest once every
+    sub part of a run is processed. It returns the run summary of the part.
+
+    :param target: The CrawlTarget of the part.
+    :param manifest: The RunManifest the processed sections were recorded in.
+    :param summary: The run summary gather_results made.
+    :param sub_parts: The sub part letters that were processed.
+    :param removed_sections: The ids of the sections removed before processing.
+    :param incremental: Whether the manifest is the saved one of incremental runs.
+    :param bundle_bodies: A dict of sub part to the bundle bytes still in memory.
+    :param bundle_hashes: A dict of sub part to the hash of the bundle in bundle_bodies.
+    """
+    s3 = get_s3()
+    bundles = summary["bundles"]
+    part_body = None
+    if bundles:
+        part_body = join_bundles(
+            s3,
+            BUCKET_NAME,
+            lambda sub_part: bundle_s3_key(target, sub_part),
+            bundle_s3_key(target),
+            target.sub_parts,
+            bundle_bodies,
+            bundle_hashes,
+        )
+        bundles.append(bundle_s3_key(target))
+
+    table, table_error = None, None
+    if "table" in OUTPUT_FORMATS and part_body:
+        table, table_error = write_requirements_table(s3, target, part_body)
+
+    if incremental:
+        for section_id in summary["failed_uploads"]:
+            manifest.remove(section_id)
+
+    complete = not (
+        summary["failed_sections"]
+        or summary["failed_uploads"]
+        or summary["failed_units"]
+        or (manifest is not None and manifest.incomplete_sub_parts)
+    )
+    batch_pending = SUMMARY_MODE == "batch" and summary.get("batch_records")
+    if incremental:
+        removed_sections += remove_sections(manifest, manifest.dropped_sections(sub_parts))
+        # Keep the old date while something failed so the next run plans those sections again.
+        # Sections waiting for a batch job are not in the manifest yet, the merge sets the date.
+        if complete and not batch_pending:
+            manifest.date = target.metadata["up_to_date_as_of"]
+        manifest.save(s3, BUCKET_NAME, manifest_s3_key(target))
+
+    batch = None
+    if SUMMARY_MODE == "batch":
+        failed_sub_parts = {s for unit in summary["failed_units"] for s in unit["sub_parts"]}
+        batch = submit_batch(
+            target,
+            [sub_part for sub_part in sub_parts if sub_part not in failed_sub_parts],
+            incremental,
+            target.metadata["up_to_date_as_of"] if complete else None,
+        )
+
+    return {
+        "part": target.name,
+        "sub_parts": sub_parts,
+        "failed_sections": summary["failed_sections"],
+        "failed_uploads": summary["failed_uploads"],
+        "failed_units": summary["failed_units"],
+        "remaining_sub_parts": summary["remaining_sub_parts"],
+        "removed_sections": removed_sections,
+        "uploads": summary["uploads"],
+        "bundles": bundles,
+        "table": table,
+        "table_error": table_error,
+        "batch": batch,
+    }
+
+
+def summarize_batch_records(records):
+    """
+    This gets the answers of batch records with invoke_model, for runs too small for a batch
+    job. It returns them in the format of a batch job's output.
+
+    :param records: The batch records.
+    """
+    outputs = []
+    for record, result, error in map_with_retries(
+        records,
+        lambda record: invoke_model_input(record["modelInput"]),
+        concurrency=SUMMARY_CONCURRENCY,
+        max_retries=SUMMARY_MAX_RETRIES,
+    ):
+        output = {"recordId": record["recordId"]}
+        if error:
+            output["error"] = {"errorMessage": str(error)}
+        else:
+            output["modelOutput"] = result
+        outputs.append(output)
+    return outputs
+
+
+def submit_batch(target, sub_parts, incremental, date):
+    """
+    This gathers the batch records the sub parts of a run wrote and submits them as one Bedrock
+    batch inference job. The job is merged right away if it is already finished, otherwise the
+    returned merge_event merges it later. It returns None if there was nothing to summarize.
+
+    :param target: The CrawlTarget of the part.
+    :param sub_parts: The sub part letters whose records are submitted.
+    :param incremental: Whether the merge records the sections in the manifest.
+    :param date: The eCFR date the merge sets on the manifest if every record succeeds, or None
+        if the run had failures.
+    """
+    s3 = get_s3()
+    piece_keys = [batch_s3_key(target, f"pending/subpart-{s}.jsonl") for s in sub_parts]
+    records = []
+    for key in piece_keys:
+        records += read_records(s3, BUCKET_NAME, key)
+    if not records:
+        return None
+
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    job_name = f"title-{target.title}-part-{target.part}-{timestamp}"
+    state = {
+        "job_name": job_name,
+        "target": target.to_dict(),
+        "incremental": incremental,
+        "date": date,
+        "records": {
+            record["recordId"]: {"cache_key": record["cacheKey"], "hash": record["hash"]}
+            for record in records
+        },
+    }
+
+    if SUMMARY_BATCH_BACKEND != "local" and len(records) < SUMMARY_BATCH_MIN_RECORDS:
+        result = apply_batch_outputs(target, state, summarize_batch_records(records))
+        for key in piece_keys:
+            s3.delete_object(Bucket=BUCKET_NAME, Key=key)
+        return dict(result, job=None, status="Completed")
+
+    input_key = batch_s3_key(target, f"{job_name}/input.jsonl")
+    write_records(
+        s3,
+        BUCKET_NAME,
+        input_key,
+        [{"recordId": r["recordId"], "modelInput": r["modelInput"]} for r in records],
+    )
+    output_uri = f"s3://{BUCKET_NAME}/{batch_s3_key(target, f'{job_name}/output/')}"
+    response = get_batch_jobs().create_model_invocation_job(
+        jobName=job_name,
+        roleArn=SUMMARY_BATCH_ROLE_ARN,
+        modelId=SUMMARY_MODEL_ID,
+        inputDataConfig={
+            "s3InputDataConfig": {
+                "s3Uri": f"s3://{BUCKET_NAME}/{input_key}",
+                "s3InputFormat": "JSONL",
+            }
+        },
+        outputDataConfig={"s3OutputDataConfig": {"s3Uri": output_uri}},
+    )
+    state.update(job_arn=response["jobArn"], input_key=input_key, output_uri=output_uri)
+
+    state_key = batch_s3_key(target, f"{job_name}/job.json")
+    s3.put_object(
+        Bucket=BUCKET_NAME,
+        Key=state_key,
+        Body=json.dumps(state),
+        ContentType="application/json",
+    )
+    for key in piece_keys:
+        s3.delete_object(Bucket=BUCKET_NAME, Key=key)
+
+    return merge_batch(state_key)
+
+
+def merge_batch(state_key):
+    """
+    This merges the descriptions of a finished batch job into the processed sections. If the
+    job is still running, it returns its status and the event to merge it with later.
+
+    :param state_key: The key of the job.json submit_batch saved.
+    """
+    s3 = get_s3()
+    state = json.loads(s3.get_object(Bucket=BUCKET_NAME, Key=state_key)["Body"].read())
+    job = get_batch_jobs().get_model_invocation_job(jobIdentifier=state["job_arn"])
+    status = job["status"]
+    if status in BATCH_RUNNING_STATUSES:
+        return {
+            "job": state["job_arn"],
+            "status": status,
+            "records": len(state["records"]),
+            "merge_event": {"batch_merge": state_key},
+        }
+    if status not in BATCH_DONE_STATUSES:
+        raise ValueError(
+            f"The batch job {state['job_arn']} ended as {status}: {job.get('message', '')}"
+        )
+
+    output_bucket, output_key = batch_output_key(
+        state["output_uri"], state["job_arn"], state["input_key"]
+    )
+    outputs = read_records(s3, output_bucket, output_key)
+    result = apply_batch_outputs(CrawlTarget.from_dict(state["target"]), state, outputs)
+    return dict(result, job=state["job_arn"], status=status)
+
+
+def apply_batch_outputs(target, state, outputs):
+    """
+    This writes the descriptions of batch answers into the processed sections, the summary
+    cache, the manifest and the bundles. It returns the merge summary.
+
+    :param target: The CrawlTarget of the part.
+    :param state: The batch state submit_batch made.
+    :param outputs: The answers in the format of a batch job's output.
+    """
+    s3 = get_s3()
+    descriptions = dict()
+    failed_records = []
+    for output in outputs:
+        result = output.get("modelOutput")
+        if output.get("error") or not result:
+            failed_records.append(output["recordId"])
+            continue
+        descriptions[output["recordId"]] = result["results"][0]["outputText"].strip()
+    # Records the job left out are failed too
+    failed_records += [
+        record_id
+        for record_id in state["records"]
+        if record_id not in descriptions and record_id not in failed_records
+    ]
+
+    manifest = None
+    if state["incremental"]:
+        manifest = RunManifest.load(s3, BUCKET_NAME, manifest_s3_key(target))
+
+    uploader = S3Uploader(s3, BUCKET_NAME, UPLOAD_CONCURRENCY, "compact" in OUTPUT_FORMATS)
+    try:
+        for record_id, description in descriptions.items():
+            sub_part, section_id = record_id.split(":", 1)
+            key = section_s3_key(target, sub_part, section_id)
+            try:
+                document = json.loads(
+                    s3.get_object(Bucket=BUCKET_NAME, Key=key)["Body"].read()
+                )
+            except s3.exceptions.NoSuchKey:
+                failed_records.append(record_id)
+                continue
+            document["description"] = description
+            uploader.submit(key, document, section_id)
+
+            record = state["records"][record_id]
+            cache_description(record["cache_key"], description)
+            if manifest is not None:
+                manifest.record(section_id, record["hash"], key, sub_part)
+    finally:
+        uploads = uploader.close()
+
+    if manifest is not None:
+        for section_id in uploader.failed:
+            manifest.remove(section_id)
+        if state["date"] and not failed_records and not uploader.failed:
+            manifest.date = state["date"]
+        manifest.save(s3, BUCKET_NAME, manifest_s3_key(target))
+
+    bundles, table, table_error = [], None, None
+    if "bundle" in OUTPUT_FORMATS or "table" in OUTPUT_FORMATS:
+        bundles, table, table_error = update_bundles(target, descriptions)
+
+    return {
+        "part": target.name,
+        "merged": len(descriptions),
+        "failed_records": failed_records,
+        "failed_uploads": uploader.failed,
+        "uploads": uploads,
+        "bundles": bundles,
+        "table": table,
+        "table_error": table_error,
+    }
+
+
+def update_bundles(target, descriptions):
+    """
+    This rewrites the bundles of the sub parts that got descriptions from a batch job, and the
+    part bundle and requirements table made from them. It returns the bundle keys written, the
+    key of the table and the error of the table.
+
+    :param target: The CrawlTarget of the part.
+    :param descriptions: A dict of batch record id, "<sub part>:<section id>", to description.
+    """
+    s3 = get_s3()
+    writer = BundleWriter()
+    for sub_part in sorted({record_id.split(":", 1)[0] for record_id in descriptions}):
+        try:
+            response = s3.get_object(Bucket=BUCKET_NAME, Key=bundle_s3_key(target, sub_part))
+        except s3.exceptions.NoSuchKey:
+            continue
+        for line in gzip.decompress(response["Body"].read()).splitlines():
+            document = json.loads(line)
+            description = descriptions.get(f"{sub_part}:{document['code']}")
+            if description is not None:
+                document["description"] = description
+            writer.add(sub_part, document)
+
+    bundles = writer.upload(
+        s3,
+        BUCKET_NAME,
+        lambda sub_part: bundle_s3_key(target, sub_part),
+        bundle_s3_key(target),
+        target.sub_parts,
+    )
+    table, table_error = None, None
+    if "table" in OUTPUT_FORMATS and writer.part_body:
+        table, table_error = write_requirements_table(s3, target, writer.part_body)
+    return bundles, table, table_error
+
+
+def save_checkpoint(target, checkpoint, summary, manifest, incremental):
+    """
+    This saves the progress of a part that stopped before the timeout. It returns whether the
+    run got further than the last checkpoint.
+
+    :param target: The CrawlTarget of the part.
+    :param checkpoint: The RunCheckpoint of the run, it is updated and saved.
+    :param summary: The run summary of the finished invocations, this one included.
+    :param manifest: The RunManifest the processed sections were recorded in.
+    :param incremental: Whether the manifest is the saved one of incremental runs.
+    """
+    s3 = get_s3()
+    remaining = summary["remaining_sub_parts"]
+    finished = [sub_part for sub_part in checkpoint.sub_parts if sub_part not in remaining]
+
+    if incremental:
+        for section_id in summary["failed_uploads"]:
+            manifest.remove(section_id)
+        checkpoint.removed_sections += remove_sections(
+            manifest, manifest.dropped_sections(finished)
+        )
+        # The date is kept, the run isn't done
+        manifest.save(s3, BUCKET_NAME, manifest_s3_key(target))
+
+    # The sections of the earlier invocations are kept, this one may not have got to them
+    sections = {
+        section_id: entry
+        for section_id, entry in dict(checkpoint.sections, **manifest.seen_entries()).items()
+        if entry["subpart"] in remaining
+    }
+    made_progress = finished or len(sections) > len(checkpoint.sections)
+    checkpoint.sub_parts = remaining
+    checkpoint.sections = sections
+    checkpoint.summary = {
+        name: summary[name]
+        for name in (
+            "failed_sections",
+            "failed_uploads",
+            "failed_units",
+            "uploads",
+            "bundles",
+            "batch_records",
+        )
+    }
+    checkpoint.continuations += 1
+    checkpoint.save(s3, BUCKET_NAME, checkpoint_s3_key(target))
+    return bool(made_progress)
+
+
+def invoke_continuation(event, context, made_progress, continuations):
+    """
+    This invokes the function again with the event of a continuation, if CHECKPOINT_CONTINUE is
+    "invoke", the run got further and it hasn't been continued too often. It returns whether it
+    was invoked.
+
+    :param event: The event of the next invocation.
+    :param context: The Lambda context, it gives the name of the function to invoke.
+    :param made_progress: Whether the run got further than the last checkpoint.
+    :param continuations: How many times the run has been continued, this time included.
+    """
+    continued = bool(
+        CHECKPOINT_CONTINUE == "invoke"
+        and context is not None
+        and made_progress
+        and continuations <= CHECKPOINT_MAX_CONTINUATIONS
+    )
+    if continued:
+        get_lambda().invoke(
+            FunctionName=context.function_name,
+            InvocationType="Event",
+            Payload=json.dumps(event),
+        )
+    return continued
+
+
+def continue_run(target, checkpoint, summary, manifest, incremental, mode, context):
+    """
+    This saves the progress of a run that stopped before the timeout and continues it, by
+    invoking the function again or by returning the continuation to the caller.
+
+    :param target: The CrawlTarget of the part.
+    :param checkpoint: The RunCheckpoint of the run, it is updated and saved.
+    :param summary: The run summary of the finished invocations, this one included.
+    :param manifest: The RunManifest the processed sections were recorded in.
+    :param incremental: Whether the manifest is the saved one of incremental runs.
+    :param mode: The execution mode, the continuation runs in it too.
+    :param context: The Lambda context, it gives the name of the function to invoke.
+    """
+    made_progress = save_checkpoint(target, checkpoint, summary, manifest, incremental)
+    continuation = {"checkpoint": checkpoint_s3_key(target)}
+    continued = invoke_continuation(
+        {"resume": continuation, "incremental": incremental, "mode": mode},
+        context,
+        made_progress,
+        checkpoint.continuations,
+    )
+    remaining = summary["remaining_sub_parts"]
+
+    return {
+        "message": "Stopped before the timeout, the run continues from the checkpoint",
+        "s3_location": f"s3://{BUCKET_NAME}",
+        "remaining_sub_parts": remaining,
+        "continuation": continuation,
+        "continued": continued,
+    }
+
+
+def load_checkpoint(key, incremental):
+    """
+    This loads the checkpoint of a run to resume. It returns the CrawlTarget, the RunManifest
+    with the sections the checkpoint has as processed, and the RunCheckpoint.
+
+    :param key: The key of the checkpoint object.
+    :param incremental: Whether the manifest is the saved one of incremental runs.
+    """
+    s3 = get_s3()
+    checkpoint = RunCheckpoint.load(s3, BUCKET_NAME, key)
+    if checkpoint is None:
+        raise ValueError(f"The checkpoint {key} was not found")
+    target = CrawlTarget.from_dict(checkpoint.target)
+    manifest = RunManifest()
+    if incremental:
+        manifest = RunManifest.load(s3, BUCKET_NAME, manifest_s3_key(target))
+    manifest.sections.update(checkpoint.sections)
+    return target, manifest, checkpoint
+
+
+def part_summary(outcomes, checkpoint, manifest, merge=True):
+    """
+    This gathers the results of the workers of a part, and of the earlier invocations of a
+    resumed run, into its run summary.
+
+    :param outcomes: The (event, result, error) tuples of the part's workers.
+    :param checkpoint: The RunCheckpoint of the run.
+    :param manifest: The RunManifest of the part.
+    :param merge: Whether what the workers recorded is added to the manifest with
+        merge_summary, False when they recorded in the manifest itself.
+    """
+    # The earlier invocations of a resumed run are added in as one more result
+    summary = gather_results(outcomes + [({"sub_parts": []}, checkpoint.summary, None)])
+    if merge:
+        merge_summary(manifest, summary)
+    return summary
+
+
+def run_part(event, mode, incremental, context):
+    """
+    This processes the default part, or resumes a run of a part from its checkpoint. It returns
+    the body of the handler response.
+
+    :param event: The handler event.
+    :param mode: The execution mode, "single" or "fan_out".
+    :param incremental: Whether only the sections that changed are processed.
+    :param context: The Lambda context.
+    """
+    s3 = get_s3()
+    resume = event.get("resume")
+    deadline = Deadline(context, CHECKPOINT_MARGIN_SECONDS)
+
+    if resume:
+        target, manifest, checkpoint = load_checkpoint(resume["checkpoint"], incremental)
+
+    else:
+        target = CrawlTarget(
+            TITLE,
+            PART,
+            SUB_PARTS,
+            get_title_metadata(TITLE, max_age=TITLES_TTL_SECONDS),
+        )
+        plan = plan_part(target, target.sub_parts, incremental)
+        if plan is None:
+            return {
+                "message": "No changes since the last run",
+                "s3_location": f"s3://{BUCKET_NAME}",
+                "up_to_date_as_of": target.metadata["up_to_date_as_of"],
+            }
+        manifest, sub_parts, removed_sections = plan
+        checkpoint = RunCheckpoint(
+            target.to_dict(), sub_parts, removed_sections=removed_sections
+        )
+
+    sub_parts = checkpoint.sub_parts
+    bundle_bodies, bundle_hashes = None, None
+    if mode == "fan_out":
+        outcomes = fan_out(target, sub_parts, incremental, context, deadline, checkpoint.sections)
+    else:
+        uploader = create_uploader(s3)
+        result = process_unit(target, sub_parts, manifest, uploader, deadline)
+        outcomes = [({"sub_parts": sub_parts}, result, None)]
+        if uploader.bundles is not None:
+            bundle_bodies = uploader.bundles.bodies
+            bundle_hashes = uploader.bundles.hashes
+
+    summary = part_summary(outcomes, checkpoint, manifest, merge=mode == "fan_out")
+    if summary["remaining_sub_parts"]:
+        return continue_run(target, checkpoint, summary, manifest, incremental, mode, context)
+
+    body = finish_part(
+        target,
+        manifest,
+        summary,
+        sub_parts,
+        checkpoint.removed_sections,
+        incremental,
+        bundle_bodies,
+        bundle_hashes,
+    )
+    if resume:
+        RunCheckpoint.delete(s3, BUCKET_NAME, resume["checkpoint"])
+
+    return dict(
+        message="Data processed and saved successfully",
+        s3_location=f"s3://{BUCKET_NAME}",
+        **body,
+    )
+
+
+def discover_targets(wanted):
+    """
+    This finds the sub parts of every part asked for in the eCFR structure of its title. It
+    returns (target, sub_parts) tuples, sub_parts are the ones to crawl.
+
+    :param wanted: The (title, part, sub_parts) tuples of parse_crawl_request.
+    """
+    targets = []
+    structures = dict()
+    for title_number, part, sub_parts in wanted:
+        metadata = get_title_metadata(title_number, max_age=TITLES_TTL_SECONDS)
+        date = metadata["up_to_date_as_of"]
+        if (title_number, date) not in structures:
+            structures[(title_number, date)] = fetch_structure(title_number, date)
+
+        part_node = find_part(structures[(title_number, date)], part)
+        if part_node is None:
+            raise ValueError(f"Part {part} was not found in title {title_number}")
+        sizes = discover_sub_parts(part_node)
+        if not sizes:
+            # The XML of a part without sub parts has no DIV6 to stream the sections from
+            print("Part", part, "of title", title_number, "has no sub parts, it is skipped")
+            continue
+
+        target = CrawlTarget(title_number, part, list(sizes), metadata, sizes)
+        targets.append(
+            (target, [sub_part for sub_part in sub_parts if sub_part in sizes])
+            if sub_parts
+            else (target, target.sub_parts)
+        )
+    return targets
+
+
+def crawl(event, mode, incremental, context):
+    """
+    This crawls every part listed in the event, or resumes a crawl from the checkpoints of its
+    unfinished parts. The sub parts of all the parts are scheduled largest first on one pool of
+    workers, then each part is finished on its own. Parts with sub parts left when the deadline
+    is near are checkpointed and continued like run_part. It returns the body of the handler
+    response, with the parts finished by this invocation.
+
+    :param event: The handler event, with the crawl list or the resume checkpoints.
+    :param mode: The execution mode, "fan_out" runs the workers as invocations of this function.
+    :param incremental: Whether only the sections that changed are processed.
+    :param context: The Lambda context.
+    """
+    s3 = get_s3()
+    resume = event.get("resume")
+    deadline = Deadline(context, CHECKPOINT_MARGIN_SECONDS)
+    parts = []
+    runs = dict()
+    if resume:
+        for key in resume["checkpoints"]:
+            target, manifest, checkpoint = load_checkpoint(key, incremental)
+            runs[target.name] = (target, manifest, checkpoint)
+    else:
+        for target, sub_parts in discover_targets(parse_crawl_request(event["crawl"])):
+            plan = plan_part(target, sub_parts, incremental)
+            if plan is None:
+                parts.append({"part": target.name, "message": "No changes since the last run"})
+                continue
+            manifest, sub_parts, removed_sections = plan
+            checkpoint = RunCheckpoint(
+                target.to_dict(), sub_parts, removed_sections=removed_sections
+            )
+            runs[target.name] = (target, manifest, checkpoint)
+
+    events = [
+        worker_event(target, [sub_part], incremental, deadline, runs[target.name][2].sections)
+        for target, sub_part in schedule_jobs(
+            [(target, checkpoint.sub_parts) for target, _, checkpoint in runs.values()]
+        )
+    ]
+    outcomes = defaultdict(list)
+    for job, result, error in run_workers(mode, context, events, deadline):
+        target = CrawlTarget.from_dict(job["target"])
+        outcomes[target.name].append((job, result, error))
+
+    checkpoints = []
+    made_progress = False
+    continuations = 0
+    for name, (target, manifest, checkpoint) in runs.items():
+        summary = part_summary(outcomes[name], checkpoint, manifest)
+        if summary["remaining_sub_parts"]:
+            made_progress |= save_checkpoint(target, checkpoint, summary, manifest, incremental)
+            continuations = max(continuations, checkpoint.continuations)
+            checkpoints.append(checkpoint_s3_key(target))
+            continue
+        parts.append(
+            finish_part(
+                target,
+                manifest,
+                summary,
+                checkpoint.sub_parts,
+                checkpoint.removed_sections,
+                incremental,
+            )
+        )
+        if resume:
+            RunCheckpoint.delete(s3, BUCKET_NAME, checkpoint_s3_key(target))
+
+    body = {
+        "message": "Crawl finished",
+        "s3_location": f"s3://{BUCKET_NAME}",
+        "parts": parts,
+    }
+    if checkpoints:
+        continuation = {"checkpoints": checkpoints}
+        body["message"] = "Stopped before the timeout, the crawl continues from the checkpoints"
+        body["continuation"] = continuation
+        body["continued"] = invoke_continuation(
+            {"resume": continuation, "incremental": incremental, "mode": mode},
+            context,
+            made_progress,
+            continuations,
+        )
+    return body
 
 
 def lambda_handler(event, context):
@@ -364,45 +2202,28 @@ def lambda_handler(event, context):
     :param event: This is the input payload that Lambda receives from whoever or whatever invoked it.
     :param context: It gives runtime info about the Lambda execution itself.
     """
+    # Workers run on threads of this invocation add to its metrics instead of returning them
+    outermost = metrics.begin()
     try:
-        for sub_part in SUB_PARTS:
-            content_url = f"https://www.ecfr.gov/api/versioner/v1/full/{title_42['up_to_date_as_of']}/title-{TITLE}.xml?part={PART}&subpart={sub_part}"
-            headers = {"Accept": "application/xml"}
-
-            response = requests.get(content_url, headers=headers)
-            response.raise_for_status()
-
-            # Converts XML to JSON
-            data = xmltodict.parse(response.text)
-
-            if "DIV6" in data.keys():
-                sub_part_data = data["DIV6"]
-                sub_part_name = sub_part_data["HEAD"]
-
-                if "DIV8" in sub_part_data.keys():
-                    sections = sub_part_data["DIV8"]
-                    process_sections(sections, sub_part, sub_part_name)
-
-                if "DIV7" in sub_part_data.keys():
-                    sub_group = sub_part_data["DIV7"]
-                    for idx in range(len(sub_group)):
-                        if "DIV8" in sub_group[idx].keys():
-                            sections = sub_group[idx]["DIV8"]
-                            process_sections(
-                                [sections] if isinstance(sections, dict) else sections,
-                                sub_part,
-                                sub_part_name,
-                            )
-
-        return {
-            "statusCode": 200,
-            "body": json.dumps(
-                {
-                    "message": "Data processed and saved successfully",
-                    "s3_location": f"s3://{BUCKET_NAME}",
-                }
-            ),
-        }
+        event = event or {}
+        check_output_formats()
+        mode = event.get("mode", EXECUTION_MODE)
+        if mode == "worker":
+            status_code, body = 200, run_worker(event, context)
+        else:
+            incremental = bool(event.get("incremental", INCREMENTAL))
+            if "batch_merge" in event:
+                body = merge_batch(event["batch_merge"])
+            elif "crawl" in event or "checkpoints" in event.get("resume", {}):
+                body = crawl(event, mode, incremental, context)
+            else:
+                body = run_part(event, mode, incremental, context)
+            status_code = 200
 
     except Exception as e:
-        return {"statusCode": 500, "body": json.dumps({"error": str(e)})}
+        status_code, body = 500, {"error": str(e)}
+
+    summary = metrics.end()
+    if outermost:
+        body["metrics"] = summary
+    return {"statusCode": status_code, "body": json.dumps(body)}
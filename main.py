@@ -1,55 +1,100 @@
-import requests
+import argparse
 import json
+import multiprocessing
+import os
+import threading
 import xmltodict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
 from pathlib import Path
-import re
+from crawl_scheduler import discover_sub_parts, find_part
+from ecfr_client import EcfrClient
+from http_cache import cached_get, create_http_cache
+from requirement_parser import build_contents
+from summary_prompts import section_text
+from summarizers import ExtractiveSummarizer
 
 
 TITLE = 42
 PART = 482
 SUB_PARTS = ["A", "B", "C", "D", "E"]
 
-titles_url = "https://www.ecfr.gov/api/versioner/v1/titles.json"
-headers = {"Accept": "application/json"}
+ECFR_BASE_URL = os.environ.get("ECFR_BASE_URL", "https://www.ecfr.gov")
 
-response = requests.get(titles_url, headers=headers)
-response.raise_for_status()
+# Processes the sub parts are parsed and transformed in, one per core by default. With 1 they
+# are processed in this process.
+MAIN_WORKERS = int(os.environ.get("MAIN_WORKERS", os.cpu_count() or 1))
 
-data = response.json()
-titles = data["titles"]
-title_42 = next(title for title in titles if title["number"] == TITLE)
+# Sub parts downloaded at the same time while the workers process the ones already downloaded
+MAIN_FETCH_CONCURRENCY = int(os.environ.get("MAIN_FETCH_CONCURRENCY", "4"))
 
+# Threads writing the output files
+MAIN_WRITE_CONCURRENCY = int(os.environ.get("MAIN_WRITE_CONCURRENCY", "4"))
 
-def create_a_sub_requirement(text, standard_code):
-    sub = dict()
-    text = text.strip()
-    code_number = ""
+# The eCFR requests time out instead of hanging and are retried, with the same settings as the
+# Lambda; ECFR_HEDGE_PERCENTILE, e.g. 0.95, sends a second request when the first is slow
+ecfr_client = EcfrClient(
+    connect_timeout=float(os.environ.get("ECFR_CONNECT_TIMEOUT", "5")),
+    read_timeout=float(os.environ.get("ECFR_READ_TIMEOUT", "60")),
+    max_retries=int(os.environ.get("ECFR_MAX_RETRIES", "4")),
+    hedge_percentile=(
+        None
+        if os.environ.get("ECFR_HEDGE_PERCENTILE", "off") == "off"
+        else float(os.environ["ECFR_HEDGE_PERCENTILE"])
+    ),
+)
 
-    sub["code"] = ""  # Just to make it come first
-    sub["text"] = text.strip()
+# Local runs keep eCFR responses on disk, set HTTP_CACHE=off to always download
+http_cache = create_http_cache(default_backend="local")
+
+# Local runs don't call Bedrock, the descriptions are picked from the section's own sentences
+summarizer = ExtractiveSummarizer()
+
+
+# Called from main, not at import, so importing this module never touches the network
+def get_title(title_number=TITLE):
+    titles_url = f"{ECFR_BASE_URL}/api/versioner/v1/titles.json"
+    headers = {"Accept": "application/json"}
+
+    with cached_get(ecfr_client, titles_url, headers, http_cache) as response:
+        data = response.json()
+
+    titles = data["titles"]
+    return next(title for title in titles if title["number"] == title_number)
 
-    while sub["text"][0] == "(" and len(sub["text"].split(" ", 1)) > 1:
-        code_number = sub["text"].split()[0].strip()
-        sub["code"] = standard_code + (
-            ""
-            if standard_code
-            and len(standard_code) > 1
-            and code_number
-            and len(code_number) > 1
-            and code_number[1] == standard_code[-2]
-            else code_number
-        )
-        sub["text"] = sub["text"].split(" ", 1)[1].strip()
 
-    return sub
+def find_sub_parts(title_number, date, part):
+    """
+    This returns the sub part letters of a part from the eCFR structure of its title.
 
+    :param title_number: The title number, e.g. 42.
+    :param date: The eCFR up_to_date_as_of date of the title.
+    :param part: The part number.
+    """
+    structure_url = f"{ECFR_BASE_URL}/api/versioner/v1/structure/{date}/title-{title_number}.json"
+    headers = {"Accept": "application/json"}
 
-def is_number(s):
-    try:
-        float(s)
-        return True
-    except ValueError:
-        return False
+    with cached_get(ecfr_client, structure_url, headers, http_cache, immutable=True) as response:
+        part_node = find_part(response.json(), part)
+    if part_node is None:
+        raise ValueError(f"Part {part} was not found in title {title_number}")
+    return list(discover_sub_parts(part_node))
+
+
+def fetch_sub_part(title_number, date, part, sub_part):
+    """
+    This downloads the XML of one sub part and returns it as text.
+
+    :param title_number: The title number.
+    :param date: The eCFR up_to_date_as_of date of the title.
+    :param part: The part number.
+    :param sub_part: The sub part letter.
+    """
+    content_url = f"{ECFR_BASE_URL}/api/versioner/v1/full/{date}/title-{title_number}.xml?part={part}&subpart={sub_part}"
+    headers = {"Accept": "application/xml"}
+
+    with cached_get(ecfr_client, content_url, headers, http_cache, immutable=True) as response:
+        return response.text
 
 
 def process_section_content(
@@ -65,16 +110,6 @@ def process_section_content(
     sub_part_name,
     section_data,
 ):
-
-    # Pattern hierarchies lowercase -> number -> roman -> uppercase
-    is_a_upper_pattern = re.compile(r"^\([A-Z]")
-    is_a_roman_pattern = re.compile(r"^\([ivxlcdm]")
-    is_a_lower_case_pattern = re.compile(r"^\([a-hj-uwyz]")
-    is_a_number_pattern = re.compile(r"^\([1-9]")
-
-    section_data = json.dumps(section_data, ensure_ascii=False)
-    section_data = json.loads(section_data)
-
     section_id = section_data["@N"]
     file_name = section_id.replace(".", "_")
     print("Saving", file_name)
@@ -91,10 +126,9 @@ def process_section_content(
     section_dict["regulation_source"] = "cms_cop"
     section_dict["code"] = section_id
     section_dict["title"] = section_data["HEAD"].split(section_id, 1)[1].strip()
-    section_dict["description"] = "FIND THIS"
+    section_dict["description"] = summarizer.summarize(section_text(section_data))
     section_dict["subpart"] = sub_part
     section_dict["subpart_name"] = sub_part_name
-    contents_array = []
 
     # Some Ps are just strings
     source_array = (
@@ -103,122 +137,7 @@ def process_section_content(
         else [section_data["P"]]
     )
 
-    current_content_dict = dict()
-    last_number_sub_requirement = dict()
-    last_roman_sub_requirement = dict()
-    last_lower_sub_requirement = dict()
-    last_upper_sub_requirement = dict()
-    jump_from_lower_to_numeral = False
-
-    for content in source_array:
-        it_is_a_lower = isinstance(content, str) and bool(
-            is_a_lower_case_pattern.match(content.strip())
-        )
-        if isinstance(content, dict) or it_is_a_lower:
-            if len(current_content_dict.keys()) > 0:
-                contents_array.append(current_content_dict)
-            current_content_dict = dict()
-
-            text = ""
-            if it_is_a_lower:
-                text = content.strip()
-            else:
-                text = content["#text"].strip()
-
-            current_content_dict["standard_code"] = section_id + (
-                text.split(" ")[0] if text[0] == "(" else ""
-            )
-
-            # Do requirement
-            if it_is_a_lower:
-                current_content_dict["requirement"] = ""
-            else:
-                current_content_dict["requirement"] = (
-                    content["I"][0].strip().strip(".")
-                    if isinstance(content["I"], list)
-                    else content["I"].strip().strip(".")
-                )
-
-            # Create the first sub requirement unit
-            last_lower_sub_requirement = create_a_sub_requirement(
-                text, current_content_dict["standard_code"]
-            )
-
-            sub_requirements = current_content_dict.get("sub_requirements", [])
-            sub_requirements.append(last_lower_sub_requirement)
-            current_content_dict["sub_requirements"] = sub_requirements
-
-            # To take care of items that have letter and number on one line
-            if len(last_lower_sub_requirement["code"]) > 2 and is_number(
-                last_lower_sub_requirement["code"][-2]
-            ):
-                jump_from_lower_to_numeral = True
-                last_number_sub_requirement = last_lower_sub_requirement
-            else:
-                jump_from_lower_to_numeral = False
-
-        else:
-            # For number sub requirements
-            if bool(is_a_number_pattern.match(content.strip())):
-                # To take care of items that have letter and number on one line
-                lower_or_main = dict()
-                if jump_from_lower_to_numeral:
-                    lower_or_main = current_content_dict
-                else:
-                    lower_or_main = last_lower_sub_requirement
-
-                last_number_sub_requirement = create_a_sub_requirement(
-                    content.strip(),
-                    (
-                        lower_or_main["code"]
-                        if lower_or_main.get("code", False)
-                        else lower_or_main["standard_code"]
-                    ),
-                )
-
-                sub_requirements = lower_or_main.get("sub_requirements", [])
-                sub_requirements.append(last_number_sub_requirement)
-                lower_or_main["sub_requirements"] = sub_requirements
-
-            # For roman numerals sub requirements
-            elif bool(is_a_roman_pattern.match(content.strip())):
-                last_roman_sub_requirement = create_a_sub_requirement(
-                    content.strip(), last_number_sub_requirement["code"]
-                )
-                sub_requirements = last_number_sub_requirement.get(
-                    "sub_requirements", []
-                )
-                sub_requirements.append(last_roman_sub_requirement)
-                last_number_sub_requirement["sub_requirements"] = sub_requirements
-
-            # For capital letter sub requirements
-            elif bool(is_a_upper_pattern.match(content.strip())):
-                last_upper_sub_requirement = create_a_sub_requirement(
-                    content.strip(), last_roman_sub_requirement["code"]
-                )
-                sub_requirements = last_roman_sub_requirement.get(
-                    "sub_requirements", []
-                )
-                sub_requirements.append(last_upper_sub_requirement)
-                last_roman_sub_requirement["sub_requirements"] = sub_requirements
-                pass
-
-            # For first level section
-            else:
-                sub_requirements = current_content_dict.get("sub_requirements", [])
-                last_level_2_sub_requirement = create_a_sub_requirement(
-                    content.strip(),
-                    current_content_dict.get("standard_code", section_id),
-                )
-                sub_requirements.append(last_level_2_sub_requirement)
-                if not current_content_dict.get("requirement", None):
-                    current_content_dict["requirement"] = ""
-                current_content_dict["sub_requirements"] = sub_requirements
-
-    if len(current_content_dict.keys()) > 0:
-        contents_array.append(current_content_dict)
-
-    section_dict["content"] = contents_array
+    section_dict["content"] = build_contents(section_id, source_array)
 
     section_dict["metadata"] = {
         "facility_type": facility_type,
@@ -234,63 +153,236 @@ def process_section_content(
     return section_dict
 
 
-def process_section(sections):
-    for section in sections:
-
-        file_name = section["@N"].replace(".", "_")
-        print("Saving", file_name)
-
-        # Save original
-        path = Path(f"original/{file_name}.json").resolve()
-        with open(path, "w") as f:
-            json.dump(section, f, indent=2)
-
-        # Process
+def sub_part_sections(data):
+    """
+    This yields the sections of a parsed sub part, including the ones in subject groups (DIV7).
+    xmltodict gives a single child as a dict instead of a list.
+
+    :param data: The xmltodict document of the sub part.
+    """
+    sub_part_data = data.get("DIV6") or dict()
+    groups = [sub_part_data]
+    sub_groups = sub_part_data.get("DIV7", [])
+    groups.extend([sub_groups] if isinstance(sub_groups, dict) else sub_groups)
+    for group in groups:
+        sections = group.get("DIV8", [])
+        yield from [sections] if isinstance(sections, dict) else sections
+
+
+def transform_sub_part(title_number, date, part, sub_part, xml, extraction_date):
+    """
+    This parses the XML of a sub part and transforms its sections. It only uses the CPU, so it
+    runs in the worker processes. It returns (file name, original JSON, processed JSON) tuples,
+    serialized here so the main process only writes them.
+
+    :param title_number: The title number.
+    :param date: The eCFR up_to_date_as_of date of the title.
+    :param part: The part number.
+    :param sub_part: The sub part letter.
+    :param xml: The XML of the sub part.
+    :param extraction_date: The time of the run, the same for every section.
+    """
+    data = xmltodict.parse(xml)
+    sub_part_name = (data.get("DIV6") or dict()).get("HEAD") or ""
+    sub_part_name = sub_part_name.split("—", 1)[1] if "—" in sub_part_name else sub_part_name
+
+    outputs = []
+    for section in sub_part_sections(data):
+        section_id = section["@N"]
         processed_section = process_section_content(
             "Hospital",
-            "Part 482",
-            "42",
-            "2025-09-29",
-            "2025-09-29",
+            f"Part {part}",
+            f"{title_number}",
+            date,
+            date,
             "Not specified",
-            "2025-11-05T02:48:03.508545Z",
-            "[https://www.ecfr.gov/current/title-42/section-482.1](https://www.ecfr.gov/current/title-42/section-482.1)",
-            "A",
-            "General Provisions",
+            extraction_date,
+            f"[https://www.ecfr.gov/current/title-{title_number}/section-{section_id}](https://www.ecfr.gov/current/title-{title_number}/section-{section_id})",
+            sub_part,
+            sub_part_name.strip(),
             section,
         )
-
-        # Save processed
-        path = Path(f"processed/{file_name}.json").resolve()
-        with open(path, "w") as f:
-            json.dump(processed_section, f, indent=2)
+        outputs.append(
+            (
+                section_id.replace(".", "_"),
+                json.dumps(section, indent=2),
+                json.dumps(processed_section, indent=2),
+            )
+        )
+    return outputs
+
+
+def write_file(path, body):
+    """
+    This writes a whole output file with one write call.
+
+    :param path: The path of the file.
+    :param body: The text of the file.
+    """
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(body)
+
+
+class OutputWriter:
+    """
+    This writes the output files on a pool of threads, so the main process goes on collecting
+    the results of the workers while the files are written. write blocks when too many files
+    are waiting, so the results don't pile up in memory.
+    """
+
+    def __init__(self, directory, concurrency=MAIN_WRITE_CONCURRENCY):
+        """
+        :param directory: The directory original/ and processed/ are created in.
+        :param concurrency: The number of files written at the same time.
+        """
+        self.directory = Path(directory)
+        for name in ("original", "processed"):
+            (self.directory / name).mkdir(parents=True, exist_ok=True)
+        concurrency = max(concurrency, 1)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._slots = threading.BoundedSemaphore(concurrency * 4)
+        self._lock = threading.Lock()
+        self.written = 0
+        self.failed = []
+
+    def write(self, folder, file_name, body):
+        """
+        This queues a file to be written.
+
+        :param folder: original or processed.
+        :param file_name: The name of the file, without .json.
+        :param body: The text of the file.
+        """
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(
+                self._write, self.directory / folder / f"{file_name}.json", body
+            )
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+    def _write(self, path, body):
+        try:
+            write_file(path, body)
+            with self._lock:
+                self.written += 1
+        except Exception as e:
+            print("Write failed for", path, e)
+            with self._lock:
+                self.failed.append(str(path))
+
+    def close(self):
+        """
+        This waits for the queued files to be written and returns how many were written and
+        failed.
+        """
+        self._executor.shutdown(wait=True)
+        return {"written": self.written, "failed": len(self.failed)}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def create_executor(workers):
+    """
+    This creates the pool the sub parts are transformed in: worker processes, or one thread of
+    this process when workers is 1.
+
+    :param workers: The number of worker processes.
+    """
+    if workers <= 1:
+        return ThreadPoolExecutor(max_workers=1)
+    # The workers start while the download and write threads run, a forked one could copy a
+    # lock held by one of them
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Extracts eCFR parts to original/ and processed/ JSON files."
+    )
+    parser.add_argument("--title", type=int, default=TITLE)
+    parser.add_argument("--parts", type=int, nargs="+", default=[PART])
+    parser.add_argument(
+        "--sub-parts",
+        nargs="+",
+        help="The sub parts of every part, all of a part's sub parts if not given. "
+        f"Defaults to {' '.join(SUB_PARTS)} for part {PART}.",
+    )
+    parser.add_argument("--output-dir", default=".")
+    parser.add_argument("--workers", type=int, default=MAIN_WORKERS)
+    return parser.parse_args(argv)
 
 
 # Now get the data
-def main():
-    for sub_part in SUB_PARTS:
-        content_url = f"https://www.ecfr.gov/api/versioner/v1/full/{title_42['up_to_date_as_of']}/title-{TITLE}.xml?part={PART}&subpart={sub_part}"
-        headers = {"Accept": "application/xml"}
-
-        response = requests.get(content_url, headers=headers)
-        response.raise_for_status()
-
-        data = xmltodict.parse(response.text)
-
-        if "DIV6" in data.keys():
-            sub_part_data = data["DIV6"]
-            if "DIV8" in sub_part_data.keys():
-                sections = sub_part_data["DIV8"]
-                process_section(sections)
-
-            if "DIV7" in sub_part_data.keys():
-                sub_group = sub_part_data["DIV7"]
-                for idx in range(len(sub_group)):
-                    if "DIV8" in sub_group[idx].keys():
-                        sections = sub_group[idx]["DIV8"]
-                        process_section(
-                            [sections] if isinstance(sections, dict) else sections
-                        )
+def main(argv=None):
+    args = parse_args(argv)
+    title = get_title(args.title)
+    date = title["up_to_date_as_of"]
+    extraction_date = (
+        datetime.now(timezone.utc).isoformat(timespec="microseconds").replace("+00:00", "Z")
+    )
+
+    jobs = []
+    for part in args.parts:
+        if args.sub_parts:
+            sub_parts = args.sub_parts
+        elif args.title == TITLE and part == PART:
+            sub_parts = SUB_PARTS
+        else:
+            sub_parts = find_sub_parts(args.title, date, part)
+        jobs.extend((part, sub_part) for sub_part in sub_parts)
+
+    failed = []
+    sections = 0
+    with OutputWriter(args.output_dir) as writer, create_executor(
+        args.workers
+    ) as executor, ThreadPoolExecutor(max_workers=max(MAIN_FETCH_CONCURRENCY, 1)) as fetcher:
+        downloads = {
+            fetcher.submit(fetch_sub_part, args.title, date, part, sub_part): (part, sub_part)
+            for part, sub_part in jobs
+        }
+        transforms = dict()
+        for download in as_completed(downloads):
+            part, sub_part = downloads[download]
+            try:
+                future = executor.submit(
+                    transform_sub_part,
+                    args.title,
+                    date,
+                    part,
+                    sub_part,
+                    download.result(),
+                    extraction_date,
+                )
+                transforms[future] = (part, sub_part)
+            except Exception as e:
+                print("Download failed for part", part, "subpart", sub_part, e)
+                failed.append(f"{part}/{sub_part}")
+
+        for future in as_completed(transforms):
+            part, sub_part = transforms[future]
+            try:
+                outputs = future.result()
+            except Exception as e:
+                print("Processing failed for part", part, "subpart", sub_part, e)
+                failed.append(f"{part}/{sub_part}")
+                continue
+            for file_name, original, processed in outputs:
+                writer.write("original", file_name, original)
+                writer.write("processed", file_name, processed)
+            sections += len(outputs)
+
+    print("Processed", sections, "sections,", writer.written, "files written")
+    print("eCFR requests:", ecfr_client.stats.to_dict())
+    if failed or writer.failed:
+        print("Failed sub parts:", failed, "failed files:", writer.failed)
+    return {"sections": sections, "failed_sub_parts": failed, "failed_files": writer.failed}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,186 @@
+import gzip
+import hashlib
+import io
+import re
+import tempfile
+import threading
+from s3_uploader import HASH_METADATA_KEY, compact_json, document_hash, put_if_changed
+
+
+def section_sort_key(code):
+    """
+    This returns the sort key of a section id, its numbers compared as numbers so 482.2 comes
+    before 482.12.
+
+    :param code: The section id, e.g. 482.12.
+    """
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", code)]
+
+
+def bundle_hash(hashes):
+    """
+    This joins the hashes of the lines of a bundle, or of the bundles of a part, in order.
+
+    :param hashes: The hashes.
+    """
+    return hashlib.sha256("".join(hashes).encode("utf-8")).hexdigest()
+
+
+class BundleWriter:
+    """
+    This writes processed sections into one gzip-compressed NDJSON file per sub part, and joins
+    them into one file for the whole part. The lines are spooled to disk while the run goes, so
+    the documents don't stay in memory, and are written sorted by section id, so the same
+    sections give the same bytes whatever order they were uploaded in. A bundle whose hash is
+    the one already stored on the object in the bucket isn't written again.
+    """
+
+    def __init__(self):
+        # Sub part to its spool file and the (sort key, hash, offset, length) of its lines
+        self._files = dict()
+        self._lock = threading.Lock()
+        self.incomplete_sub_parts = set()
+        self.bodies = dict()
+        self.hashes = dict()
+        self.part_body = None
+
+    def add(self, sub_part, document, text=None):
+        """
+        This adds a processed section to its sub part's bundle.
+
+        :param sub_part: The sub part letter of the section.
+        :param document: The processed section dict.
+        :param text: The document already serialized with compact_json, if it was.
+        """
+        text = text or compact_json(document)
+        line = (text + "\n").encode("utf-8")
+        # The hash leaves out the extraction date, like the hash of the section's own object
+        line_hash = document_hash(text, document, "bundle")
+        sort_key = section_sort_key(document.get("code", ""))
+        with self._lock:
+            if sub_part not in self._files:
+                self._files[sub_part] = (tempfile.TemporaryFile(), [])
+            spool, lines = self._files[sub_part]
+            lines.append((sort_key, line_hash, spool.tell(), len(line)))
+            spool.write(line)
+
+    def finish(self):
+        """
+        This closes the bundles and returns a dict of sub part to its compressed bytes, in sub
+        part order, and keeps the hash of each one in hashes. Sub parts that stopped on an error
+        are left out, their old bundle stays in place.
+        """
+        bundles = dict()
+        with self._lock:
+            for sub_part in sorted(self._files):
+                spool, lines = self._files[sub_part]
+                if sub_part not in self.incomplete_sub_parts:
+                    lines.sort()
+                    bundles[sub_part] = compress_lines(spool, lines)
+                    self.hashes[sub_part] = bundle_hash(line[1] for line in lines)
+                spool.close()
+            self._files = dict()
+        return bundles
+
+    def upload(self, s3, bucket, sub_part_key, part_key=None, sub_parts=None):
+        """
+        This uploads the bundle of every sub part processed this run and, if part_key is given,
+        rebuilds the part bundle with join_bundles. The sub part bundles are kept in bodies and
+        the part bundle in part_body. It returns the keys of the bundles, also the ones that
+        were already up to date.
+
+        :param s3: The boto3 S3 client.
+        :param bucket: The bucket to write to.
+        :param sub_part_key: A function that returns the bundle key of a sub part.
+        :param part_key: The key of the part bundle, or None to only write the sub part bundles.
+        :param sub_parts: All the sub part letters of the part, in order.
+        """
+        self.bodies = self.finish()
+        written = []
+        for sub_part, body in self.bodies.items():
+            put_bundle(s3, bucket, sub_part_key(sub_part), body, self.hashes[sub_part])
+            written.append(sub_part_key(sub_part))
+
+        if not self.bodies or part_key is None:
+            return written
+
+        self.part_body = join_bundles(
+            s3, bucket, sub_part_key, part_key, sub_parts, self.bodies, self.hashes
+        )
+        written.append(part_key)
+        return written
+
+
+def compress_lines(spool, lines):
+    """
+    This gzips the lines of a bundle from its spool file, in the order given.
+
+    :param spool: The file the lines were written to.
+    :param lines: The (sort key, hash, offset, length) of the lines.
+    """
+    raw = io.BytesIO()
+    # mtime=0 so the same content always compresses to the same bytes
+    with gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as gz:
+        for _, _, offset, length in lines:
+            spool.seek(offset)
+            gz.write(spool.read(length))
+    return raw.getvalue()
+
+
+def join_bundles(s3, bucket, sub_part_key, part_key, sub_parts, bodies=None, hashes=None):
+    """
+    This rebuilds and uploads the part bundle, and returns its bytes. Gzip files can be joined end
+    to end, so the part bundle is the sub part bundles one after the other. The ones that aren't
+    in bodies are read back from S3. Its hash is made from the hashes of the sub part bundles,
+    so it is only written again when one of them changed.
+
+    :param s3: The boto3 S3 client.
+    :param bucket: The bucket to write to.
+    :param sub_part_key: A function that returns the bundle key of a sub part.
+    :param part_key: The key of the part bundle.
+    :param sub_parts: All the sub part letters of the part, in order.
+    :param bodies: A dict of sub part to the compressed bytes already in memory.
+    :param hashes: A dict of sub part to the hash of the bundle in bodies.
+    """
+    bodies = bodies or dict()
+    hashes = hashes or dict()
+    part_body = b""
+    part_hashes = []
+    for sub_part in sub_parts:
+        if sub_part in bodies:
+            body, content_hash = bodies[sub_part], hashes.get(sub_part)
+        else:
+            try:
+                response = s3.get_object(Bucket=bucket, Key=sub_part_key(sub_part))
+            except s3.exceptions.NoSuchKey:
+                continue
+            body = response["Body"].read()
+            content_hash = response.get("Metadata", {}).get(HASH_METADATA_KEY)
+        part_body += body
+        # A bundle written before the hashes were stored is hashed by its bytes
+        part_hashes.append(content_hash or hashlib.sha256(body).hexdigest())
+
+    put_bundle(s3, bucket, part_key, part_body, bundle_hash(part_hashes))
+    return part_body
+
+
+def put_bundle(s3, bucket, key, body, content_hash):
+    """
+    This writes a gzip-compressed NDJSON bundle, unless the object in the bucket has the same
+    hash. It returns True if it was written.
+
+    :param s3: The boto3 S3 client.
+    :param bucket: The bucket to write to.
+    :param key: The key of the bundle.
+    :param body: The compressed bytes.
+    :param content_hash: The hash of the bundle, from bundle_hash.
+    """
+    return put_if_changed(
+        s3,
+        bucket,
+        key,
+        body,
+        content_hash,
+        ContentType="application/x-ndjson",
+        ContentEncoding="gzip",
+    )
@@ -0,0 +1,180 @@
+import re
+
+# Enumerator kinds, the hierarchy goes lowercase -> number -> roman -> uppercase
+LOWER = "lower"
+NUMBER = "number"
+ROMAN = "roman"
+UPPER = "upper"
+
+# Kind of a paragraph by the character after its opening "(". i, v and x are left out of the
+# lowercase letters because they are roman numerals, c, d, l and m are both but lowercase wins.
+_KINDS = dict()
+_KINDS.update(dict.fromkeys("ABCDEFGHIJKLMNOPQRSTUVWXYZ", UPPER))
+_KINDS.update(dict.fromkeys("ivxlcdm", ROMAN))
+_KINDS.update(dict.fromkeys("123456789", NUMBER))
+_KINDS.update(dict.fromkeys("abcdefghjklmnopqrstuwyz", LOWER))
+
+# Every leading "(x) " code followed by a plain space, matched in one go. Group 1 is the last one.
+_LEADING_CODES = re.compile(r"(?:(\(\S*) \s*)*")
+_TOKEN_END = re.compile(r"\S*")
+_WHITESPACE = re.compile(r"\s*")
+
+
+def classify(text):
+    """
+    This returns the kind of enumerator a stripped paragraph starts with, or None.
+
+    :param text: The stripped paragraph text.
+    """
+    if len(text) > 1 and text[0] == "(":
+        return _KINDS.get(text[1])
+    return None
+
+
+def split_leading_codes(text):
+    """
+    This reads every leading "(x)" code of a stripped text in one scan. It returns the last code
+    read and the text after the codes. A code is only read if a space follows somewhere, so a
+    text that is nothing but a code is kept as it is.
+
+    :param text: The stripped text, it must not be empty.
+    """
+    match = _LEADING_CODES.match(text)
+    code_number = match.group(1)
+    position = match.end()
+    if position == len(text) or text[position] != "(":
+        return code_number, text[position:] if position else text
+
+    # A code followed by a tab or a new line, or with no space after it
+    while text[position] == "(":
+        space = text.find(" ", position)
+        if space == -1:
+            break
+        code_number = text[position : _TOKEN_END.match(text, position).end()]
+        position = _WHITESPACE.match(text, space + 1).end()
+    return code_number, text[position:]
+
+
+def is_number(s):
+    """
+    Checks if a string is a number.
+
+    :param s: The string to check.
+    """
+    try:
+        float(s)
+        return True
+    except ValueError:
+        return False
+
+
+def sub_requirement(text, standard_code):
+    """
+    This creates a sub requirement from a stripped, non empty text.
+
+    :param text: The stripped text of the sub requirement.
+    :param standard_code: The code of the requirement it belongs to.
+    """
+    code_number, text = split_leading_codes(text)
+    if code_number is None:
+        return {"code": "", "text": text}
+
+    # A code that repeats the last letter of the standard code isn't added again
+    if (
+        len(standard_code) > 1
+        and len(code_number) > 1
+        and code_number[1] == standard_code[-2]
+    ):
+        return {"code": standard_code, "text": text}
+    return {"code": standard_code + code_number, "text": text}
+
+
+def build_contents(section_id, paragraphs):
+    """
+    This builds the content list of a section from its P paragraphs. Every paragraph is
+    stripped and classified once, and the last requirement of each level is kept so a new one
+    can be hung under the level above it.
+
+    :param section_id: The section number, e.g. 482.12.
+    :param paragraphs: The P items of the section, strings or dicts with #text and I.
+    """
+    contents = []
+    current = dict()
+    # The last sub requirement seen at each level of the hierarchy
+    last_lower = dict()
+    last_number = dict()
+    last_roman = dict()
+    jump_from_lower_to_numeral = False
+
+    for content in paragraphs:
+        is_text = isinstance(content, str)
+        kind = None
+        if is_text:
+            text = content.strip()
+            kind = classify(text)
+
+        # A paragraph with an italic heading or a lowercase code starts a new standard
+        if kind is LOWER or not is_text:
+            if current:
+                contents.append(current)
+            current = dict()
+
+            if not is_text:
+                text = content["#text"].strip()
+
+            if text[0] == "(":
+                space = text.find(" ")
+                standard_code = section_id + (text if space == -1 else text[:space])
+            else:
+                standard_code = section_id
+            current["standard_code"] = standard_code
+
+            if is_text:
+                current["requirement"] = ""
+            else:
+                heading = content["I"][0] if isinstance(content["I"], list) else content["I"]
+                current["requirement"] = heading.strip().strip(".")
+
+            last_lower = sub_requirement(text, standard_code)
+            current["sub_requirements"] = [last_lower]
+
+            # To take care of items that have letter and number on one line
+            code = last_lower["code"]
+            if len(code) > 2 and is_number(code[-2]):
+                jump_from_lower_to_numeral = True
+                last_number = last_lower
+            else:
+                jump_from_lower_to_numeral = False
+
+        elif kind is NUMBER:
+            parent = current if jump_from_lower_to_numeral else last_lower
+            last_number = sub_requirement(
+                text,
+                parent["code"] if parent.get("code", False) else parent["standard_code"],
+            )
+            parent.setdefault("sub_requirements", []).append(last_number)
+
+        elif kind is ROMAN:
+            last_roman = sub_requirement(text, last_number["code"])
+            last_number.setdefault("sub_requirements", []).append(last_roman)
+
+        elif kind is UPPER:
+            last_upper = sub_requirement(text, last_roman["code"])
+            last_roman.setdefault("sub_requirements", []).append(last_upper)
+
+        # For first level section
+        else:
+            sub_requirements = current.get("sub_requirements", [])
+            sub_requirements.append(
+                sub_requirement(text, current.get("standard_code", section_id))
+                if text
+                else None
+            )
+            if not current.get("requirement", None):
+                current["requirement"] = ""
+            current["sub_requirements"] = sub_requirements
+
+    if current:
+        contents.append(current)
+
+    return contents
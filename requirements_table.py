@@ -0,0 +1,128 @@
+import gzip
+import json
+
+# pyarrow is optional, it is only needed when the "table" output format is chosen
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Column name and pyarrow type name of the flattened requirements table
+COLUMNS = [
+    ("regulation_id", "string"),
+    ("section", "string"),
+    ("section_title", "string"),
+    ("subpart", "string"),
+    ("subpart_name", "string"),
+    ("standard_code", "string"),
+    ("requirement", "string"),
+    ("code", "string"),
+    ("parent_code", "string"),
+    ("depth", "int32"),
+    ("text", "string"),
+    ("title_number", "string"),
+    ("part_label", "string"),
+    ("version", "string"),
+    ("effective_date", "string"),
+    ("extraction_date", "string"),
+]
+
+
+def flatten_section(document):
+    """
+    This turns the nested content of a processed section into one row per sub requirement.
+    depth is 1 for the sub requirements right under a standard, 2 for theirs, and so on.
+
+    :param document: The processed section dict.
+    """
+    metadata = document.get("metadata") or dict()
+    base = {
+        "regulation_id": document.get("regulation_id"),
+        "section": document.get("code"),
+        "section_title": document.get("title"),
+        "subpart": document.get("subpart"),
+        "subpart_name": document.get("subpart_name"),
+        "title_number": metadata.get("title_number"),
+        "part_label": metadata.get("part_label"),
+        "version": metadata.get("version"),
+        "effective_date": metadata.get("effective_date"),
+        "extraction_date": metadata.get("extraction_date"),
+    }
+
+    for content in document.get("content") or []:
+        standard = dict(
+            base,
+            standard_code=content.get("standard_code"),
+            requirement=content.get("requirement"),
+        )
+        # The first sub requirement of a standard carries the standard's own code, its parent is
+        # the section. Walked with a stack instead of recursion, in document order. An empty
+        # paragraph is kept as None by build_contents and has no row.
+        stack = [
+            (
+                sub,
+                document.get("code")
+                if sub.get("code") == content.get("standard_code")
+                else content.get("standard_code"),
+                1,
+            )
+            for sub in reversed(content.get("sub_requirements") or [])
+            if sub
+        ]
+        while stack:
+            sub, parent_code, depth = stack.pop()
+            yield dict(
+                standard,
+                code=sub.get("code"),
+                parent_code=parent_code,
+                depth=depth,
+                text=sub.get("text"),
+            )
+            for child in reversed(sub.get("sub_requirements") or []):
+                if child:
+                    stack.append((child, sub.get("code"), depth + 1))
+
+
+def bundle_rows(bundle_body):
+    """
+    This yields the flattened rows of every section in a gzip NDJSON bundle.
+
+    :param bundle_body: The compressed bytes of the bundle.
+    """
+    for line in gzip.decompress(bundle_body).splitlines():
+        if line.strip():
+            yield from flatten_section(json.loads(line))
+
+
+def table_supported():
+    """
+    This tells whether the table can be written, i.e. pyarrow is installed.
+    """
+    return pa is not None
+
+
+def write_table(rows):
+    """
+    This writes the rows as a Parquet file, or as an Arrow IPC file when pyarrow was built
+    without Parquet. It returns the bytes and the file extension, or None if pyarrow is missing.
+
+    :param rows: The flattened requirement rows.
+    """
+    if pa is None:
+        print("pyarrow is not installed, the requirements table is not written")
+        return None
+
+    schema = pa.schema([(name, getattr(pa, type_name)()) for name, type_name in COLUMNS])
+    table = pa.Table.from_pylist(list(rows), schema=schema)
+    sink = pa.BufferOutputStream()
+
+    try:
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, sink, compression="snappy")
+        return sink.getvalue().to_pybytes(), "parquet"
+
+    except ImportError:
+        with pa.ipc.new_file(sink, schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes(), "arrow"
@@ -0,0 +1,164 @@
+import hashlib
+import json
+
+
+def section_content_hash(section_text):
+    """
+    This creates a hash of the section's content.
+
+    :param section_text: The section as parsed from the eCFR XML, serialized to JSON. The keys
+        follow the order of the XML, so the same content always gives the same text.
+    """
+    return hashlib.sha256(section_text.encode("utf-8")).hexdigest()
+
+
+class RunManifest:
+    """
+    This records what the last run produced: the eCFR date it processed, and the content hash,
+    output key and sub part of every section. It is compared with the next run to only redo
+    sections that are new or changed.
+    """
+
+    def __init__(self, date=None, sections=None):
+        """
+        :param date: The eCFR up_to_date_as_of date of the last run.
+        :param sections: A dict of section id to its hash, key and sub part.
+        """
+        self.date = date
+        self.sections = sections or dict()
+        self.seen = set()
+        self.incomplete_sub_parts = set()
+
+    @classmethod
+    def load(cls, s3, bucket, key):
+        """
+        This reads the manifest from S3, or returns an empty one if there is none yet.
+
+        :param s3: The boto3 S3 client.
+        :param bucket: The bucket the manifest is stored in.
+        :param key: The key of the manifest object.
+        """
+        try:
+            response = s3.get_object(Bucket=bucket, Key=key)
+        except s3.exceptions.NoSuchKey:
+            return cls()
+        data = json.loads(response["Body"].read())
+        return cls(data.get("date"), data.get("sections"))
+
+    def save(self, s3, bucket, key):
+        """
+        This writes the manifest to S3.
+
+        :param s3: The boto3 S3 client.
+        :param bucket: The bucket the manifest is stored in.
+        :param key: The key of the manifest object.
+        """
+        s3.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=json.dumps({"date": self.date, "sections": self.sections}),
+            ContentType="application/json",
+        )
+
+    def is_unchanged(self, section_id, content_hash):
+        """
+        This marks the section as seen and tells if it is the same as in the last run.
+
+        :param section_id: The section number, e.g. 482.12.
+        :param content_hash: The hash of the section's current content.
+        """
+        self.seen.add(section_id)
+        entry = self.sections.get(section_id)
+        return entry is not None and entry["hash"] == content_hash
+
+    def record(self, section_id, content_hash, key, sub_part):
+        """
+        This stores the result of processing a section.
+
+        :param section_id: The section number, e.g. 482.12.
+        :param content_hash: The hash of the section's content.
+        :param key: The S3 key the processed section was written to.
+        :param sub_part: The sub part letter of the section.
+        """
+        self.seen.add(section_id)
+        self.sections[section_id] = {
+            "hash": content_hash,
+            "key": key,
+            "subpart": sub_part,
+        }
+
+    def merge(self, sections, seen, incomplete_sub_parts):
+        """
+        This adds what a worker recorded for its sub parts to the manifest.
+
+        :param sections: A dict of section id to its hash, key and sub part, for the sections the
+            worker saw.
+        :param seen: The ids of the sections the worker found.
+        :param incomplete_sub_parts: The sub parts the worker stopped on an error in.
+        """
+        self.sections.update(sections)
+        self.seen.update(seen)
+        self.incomplete_sub_parts.update(incomplete_sub_parts)
+
+    def seen_entries(self):
+        """
+        This returns the entries of the sections seen this run, for a worker to report back.
+        """
+        return {
+            section_id: self.sections[section_id]
+            for section_id in self.seen
+            if section_id in self.sections
+        }
+
+    def dropped_sections(self, sub_parts):
+        """
+        This lists the sections of the manifest that are in the given, fully re-read sub parts but
+        were not found in them this run. Sub parts that stopped on an error are left out.
+
+        :param sub_parts: The sub part letters that were read this run.
+        """
+        return [
+            section_id
+            for section_id, entry in self.sections.items()
+            if entry["subpart"] in sub_parts
+            and entry["subpart"] not in self.incomplete_sub_parts
+            and section_id not in self.seen
+        ]
+
+    def remove(self, section_id):
+        """
+        This removes a section from the manifest and returns its entry.
+
+        :param section_id: The section number, e.g. 482.12.
+        """
+        return self.sections.pop(section_id, None)
+
+
+def plan_incremental_run(manifest, content_versions, sub_parts):
+    """
+    This compares the manifest with the eCFR versioner data. It returns the sub parts that have
+    new or changed sections since the manifest's date, and the sections that have been removed.
+
+    :param manifest: The RunManifest of the last run.
+    :param content_versions: The content_versions list of the eCFR versions endpoint.
+    :param sub_parts: The sub part letters this run is configured for.
+    """
+    latest = dict()
+    for version in content_versions:
+        if version.get("type") != "section":
+            continue
+        current = latest.get(version["identifier"])
+        if current is None or version["date"] > current["date"]:
+            latest[version["identifier"]] = version
+
+    changed_sub_parts = set()
+    removed_sections = []
+    for section_id, version in latest.items():
+        if version.get("removed"):
+            if section_id in manifest.sections:
+                removed_sections.append(section_id)
+        elif manifest.date is None or version["date"] > manifest.date:
+            changed_sub_parts.add(version.get("subpart"))
+
+    sub_parts_to_run = [sub_part for sub_part in sub_parts if sub_part in changed_sub_parts]
+    return sub_parts_to_run, removed_sections
@@ -0,0 +1,318 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000, 60000)
+
+# CloudWatch takes at most 100 values of a metric in one EMF line
+EMF_MAX_VALUES = 100
+
+
+class StageStats:
+    """
+    This keeps the counts, error counts, byte sizes and latency histogram of one stage.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.bytes = 0
+        self.total_ms = 0.0
+        self.min_ms = None
+        self.max_ms = None
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.counters = dict()
+
+    def add(self, milliseconds, size=None, error=False, counters=None):
+        for name, value in (counters or {}).items():
+            self.counters[name] = self.counters.get(name, 0) + value
+        self.calls += 1
+        self.errors += 1 if error else 0
+        self.bytes += size or 0
+        self.total_ms += milliseconds
+        self.min_ms = milliseconds if self.min_ms is None else min(self.min_ms, milliseconds)
+        self.max_ms = milliseconds if self.max_ms is None else max(self.max_ms, milliseconds)
+        self.buckets[bucket_index(milliseconds)] += 1
+
+    def merge(self, summary):
+        """
+        This adds in the summary of the same stage from another process, e.g. a worker.
+
+        :param summary: The dict to_dict returned.
+        """
+        self.calls += summary["calls"]
+        self.errors += summary["errors"]
+        self.bytes += summary["bytes"]
+        latency = summary["latency_ms"]
+        self.total_ms += latency["total"]
+        if latency["min"] is not None:
+            self.min_ms = latency["min"] if self.min_ms is None else min(self.min_ms, latency["min"])
+        if latency["max"] is not None:
+            self.max_ms = latency["max"] if self.max_ms is None else max(self.max_ms, latency["max"])
+        for index, count in enumerate(summary["histogram_ms"].values()):
+            self.buckets[index] += count
+        for name, value in summary.get("counters", {}).items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def percentile(self, fraction):
+        """
+        This returns the upper bound of the histogram bucket the percentile falls in.
+
+        :param fraction: The percentile as a fraction, e.g. 0.9.
+        """
+        wanted = fraction * self.calls
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= wanted:
+                bound = LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else None
+                return min(bound, self.max_ms) if bound is not None else self.max_ms
+        return None
+
+    def to_dict(self):
+        labels = [str(bound) for bound in LATENCY_BUCKETS_MS] + ["+Inf"]
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "bytes": self.bytes,
+            "latency_ms": {
+                "total": round(self.total_ms, 3),
+                "mean": round(self.total_ms / self.calls, 3) if self.calls else None,
+                "min": round(self.min_ms, 3) if self.min_ms is not None else None,
+                "max": round(self.max_ms, 3) if self.max_ms is not None else None,
+                "p50": self.percentile(0.5),
+                "p90": self.percentile(0.9),
+                "p99": self.percentile(0.99),
+            },
+            "histogram_ms": dict(zip(labels, self.buckets)),
+            "counters": dict(self.counters),
+        }
+
+
+def bucket_index(milliseconds):
+    for index, bound in enumerate(LATENCY_BUCKETS_MS):
+        if milliseconds <= bound:
+            return index
+    return len(LATENCY_BUCKETS_MS)
+
+
+class Measurement:
+    """
+    This is yielded by RunMetrics.time, set size once the number of bytes is known and add the
+    counts that come with the call, e.g. the tokens of a model call.
+    """
+
+    def __init__(self, size=None):
+        self.size = size
+        self.counters = dict()
+
+    def count(self, name, value):
+        """
+        This adds a count to the call, e.g. count("input_tokens", 120).
+
+        :param name: The snake case name of the counter.
+        :param value: The number to add.
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+
+class RunMetrics:
+    """
+    This measures the stages of the pipeline: eCFR fetches, XML parsing, the section transform,
+    Bedrock summaries and S3 writes. Every measurement is written to the logs as CloudWatch
+    Embedded Metric Format lines, which CloudWatch turns into metrics without any API call, and
+    added to a summary of the invocation that is returned in the handler's response.
+    """
+
+    def __init__(self, namespace, emit=True):
+        """
+        :param namespace: The CloudWatch namespace of the metrics.
+        :param emit: Whether the EMF lines are printed, the summary is kept either way.
+        """
+        self.namespace = namespace
+        self.emit = emit
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._stats = dict()
+        self._pending = dict()
+
+    def begin(self):
+        """
+        This starts measuring an invocation. It returns True for the outermost one, which
+        starts from a new summary; handlers called on threads of a running invocation add to
+        its summary.
+        """
+        with self._lock:
+            self._depth += 1
+            if self._depth == 1:
+                self._stats = dict()
+                self._pending = dict()
+                return True
+            return False
+
+    def end(self):
+        """
+        This finishes an invocation started with begin. The outermost one writes the EMF lines
+        not written yet and returns the summary.
+        """
+        with self._lock:
+            self._depth = max(self._depth - 1, 0)
+            outermost = self._depth == 0
+        if outermost:
+            self.flush()
+        return self.summary()
+
+    def record(self, stage, milliseconds, size=None, error=False, counters=None):
+        """
+        This adds one measurement of a stage.
+
+        :param stage: The name of the stage, e.g. "fetch".
+        :param milliseconds: How long it took.
+        :param size: The number of bytes it handled, if known.
+        :param error: Whether it failed.
+        :param counters: A dict of other counts of the call, e.g. {"input_tokens": 120}.
+        """
+        line = None
+        with self._lock:
+            self._stats.setdefault(stage, StageStats()).add(milliseconds, size, error, counters)
+            if not self.emit:
+                return
+            pending = self._pending.setdefault(stage, [])
+            pending.append((milliseconds, size, error, counters or {}))
+            if len(pending) >= EMF_MAX_VALUES:
+                line = self.emf_line(stage, pending)
+                self._pending[stage] = []
+        if line:
+            print(line)
+
+    @contextmanager
+    def time(self, stage, size=None):
+        """
+        This measures the code in the with block as one call of the stage. An exception counts
+        as an error and is raised again.
+
+        :param stage: The name of the stage.
+        :param size: The number of bytes handled, it can also be set on the yielded Measurement.
+        """
+        measurement = Measurement(size)
+        start = time.perf_counter()
+        try:
+            yield measurement
+        except Exception:
+            self.record(
+                stage,
+                (time.perf_counter() - start) * 1000,
+                measurement.size,
+                True,
+                measurement.counters,
+            )
+            raise
+        self.record(
+            stage,
+            (time.perf_counter() - start) * 1000,
+            measurement.size,
+            counters=measurement.counters,
+        )
+
+    def timed_iter(self, stage, items):
+        """
+        This yields the items, measuring the time spent producing each one as a call of the
+        stage, but not the time the caller spends on it.
+
+        :param stage: The name of the stage.
+        :param items: The iterable to measure, e.g. a streaming parser.
+        """
+        iterator = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            except Exception:
+                self.record(stage, (time.perf_counter() - start) * 1000, error=True)
+                raise
+            self.record(stage, (time.perf_counter() - start) * 1000)
+            yield item
+
+    def emf_line(self, stage, measurements):
+        """
+        This returns the EMF JSON line of some measurements of a stage.
+
+        :param stage: The name of the stage.
+        :param measurements: (milliseconds, size, error, counters) tuples, at most
+            EMF_MAX_VALUES.
+        """
+        sizes = [size for _, size, _, _ in measurements if size is not None]
+        metrics = [
+            {"Name": "Latency", "Unit": "Milliseconds"},
+            {"Name": "Calls", "Unit": "Count"},
+            {"Name": "Errors", "Unit": "Count"},
+        ]
+        document = {
+            "Stage": stage,
+            "Latency": [round(milliseconds, 3) for milliseconds, _, _, _ in measurements],
+            "Calls": len(measurements),
+            "Errors": sum(1 for _, _, error, _ in measurements if error),
+        }
+        if sizes:
+            metrics.append({"Name": "Bytes", "Unit": "Bytes"})
+            document["Bytes"] = sizes
+        names = sorted({name for _, _, _, counters in measurements for name in counters})
+        for name in names:
+            # input_tokens is written as InputTokens, like the other metric names
+            metric_name = "".join(word.title() for word in name.split("_"))
+            metrics.append({"Name": metric_name, "Unit": "Count"})
+            document[metric_name] = [
+                counters[name] for _, _, _, counters in measurements if name in counters
+            ]
+        document["_aws"] = {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [
+                {"Namespace": self.namespace, "Dimensions": [["Stage"]], "Metrics": metrics}
+            ],
+        }
+        return json.dumps(document, separators=(",", ":"))
+
+    def flush(self):
+        """
+        This prints the EMF lines of the measurements that are not written yet.
+        """
+        with self._lock:
+            lines = [
+                self.emf_line(stage, pending)
+                for stage, pending in self._pending.items()
+                if pending
+            ]
+            self._pending = dict()
+        for line in lines:
+            print(line)
+
+    def merge(self, summary):
+        """
+        This adds the summary of another invocation, e.g. a fan out worker, to this one. Its
+        EMF lines were written by that invocation, so they are not written again.
+
+        :param summary: The dict summary returned.
+        """
+        with self._lock:
+            for stage, stats in summary.items():
+                self._stats.setdefault(stage, StageStats()).merge(stats)
+
+    def summary(self):
+        """
+        This returns a dict of every stage to its calls, errors, bytes, latencies and counters.
+        """
+        with self._lock:
+            return {stage: stats.to_dict() for stage, stats in self._stats.items()}
+
+
+# The metrics of this process, shared by every module of the pipeline. METRICS=off stops the EMF
+# lines, the summary in the response is kept.
+metrics = RunMetrics(
+    os.environ.get("METRICS_NAMESPACE", "MedlaunchRegulations"),
+    emit=os.environ.get("METRICS", "emf") != "off",
+)
@@ -0,0 +1,178 @@
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import ClientError
+from run_metrics import metrics
+
+# Object metadata key the hash of the stable part of the document is stored under
+HASH_METADATA_KEY = "content-sha256"
+
+# Metadata fields that change on every run without the content changing
+VOLATILE_METADATA = ("extraction_date",)
+
+
+def compact_json(document):
+    """
+    This serializes a document as JSON with no indentation or spaces.
+
+    :param document: The dict to serialize.
+    """
+    return json.dumps(document, ensure_ascii=False, separators=(",", ":"))
+
+
+def document_hash(body, document, output_format=""):
+    """
+    This creates a hash of a serialized processed section that leaves out the volatile metadata,
+    so the same content extracted on another day has the same hash. The values are cut out of
+    the body that is written, so the document isn't serialized a second time.
+
+    :param body: The document serialized as it is written.
+    :param document: The processed section dict.
+    :param output_format: The name of the format the document is written in, so a format change
+        is written again.
+    """
+    metadata = document.get("metadata")
+    if isinstance(metadata, dict):
+        for name in VOLATILE_METADATA:
+            if metadata.get(name) is None:
+                continue
+            # The metadata is the last part of the document, so the last occurrence is the one
+            value = json.dumps(metadata[name], ensure_ascii=False)
+            position = body.rfind(value)
+            if position != -1:
+                body = body[:position] + body[position + len(value) :]
+    return hashlib.sha256((output_format + body).encode("utf-8")).hexdigest()
+
+
+def put_if_changed(s3, bucket, key, body, content_hash, **put_args):
+    """
+    This writes the object only if the hash stored on the existing object is different.
+    It returns True if the object was written and False if the write was skipped.
+
+    :param s3: The boto3 S3 client.
+    :param bucket: The bucket to write to.
+    :param key: The key of the object.
+    :param body: The body of the object.
+    :param content_hash: The hash of the content, stored as object metadata.
+    :param put_args: Extra arguments for put_object, e.g. ContentType.
+    """
+    try:
+        head = s3.head_object(Bucket=bucket, Key=key)
+        if head.get("Metadata", {}).get(HASH_METADATA_KEY) == content_hash:
+            return False
+    except ClientError as e:
+        if e.response.get("Error", {}).get("Code") not in ("404", "NoSuchKey", "NotFound"):
+            raise
+
+    with metrics.time("upload", len(body.encode("utf-8") if isinstance(body, str) else body)):
+        s3.put_object(
+            Bucket=bucket,
+            Key=key,
+            Body=body,
+            Metadata={HASH_METADATA_KEY: content_hash},
+            **put_args,
+        )
+    return True
+
+
+class S3Uploader:
+    """
+    This writes processed sections to S3 on a bounded pool of worker threads, skipping the ones
+    that are the same as the object already in the bucket. submit blocks when too many uploads
+    are waiting, so documents don't pile up in memory.
+    """
+
+    def __init__(self, s3, bucket, concurrency=8, compact=False, bundles=None):
+        """
+        :param s3: The boto3 S3 client.
+        :param bucket: The bucket to write to.
+        :param concurrency: The number of uploads running at the same time.
+        :param compact: Whether the JSON is written without indentation.
+        :param bundles: A BundleWriter every submitted document is also added to, or None.
+        """
+        self.s3 = s3
+        self.bucket = bucket
+        self.compact = compact
+        self.bundles = bundles
+        concurrency = max(concurrency, 1)
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._slots = threading.BoundedSemaphore(concurrency * 2)
+        self._lock = threading.Lock()
+        self.written = []
+        self.skipped = []
+        self.failed = []
+
+    def submit(self, key, document, name=None, group=None):
+        """
+        This queues a processed section to be written.
+
+        :param key: The key of the object.
+        :param document: The processed section dict.
+        :param name: The name the upload is reported under, the key if None.
+        :param group: The bundle the document is added to, e.g. its sub part.
+        """
+        self._slots.acquire()
+        try:
+            future = self._executor.submit(self._upload, key, document, name or key, group)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+
+    def _upload(self, key, document, name, group):
+        try:
+            if self.compact:
+                body = compact_json(document)
+            else:
+                body = json.dumps(document, ensure_ascii=False, indent=2)
+
+            if self.bundles is not None and group is not None:
+                # A compact body is already the bundle line
+                self.bundles.add(group, document, body if self.compact else None)
+
+            changed = put_if_changed(
+                self.s3,
+                self.bucket,
+                key,
+                body,
+                document_hash(body, document, "compact" if self.compact else ""),
+                ContentType="application/json",
+            )
+            with self._lock:
+                (self.written if changed else self.skipped).append(name)
+        except Exception as e:
+            print("Upload failed for", key, e)
+            with self._lock:
+                self.failed.append(name)
+
+    def bundle_existing(self, key, group):
+        """
+        This adds a section that was not processed this run to the bundle, by reading back the
+        object already in the bucket.
+
+        :param key: The key of the existing object.
+        :param group: The bundle the document is added to, e.g. its sub part.
+        """
+        if self.bundles is None:
+            return
+        response = self.s3.get_object(Bucket=self.bucket, Key=key)
+        self.bundles.add(group, json.loads(response["Body"].read()))
+
+    def close(self):
+        """
+        This waits for the queued uploads to finish and returns how many were written, skipped
+        and failed.
+        """
+        self._executor.shutdown(wait=True)
+        return {
+            "written": len(self.written),
+            "skipped": len(self.skipped),
+            "failed": len(self.failed),
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
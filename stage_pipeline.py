@@ -0,0 +1,156 @@
+import queue
+import threading
+
+# Put on a queue after the last item of a stage
+_DONE = object()
+
+# How often a thread blocked on a queue checks if the pipeline was stopped, in seconds
+_POLL_SECONDS = 0.1
+
+
+class Stage:
+    """
+    This is one step of a pipeline: a function called on every item on the step's own worker
+    threads. The function returns an iterable of the items it passes on, usually a generator, so
+    a step can drop an item, pass it on, or turn it into many, e.g. a download into its sections.
+    """
+
+    def __init__(self, name, func, workers=1):
+        """
+        :param name: The name of the step, used for its threads.
+        :param func: The function that takes an item and returns an iterable of items.
+        :param workers: How many items the step works on at the same time.
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(workers, 1)
+
+
+class _Pipeline:
+    """
+    This keeps the queues, threads and first error of one run_pipeline call.
+    """
+
+    def __init__(self, stages, queue_size):
+        self.stages = stages
+        self.queues = [queue.Queue(max(queue_size, 1)) for _ in range(len(stages) + 1)]
+        self.stop = threading.Event()
+        self.errors = []
+        self.threads = []
+        self._lock = threading.Lock()
+        self._running = [stage.workers for stage in stages]
+
+    def put(self, index, item):
+        """
+        This waits until there is room on a queue and puts the item on it. It returns False if
+        the pipeline was stopped first.
+        """
+        while not self.stop.is_set():
+            try:
+                self.queues[index].put(item, timeout=_POLL_SECONDS)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get(self, index):
+        """
+        This waits for the next item of a queue. It returns _DONE if the pipeline was stopped.
+        """
+        while not self.stop.is_set():
+            try:
+                return self.queues[index].get(timeout=_POLL_SECONDS)
+            except queue.Empty:
+                continue
+        return _DONE
+
+    def fail(self, error):
+        with self._lock:
+            self.errors.append(error)
+        self.stop.set()
+
+    def feed(self, source):
+        try:
+            for item in source:
+                if not self.put(0, item):
+                    return
+        except Exception as e:
+            self.fail(e)
+        self.put(0, _DONE)
+
+    def work(self, index):
+        stage = self.stages[index]
+        try:
+            while True:
+                item = self.get(index)
+                if item is _DONE:
+                    # Put back for the other workers of the stage
+                    self.put(index, _DONE)
+                    break
+                results = iter(stage.func(item))
+                try:
+                    for result in results:
+                        if not self.put(index + 1, result):
+                            return
+                finally:
+                    # A generator left on a stop closes what it has open, e.g. a download
+                    if hasattr(results, "close"):
+                        results.close()
+        except Exception as e:
+            self.fail(e)
+            return
+
+        with self._lock:
+            self._running[index] -= 1
+            last = self._running[index] == 0
+        if last:
+            self.put(index + 1, _DONE)
+
+    def start(self, source):
+        self.threads.append(threading.Thread(target=self.feed, args=(source,), daemon=True))
+        for index, stage in enumerate(self.stages):
+            for number in range(stage.workers):
+                self.threads.append(
+                    threading.Thread(
+                        target=self.work,
+                        args=(index,),
+                        name=f"{stage.name}-{number}",
+                        daemon=True,
+                    )
+                )
+        for thread in self.threads:
+            thread.start()
+
+    def close(self):
+        self.stop.set()
+        for thread in self.threads:
+            thread.join()
+
+
+def run_pipeline(source, stages, queue_size=16):
+    """
+    This runs the stages as a producer/consumer pipeline and yields the items the last stage
+    passes on, as they come out. The source is read on a thread of its own and every stage has
+    its own worker threads, with a queue of at most queue_size items between two stages, so a
+    network bound stage works at the same time as a CPU bound one and a fast stage waits for a
+    slow one instead of piling items up in memory.
+
+    A stage function should handle the errors of an item itself. An exception that escapes it
+    stops the whole pipeline and is raised here once the threads have finished.
+
+    :param source: The iterable of the items sent to the first stage.
+    :param stages: The Stage objects, in order.
+    :param queue_size: The most items waiting between two stages.
+    """
+    pipeline = _Pipeline(stages, queue_size)
+    pipeline.start(source)
+    try:
+        while True:
+            item = pipeline.get(len(stages))
+            if item is _DONE:
+                break
+            yield item
+    finally:
+        pipeline.close()
+    if pipeline.errors:
+        raise pipeline.errors[0]
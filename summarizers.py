@@ -0,0 +1,152 @@
+import re
+from collections import Counter
+from summary_prompts import summarize_text
+
+# Words too common in regulations to tell sentences apart
+STOP_WORDS = frozenset(
+    """
+    a about above after all also an and any are as at be been before being between both but by
+    can could does each either for from had has have if in into is it its may more must no nor
+    not of on or other over part section shall should so such than that the their them then
+    there these they this those through to under unless upon was were when where whether which
+    while who will with within without would
+    """.split()
+)
+
+# Sentences with these words state a requirement, which is what a description should give
+REQUIREMENT_WORDS = frozenset(["must", "shall", "required", "requires", "ensure", "ensures"])
+
+_WORDS = re.compile(r"[a-z][a-z'-]+")
+_SENTENCE_END = re.compile(r"(?<=\.)\s+(?=[A-Z(])")
+_PARAGRAPH_CODE = re.compile(r"^(?:\((?:[a-z]{1,4}|\d{1,3})\)\s*)+")
+_SECTION_NUMBER = re.compile(r"^§\s*[\d.]+\s*")
+
+
+def content_words(text):
+    """
+    This returns the lower case words of a text, without the stop words.
+
+    :param text: The text.
+    """
+    return [word for word in _WORDS.findall(text.lower()) if word not in STOP_WORDS]
+
+
+class BedrockSummarizer:
+    """
+    This summarizes a section with a Bedrock text model. A section longer than the token budget
+    is summarized in chunks, see summarize_text.
+    """
+
+    def __init__(
+        self, invoke, prompt_template, chunk_template, combine_template, budget_tokens, max_chunks
+    ):
+        """
+        :param invoke: The function that sends a prompt to the model and returns its answer.
+        :param prompt_template: The prompt of a whole section, with a {text} field.
+        :param chunk_template: The prompt of a chunk, with {heading} and {text} fields.
+        :param combine_template: The prompt that combines the chunk summaries.
+        :param budget_tokens: The most tokens of text a prompt may have.
+        :param max_chunks: The most chunks a long section is split into.
+        """
+        self.invoke = invoke
+        self.prompt_template = prompt_template
+        self.chunk_template = chunk_template
+        self.combine_template = combine_template
+        self.budget_tokens = budget_tokens
+        self.max_chunks = max_chunks
+
+    def summarize(self, text):
+        """
+        This returns the description of a section. Errors of the model are raised.
+
+        :param text: The plain text of the section from section_text.
+        """
+        return summarize_text(
+            text,
+            self.invoke,
+            self.prompt_template,
+            self.chunk_template,
+            self.combine_template,
+            self.budget_tokens,
+            self.max_chunks,
+        )
+
+
+class ExtractiveSummarizer:
+    """
+    This describes a section with its most informative sentences, picked from the text itself
+    with no network call. A sentence scores higher the more of the section's frequent words and
+    heading words it has, and if it states a requirement. It is much faster than a model and
+    never fails, so it fills in when Bedrock can't be used.
+    """
+
+    def __init__(self, max_sentences=1, max_chars=400, min_words=6):
+        """
+        :param max_sentences: How many sentences the description has at most.
+        :param max_chars: The longest description, a longer one is cut at the end of a word.
+        :param min_words: Sentences with fewer words, e.g. "Standard: Medical staff.", are only
+            used if there is nothing else.
+        """
+        self.max_sentences = max_sentences
+        self.max_chars = max_chars
+        self.min_words = min_words
+
+    def sentences(self, text):
+        """
+        This splits the paragraphs of a section into sentences, without their paragraph codes.
+        It returns the heading and the sentences.
+
+        :param text: The plain text of the section from section_text, the heading on the first
+            line.
+        """
+        heading, _, body = text.partition("\n")
+        sentences = []
+        for line in body.split("\n"):
+            for sentence in _SENTENCE_END.split(_PARAGRAPH_CODE.sub("", line.strip())):
+                sentence = _PARAGRAPH_CODE.sub("", sentence.strip())
+                if sentence:
+                    sentences.append(sentence)
+        return _SECTION_NUMBER.sub("", heading.strip()), sentences
+
+    def summarize(self, text):
+        """
+        This returns the description of a section.
+
+        :param text: The plain text of the section from section_text.
+        """
+        heading, sentences = self.sentences(text)
+        words = [content_words(sentence) for sentence in sentences]
+        frequencies = Counter(word for sentence_words in words for word in set(sentence_words))
+        heading_words = set(content_words(heading))
+
+        scored = []
+        for index, (sentence, sentence_words) in enumerate(zip(sentences, words)):
+            unique = set(sentence_words)
+            if not unique:
+                continue
+            score = sum(frequencies[word] + 2 * (word in heading_words) for word in unique)
+            # Long sentences shouldn't win only by having more words
+            score /= len(unique) ** 0.5
+            if REQUIREMENT_WORDS & set(_WORDS.findall(sentence.lower())):
+                score *= 1.5
+            if len(sentence.split()) < self.min_words:
+                score *= 0.1
+            # Regulations usually state the rule first and the details after it
+            score *= 1 + 1 / (index + 2)
+            scored.append((score, index))
+
+        if not scored:
+            return self.cut(heading)
+        picked = sorted(index for _, index in sorted(scored, reverse=True)[: self.max_sentences])
+        return self.cut(" ".join(sentences[index] for index in picked))
+
+    def cut(self, text):
+        """
+        This cuts a description to max_chars, at the end of a word.
+
+        :param text: The description.
+        """
+        if len(text) <= self.max_chars:
+            return text
+        cut = text.rfind(" ", 0, self.max_chars - 3)
+        return text[: cut if cut > 0 else self.max_chars - 3].rstrip(",;:") + "..."
@@ -0,0 +1,205 @@
+import json
+import posixpath
+import threading
+import uuid
+
+# Statuses of a model invocation job that is not finished yet
+BATCH_RUNNING_STATUSES = {"Submitted", "Validating", "Scheduled", "InProgress", "Stopping"}
+
+# Statuses of a finished job whose output can be merged
+BATCH_DONE_STATUSES = {"Completed", "PartiallyCompleted"}
+
+
+def parse_s3_uri(uri):
+    """
+    This splits an s3://bucket/key URI into the bucket and the key.
+
+    :param uri: The S3 URI.
+    """
+    bucket, _, key = uri[len("s3://") :].partition("/")
+    return bucket, key
+
+
+class BatchPrompts:
+    """
+    This keeps the batch records of the sections processed this invocation, by part and sub part,
+    until they are written to S3. Shared by the threads of the invocation.
+    """
+
+    def __init__(self):
+        self._records = dict()
+        self._lock = threading.Lock()
+
+    def add(self, part, sub_part, record):
+        """
+        This adds the record of a section.
+
+        :param part: The name of the part, e.g. title-42/part-482.
+        :param sub_part: The sub part letter of the section.
+        :param record: The record dict from batch_record.
+        """
+        with self._lock:
+            self._records.setdefault((part, sub_part), []).append(record)
+
+    def pop(self, part, sub_part):
+        """
+        This returns the records of a sub part and forgets them.
+
+        :param part: The name of the part.
+        :param sub_part: The sub part letter.
+        """
+        with self._lock:
+            return self._records.pop((part, sub_part), [])
+
+
+def batch_record(record_id, model_input, cache_key, content_hash):
+    """
+    This creates the record of a section. recordId and modelInput are what Bedrock reads, the
+    summary cache key and the content hash are kept for the merge.
+
+    :param record_id: The id of the record, "<sub part>:<section id>".
+    :param model_input: The invoke_model body of the prompt.
+    :param cache_key: The summary cache key of the section, or None.
+    :param content_hash: The manifest hash of the section.
+    """
+    return {
+        "recordId": record_id,
+        "modelInput": model_input,
+        "cacheKey": cache_key,
+        "hash": content_hash,
+    }
+
+
+def write_records(s3, bucket, key, records):
+    """
+    This writes records as JSONL. An empty list writes an empty file, so an older file of the
+    same key is not read by mistake.
+
+    :param s3: The boto3 S3 client.
+    :param bucket: The bucket to write to.
+    :param key: The key of the file.
+    :param records: The record dicts.
+    """
+    s3.put_object(
+        Bucket=bucket,
+        Key=key,
+        Body="".join(json.dumps(record) + "\n" for record in records).encode("utf-8"),
+        ContentType="application/jsonl",
+    )
+
+
+def read_records(s3, bucket, key):
+    """
+    This returns the records of a JSONL file, or an empty list if there is none.
+
+    :param s3: The boto3 S3 client.
+    :param bucket: The bucket the file is in.
+    :param key: The key of the file.
+    """
+    try:
+        body = s3.get_object(Bucket=bucket, Key=key)["Body"].read()
+    except s3.exceptions.NoSuchKey:
+        return []
+    return [json.loads(line) for line in body.decode("utf-8").splitlines() if line.strip()]
+
+
+def batch_output_key(output_uri, job_arn, input_key):
+    """
+    This returns the bucket and key Bedrock writes the answers of a job to:
+    <output prefix><job id>/<input file name>.out
+
+    :param output_uri: The s3Uri of the job's outputDataConfig.
+    :param job_arn: The ARN of the job, its last part is the job id.
+    :param input_key: The key of the input JSONL file.
+    """
+    bucket, prefix = parse_s3_uri(output_uri)
+    job_id = job_arn.rsplit("/", 1)[-1]
+    return bucket, f"{prefix}{job_id}/{posixpath.basename(input_key)}.out"
+
+
+class LocalBatchJobs:
+    """
+    This stands in for the batch inference calls of the boto3 "bedrock" client, so the batch
+    mode can be run and tested offline. A job reads the input JSONL from S3, calls invoke for
+    every record and writes the answers where Bedrock would. The job descriptions are kept in
+    S3, so another invocation can look a job up.
+    """
+
+    def __init__(self, s3, bucket, invoke, pending_polls=0, prefix="batch-jobs/"):
+        """
+        :param s3: The boto3 S3 client, or a stand-in.
+        :param bucket: The bucket the job descriptions are kept in.
+        :param invoke: The function that takes a modelInput dict and returns the model's answer.
+        :param pending_polls: How many get_model_invocation_job calls report InProgress before
+            the job runs, to test a run that is merged later.
+        :param prefix: The prefix the job descriptions are kept under.
+        """
+        self.s3 = s3
+        self.bucket = bucket
+        self.invoke = invoke
+        self.pending_polls = pending_polls
+        self.prefix = prefix
+
+    def _job_key(self, job_arn):
+        return f"{self.prefix}{job_arn.rsplit('/', 1)[-1]}.json"
+
+    def _save(self, job):
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=self._job_key(job["jobArn"]),
+            Body=json.dumps(job),
+            ContentType="application/json",
+        )
+
+    def create_model_invocation_job(
+        self, jobName, roleArn, modelId, inputDataConfig, outputDataConfig, **kwargs
+    ):
+        job_arn = f"arn:aws:bedrock:local:000000000000:model-invocation-job/{uuid.uuid4().hex[:12]}"
+        job = {
+            "jobArn": job_arn,
+            "jobName": jobName,
+            "modelId": modelId,
+            "roleArn": roleArn,
+            "status": "Submitted",
+            "inputDataConfig": inputDataConfig,
+            "outputDataConfig": outputDataConfig,
+            "pendingPolls": self.pending_polls,
+        }
+        if self.pending_polls <= 0:
+            self._run(job)
+        self._save(job)
+        return {"jobArn": job_arn}
+
+    def get_model_invocation_job(self, jobIdentifier):
+        job = json.loads(
+            self.s3.get_object(Bucket=self.bucket, Key=self._job_key(jobIdentifier))[
+                "Body"
+            ].read()
+        )
+        if job["status"] not in BATCH_DONE_STATUSES:
+            job["pendingPolls"] -= 1
+            if job["pendingPolls"] < 0:
+                self._run(job)
+            else:
+                job["status"] = "InProgress"
+            self._save(job)
+        return job
+
+    def _run(self, job):
+        input_bucket, input_key = parse_s3_uri(job["inputDataConfig"]["s3InputDataConfig"]["s3Uri"])
+        outputs = []
+        errors = 0
+        for record in read_records(self.s3, input_bucket, input_key):
+            output = {"recordId": record["recordId"], "modelInput": record["modelInput"]}
+            try:
+                output["modelOutput"] = self.invoke(record["modelInput"])
+            except Exception as e:
+                errors += 1
+                output["error"] = {"errorCode": 500, "errorMessage": str(e)}
+            outputs.append(output)
+
+        output_bucket, output_key = batch_output_key(
+            job["outputDataConfig"]["s3OutputDataConfig"]["s3Uri"], job["jobArn"], input_key
+        )
+        write_records(self.s3, output_bucket, output_key, outputs)
+        job["status"] = "PartiallyCompleted" if errors else "Completed"
@@ -0,0 +1,182 @@
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+
+def summary_cache_key(text, model_id, prompt_template):
+    """
+    This creates the cache key of a summary. It changes whenever the section content, the model or
+    the prompt changes, so a stale description is never returned.
+
+    :param text: The section content that is summarized.
+    :param model_id: The Bedrock model that writes the summary.
+    :param prompt_template: The prompt the content is inserted into.
+    """
+    digest = hashlib.sha256()
+    for part in (model_id, prompt_template, text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def make_entry(description, model_id):
+    """
+    This creates the JSON stored for one cached summary.
+
+    :param description: The summary to store.
+    :param model_id: The Bedrock model that wrote the summary.
+    """
+    return json.dumps(
+        {"description": description, "model_id": model_id, "created_at": time.time()},
+        ensure_ascii=False,
+    )
+
+
+def read_entry(body, ttl_seconds):
+    """
+    This gets the description out of a stored entry, or None if the entry has expired.
+
+    :param body: The stored JSON entry.
+    :param ttl_seconds: How long an entry stays valid, None means forever.
+    """
+    entry = json.loads(body)
+    if ttl_seconds is not None and time.time() - entry["created_at"] > ttl_seconds:
+        return None
+    return entry["description"]
+
+
+class LocalSummaryCache:
+    """
+    This keeps the summaries as JSON files in a local directory, for development runs.
+    """
+
+    def __init__(self, directory, ttl_seconds=None):
+        """
+        :param directory: The directory the cache files are written to.
+        :param ttl_seconds: How long a summary stays valid, None means forever.
+        """
+        self.directory = Path(directory)
+        self.ttl_seconds = ttl_seconds
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def path(self, key):
+        """
+        This gets the file of a cache key, spread over sub directories by the first characters.
+
+        :param key: The cache key.
+        """
+        return self.directory / key[:2] / f"{key}.json"
+
+    def get(self, key):
+        """
+        This returns the cached description, or None if it is missing or expired.
+
+        :param key: The cache key.
+        """
+        path = self.path(key)
+        try:
+            description = read_entry(path.read_text(encoding="utf-8"), self.ttl_seconds)
+        except FileNotFoundError:
+            return None
+        if description is None:
+            path.unlink(missing_ok=True)
+        return description
+
+    def put(self, key, description, model_id):
+        """
+        This stores a description.
+
+        :param key: The cache key.
+        :param description: The summary to store.
+        :param model_id: The Bedrock model that wrote the summary.
+        """
+        path = self.path(key)
+        path.parent.mkdir(exist_ok=True)
+        path.write_text(make_entry(description, model_id), encoding="utf-8")
+
+    def evict(self, max_entries=None):
+        """
+        This removes the expired summaries, then the oldest ones until at most max_entries are left.
+
+        :param max_entries: The highest number of summaries to keep, None means no limit.
+        """
+        paths = sorted(self.directory.glob("*/*.json"), key=lambda p: p.stat().st_mtime)
+        kept = []
+        for path in paths:
+            if read_entry(path.read_text(encoding="utf-8"), self.ttl_seconds) is None:
+                path.unlink(missing_ok=True)
+            else:
+                kept.append(path)
+
+        if max_entries is not None:
+            for path in kept[: max(len(kept) - max_entries, 0)]:
+                path.unlink(missing_ok=True)
+
+
+class S3SummaryCache:
+    """
+    This keeps the summaries as objects under a prefix of the S3 bucket. Old objects are removed by
+    the bucket's lifecycle rule for the prefix, the TTL makes sure they are not used before that.
+    """
+
+    def __init__(self, s3, bucket, prefix="summary-cache/", ttl_seconds=None):
+        """
+        :param s3: The boto3 S3 client.
+        :param bucket: The bucket the cache lives in.
+        :param prefix: The key prefix of the cache objects.
+        :param ttl_seconds: How long a summary stays valid, None means forever.
+        """
+        self.s3 = s3
+        self.bucket = bucket
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key):
+        """
+        This returns the cached description, or None if it is missing or expired.
+
+        :param key: The cache key.
+        """
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=self.prefix + key)
+        except self.s3.exceptions.NoSuchKey:
+            return None
+        return read_entry(response["Body"].read(), self.ttl_seconds)
+
+    def put(self, key, description, model_id):
+        """
+        This stores a description.
+
+        :param key: The cache key.
+        :param description: The summary to store.
+        :param model_id: The Bedrock model that wrote the summary.
+        """
+        self.s3.put_object(
+            Bucket=self.bucket,
+            Key=self.prefix + key,
+            Body=make_entry(description, model_id),
+            ContentType="application/json",
+        )
+
+
+def create_summary_cache(s3, bucket):
+    """
+    This creates the summary cache chosen with the SUMMARY_CACHE environment variable:
+    "s3" (the default), "local" or "off".
+
+    :param s3: The boto3 S3 client used by the S3 cache.
+    :param bucket: The bucket used by the S3 cache.
+    """
+    backend = os.environ.get("SUMMARY_CACHE", "s3")
+    ttl_days = os.environ.get("SUMMARY_CACHE_TTL_DAYS", "90")
+    ttl_seconds = float(ttl_days) * 86400 if ttl_days else None
+
+    if backend == "s3":
+        prefix = os.environ.get("SUMMARY_CACHE_PREFIX", "summary-cache/")
+        return S3SummaryCache(s3, bucket, prefix, ttl_seconds)
+    if backend == "local":
+        directory = os.environ.get("SUMMARY_CACHE_DIR", "summary_cache")
+        return LocalSummaryCache(directory, ttl_seconds)
+    return None
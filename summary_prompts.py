@@ -0,0 +1,148 @@
+import re
+
+# Titan doesn't publish its tokenizer, English text is about 4 characters a token
+CHARS_PER_TOKEN = 4
+
+_SPACES = re.compile(r"\s+")
+
+
+def estimate_tokens(text):
+    """
+    This estimates the number of tokens of a text.
+
+    :param text: The text that goes into the prompt.
+    """
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def paragraph_text(paragraph):
+    """
+    This returns the plain text of a paragraph as xmltodict parsed it: a string, or a dict with
+    the text in "#text" and inline elements such as the italic heading in <I>.
+
+    :param paragraph: The parsed paragraph, or a list of them.
+    """
+    if paragraph is None:
+        return ""
+    if isinstance(paragraph, str):
+        return _SPACES.sub(" ", paragraph).strip()
+    if isinstance(paragraph, list):
+        return " ".join(filter(None, (paragraph_text(item) for item in paragraph)))
+
+    text = paragraph_text(paragraph.get("#text"))
+    inline = " ".join(
+        filter(
+            None,
+            (
+                paragraph_text(value)
+                for name, value in paragraph.items()
+                if name != "#text" and not name.startswith("@")
+            ),
+        )
+    )
+    if not inline:
+        return text
+
+    # xmltodict keeps the inline text apart, so the heading is put back after the "(a)" code
+    code, _, rest = text.partition(" ")
+    if code.startswith("(") and code.endswith(")"):
+        return " ".join(filter(None, (code, inline, rest)))
+    return " ".join(filter(None, (inline, text)))
+
+
+def section_text(section):
+    """
+    This turns a parsed section into the plain text sent to the model: the heading on the first
+    line and one paragraph a line, without the XML attributes and JSON escaping.
+
+    :param section: The section dict of the DIV8 element.
+    """
+    paragraphs = section.get("P") or []
+    if not isinstance(paragraphs, list):
+        paragraphs = [paragraphs]
+    lines = [paragraph_text(section.get("HEAD"))]
+    lines += [paragraph_text(paragraph) for paragraph in paragraphs]
+    return "\n".join(line for line in lines if line)
+
+
+def fit_to_budget(text, budget_tokens):
+    """
+    This cuts a text to the token budget, at the end of a word.
+
+    :param text: The text to cut.
+    :param budget_tokens: The most tokens the text may have.
+    """
+    max_chars = max(budget_tokens, 1) * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind(" ", 0, max_chars)
+    return text[: cut if cut > 0 else max_chars]
+
+
+def chunk_text(text, budget_tokens):
+    """
+    This splits a text into chunks that each fit the token budget. Whole lines are kept
+    together, a line longer than the budget is split at the end of a word.
+
+    :param text: The text to split, one paragraph a line.
+    :param budget_tokens: The most tokens a chunk may have.
+    """
+    max_chars = max(budget_tokens, 1) * CHARS_PER_TOKEN
+    chunks = []
+    current = ""
+    for line in text.split("\n"):
+        while len(line) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            piece = fit_to_budget(line, budget_tokens)
+            chunks.append(piece)
+            line = line[len(piece) :].strip()
+        if current and len(current) + 1 + len(line) > max_chars:
+            chunks.append(current)
+            current = line
+        elif line:
+            current = f"{current}\n{line}" if current else line
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def summarize_text(
+    text,
+    invoke,
+    prompt_template,
+    chunk_template,
+    combine_template,
+    budget_tokens,
+    max_chunks,
+):
+    """
+    This returns the summary of a section's text. A text within the token budget is summarized
+    with one call. A longer one is split into chunks that are summarized on their own, and the
+    chunk summaries are combined into one with a last call.
+
+    :param text: The plain text of the section, its heading on the first line.
+    :param invoke: The function that sends a prompt to the model and returns its answer.
+    :param prompt_template: The prompt of a whole section, with a {text} field.
+    :param chunk_template: The prompt of a chunk, with {heading} and {text} fields.
+    :param combine_template: The prompt that combines the chunk summaries, with {heading} and
+        {text} fields.
+    :param budget_tokens: The most tokens of text a prompt may have.
+    :param max_chunks: The most chunks summarized, the text after them is left out.
+    """
+    if estimate_tokens(text) <= budget_tokens:
+        return invoke(prompt_template.format(text=text))
+
+    heading = text.split("\n", 1)[0]
+    summaries = [
+        invoke(chunk_template.format(heading=heading, text=chunk))
+        for chunk in chunk_text(text, budget_tokens)[: max(max_chunks, 1)]
+    ]
+    if len(summaries) == 1:
+        return summaries[0]
+    return invoke(
+        combine_template.format(
+            heading=heading, text=fit_to_budget("\n".join(summaries), budget_tokens)
+        )
+    )
@@ -53,6 +53,47 @@ resource "aws_s3_bucket_versioning" "regulations_data" {
   }
 }
 
+# Cached Bedrock summaries and eCFR responses are removed once they are older than their TTL
+resource "aws_s3_bucket_lifecycle_configuration" "regulations_data" {
+  bucket = aws_s3_bucket.regulations_data.id
+
+  rule {
+    id     = "expire-summary-cache"
+    status = "Enabled"
+
+    filter {
+      prefix = "summary-cache/"
+    }
+
+    expiration {
+      days = 90
+    }
+
+    noncurrent_version_expiration {
+      noncurrent_days = 1
+    }
+  }
+
+  rule {
+    id     = "expire-http-cache"
+    status = "Enabled"
+
+    filter {
+      prefix = "http-cache/"
+    }
+
+    expiration {
+      days = 30
+    }
+
+    noncurrent_version_expiration {
+      noncurrent_days = 1
+    }
+  }
+
+  depends_on = [aws_s3_bucket_versioning.regulations_data]
+}
+
 # IAM Role for Lambda
 resource "aws_iam_role" "lambda_role" {
   name = "medlaunch-lambda-role"
@@ -86,10 +127,17 @@ resource "aws_iam_role_policy" "lambda_s3_policy" {
         Effect = "Allow"
         Action = [
           "s3:PutObject",
-          "s3:GetObject"
+          "s3:GetObject",
+          "s3:DeleteObject"
         ]
         Resource = "${aws_s3_bucket.regulations_data.arn}/*"
       },
+      {
+        # Without it a missing key is reported as AccessDenied instead of NoSuchKey
+        Effect   = "Allow"
+        Action   = ["s3:ListBucket"]
+        Resource = aws_s3_bucket.regulations_data.arn
+      },
       {
         Effect = "Allow"
         Action = [
@@ -105,6 +153,65 @@ resource "aws_iam_role_policy" "lambda_s3_policy" {
           "bedrock:InvokeModel"
         ]
         Resource = "arn:aws:bedrock:*::foundation-model/amazon.titan-text-express-v1"
+      },
+      {
+        # SUMMARY_MODE=batch submits the summaries as a batch inference job
+        Effect = "Allow"
+        Action = [
+          "bedrock:CreateModelInvocationJob",
+          "bedrock:GetModelInvocationJob"
+        ]
+        Resource = "*"
+      },
+      {
+        Effect   = "Allow"
+        Action   = ["iam:PassRole"]
+        Resource = aws_iam_role.bedrock_batch_role.arn
+      },
+      {
+        # The orchestrator invokes the same function for each fan out worker
+        Effect   = "Allow"
+        Action   = ["lambda:InvokeFunction"]
+        Resource = "arn:aws:lambda:*:*:function:medlaunch-regulations-processor"
+      }
+    ]
+  })
+}
+
+# IAM Role Bedrock batch inference jobs run as, it reads the input and writes the output in S3
+resource "aws_iam_role" "bedrock_batch_role" {
+  name = "medlaunch-bedrock-batch-role"
+
+  assume_role_policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Action = "sts:AssumeRole"
+        Effect = "Allow"
+        Principal = {
+          Service = "bedrock.amazonaws.com"
+        }
+      }
+    ]
+  })
+}
+
+resource "aws_iam_role_policy" "bedrock_batch_s3_policy" {
+  name = "bedrock-batch-s3-policy"
+  role = aws_iam_role.bedrock_batch_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect   = "Allow"
+        Action   = ["s3:GetObject", "s3:PutObject"]
+        Resource = "${aws_s3_bucket.regulations_data.arn}/*"
+      },
+      {
+        Effect   = "Allow"
+        Action   = ["s3:ListBucket"]
+        Resource = aws_s3_bucket.regulations_data.arn
       }
     ]
   })
@@ -128,6 +235,51 @@ resource "aws_lambda_function" "medlaunch_processor" {
   timeout         = 900
   layers          = [aws_lambda_layer_version.dependencies.arn]
 
+  # Room in /tmp for a full title download and its index, see ECFR_SOURCE
+  ephemeral_storage {
+    size = 2048
+  }
+
+  environment {
+    variables = {
+      FETCH_CONCURRENCY         = "5"
+      PARSE_MODE                = "stream"
+      ECFR_SOURCE               = "subpart"
+      WARM_CACHE_FRACTION       = "0.25"
+      ECFR_CONNECT_TIMEOUT      = "5"
+      ECFR_READ_TIMEOUT         = "60"
+      ECFR_MAX_RETRIES          = "4"
+      ECFR_HEDGE_PERCENTILE     = "0.95"
+      SUMMARY_CONCURRENCY       = "4"
+      SUMMARY_MAX_RETRIES       = "5"
+      SUMMARY_INPUT_TOKENS      = "2000"
+      SUMMARY_OUTPUT_TOKENS     = "100"
+      SUMMARY_MAX_CHUNKS        = "8"
+      SUMMARIZER                = "bedrock"
+      SUMMARY_FALLBACK          = "extractive"
+      SUMMARY_MODE              = "realtime"
+      SUMMARY_BATCH_ROLE_ARN    = aws_iam_role.bedrock_batch_role.arn
+      SUMMARY_CACHE             = "s3"
+      SUMMARY_CACHE_TTL_DAYS    = "90"
+      INCREMENTAL               = "true"
+      HTTP_CACHE                = "s3"
+      UPLOAD_CONCURRENCY        = "8"
+      PIPELINE_QUEUE_SIZE       = "16"
+      TRANSFORM_CONCURRENCY     = "1"
+      OUTPUT_FORMATS            = "json,bundle"
+      EXECUTION_MODE            = "fan_out"
+      FAN_OUT_BACKEND           = "lambda"
+      FAN_OUT_CONCURRENCY       = "10"
+      FAN_OUT_UNIT_SIZE         = "1"
+      CHECKPOINT_MARGIN_SECONDS = "120"
+      CHECKPOINT_CONTINUE       = "invoke"
+      CRAWL_CONCURRENCY         = "4"
+      HOST_CONCURRENCY          = "www.ecfr.gov=4,bedrock-runtime=16"
+      METRICS                   = "emf"
+      METRICS_NAMESPACE         = "MedlaunchRegulations"
+    }
+  }
+
   depends_on = [aws_iam_role_policy.lambda_s3_policy]
 }
 
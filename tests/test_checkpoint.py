@@ -0,0 +1,110 @@
+import io
+import time
+from checkpoint import Deadline, RunCheckpoint, until_deadline
+
+BUCKET = "bucket"
+KEY = "title-42/part-482/_checkpoint.json"
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class StubS3:
+    class exceptions:
+        NoSuchKey = NoSuchKey
+
+    def __init__(self):
+        self.objects = dict()
+
+    def get_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise NoSuchKey(Key)
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)].encode("utf-8"))}
+
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        self.objects[(Bucket, Key)] = Body
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+
+class StubContext:
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def get_remaining_time_in_millis(self):
+        return self.seconds * 1000
+
+
+def test_checkpoint_round_trip():
+    s3 = StubS3()
+    checkpoint = RunCheckpoint(
+        {"title": 42, "part": "482", "sub_parts": ["A", "B", "C"], "metadata": {}},
+        ["B", "C"],
+        {"482.11": {"hash": "h11", "key": "k11", "subpart": "B"}},
+        removed_sections=["482.99"],
+    )
+    checkpoint.summary["uploads"]["written"] = 7
+    checkpoint.summary["failed_units"].append({"sub_parts": ["C"], "error": "boom"})
+    checkpoint.continuations = 2
+
+    checkpoint.save(s3, BUCKET, KEY)
+    loaded = RunCheckpoint.load(s3, BUCKET, KEY)
+
+    assert vars(loaded) == vars(checkpoint)
+
+
+def test_a_missing_checkpoint_loads_as_none_and_delete_removes_it():
+    s3 = StubS3()
+    assert RunCheckpoint.load(s3, BUCKET, KEY) is None
+
+    RunCheckpoint(sub_parts=["A"]).save(s3, BUCKET, KEY)
+    RunCheckpoint.delete(s3, BUCKET, KEY)
+
+    assert RunCheckpoint.load(s3, BUCKET, KEY) is None
+
+
+def test_a_new_checkpoint_has_an_empty_summary():
+    summary = RunCheckpoint().summary
+
+    assert summary == {
+        "failed_sections": [],
+        "failed_uploads": [],
+        "uploads": {"written": 0, "skipped": 0, "failed": 0},
+        "bundles": [],
+        "failed_units": [],
+        "batch_records": 0,
+    }
+    assert RunCheckpoint().summary is not summary
+
+
+def test_deadline_without_a_timeout_is_never_near():
+    deadline = Deadline(None, 120)
+
+    assert not deadline.near()
+    assert deadline.near_at() is None
+    assert deadline.wait_seconds() is None
+    assert list(until_deadline([1, 2, 3], deadline)) == [1, 2, 3]
+
+
+def test_deadline_is_near_within_the_margin_and_stays_near():
+    context = StubContext(100)
+    deadline = Deadline(context, 120)
+
+    assert deadline.near()
+    context.seconds = 900
+    assert deadline.near()
+    assert list(until_deadline([1, 2, 3], deadline)) == []
+
+
+def test_stop_at_comes_before_the_timeout():
+    deadline = Deadline(StubContext(900), 10, stop_at=time.time() + 60)
+
+    assert 49 < deadline.wait_seconds() <= 50
+    assert abs(deadline.near_at() - (time.time() + 50)) < 1
+    assert not deadline.near()
+
+    deadline = Deadline(StubContext(900), 10, stop_at=time.time() + 5)
+    assert deadline.wait_seconds() == 0.0
+    assert deadline.near()
@@ -0,0 +1,102 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from ecfr_client import EcfrClient, same_body
+
+BODY = bytes(range(256)) * 2000
+
+
+class StubResponse:
+    def __init__(self, status_code=200, **headers):
+        self.status_code = status_code
+        self.headers = requests.structures.CaseInsensitiveDict(
+            {name.replace("_", "-"): value for name, value in headers.items()}
+        )
+
+
+class CutHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+        first = len(server.requests) == 1
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(BODY)))
+        for name, value in server.headers[0 if first else 1].items():
+            self.send_header(name, value)
+        self.end_headers()
+        if first:
+            # The connection breaks off in the middle of the body
+            self.wfile.write(BODY[:100001])
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(BODY)
+
+
+@pytest.fixture
+def server():
+    stub = ThreadingHTTPServer(("127.0.0.1", 0), CutHandler)
+    stub.requests = []
+    thread = threading.Thread(target=stub.serve_forever, daemon=True)
+    thread.start()
+    yield stub
+    stub.shutdown()
+    stub.server_close()
+
+
+def read(server, chunk_size):
+    url = f"http://127.0.0.1:{server.server_port}/title-42.xml"
+    with EcfrClient(read_timeout=2, backoff_seconds=0.01) as client:
+        with client.get(url, stream=True) as response:
+            return b"".join(response.iter_content(chunk_size))
+
+
+def test_same_body_needs_the_same_validators():
+    first = StubResponse(ETag='"a"', Content_Length="10")
+
+    assert same_body(first, StubResponse(ETag='"a"', Content_Length="10"))
+    assert not same_body(first, StubResponse(ETag='"b"', Content_Length="10"))
+    assert not same_body(first, StubResponse(ETag='"a"', Content_Length="11"))
+    assert not same_body(first, StubResponse(206, ETag='"a"', Content_Length="10"))
+
+
+def test_same_body_with_last_modified_only():
+    date = "Wed, 01 Jan 2025 00:00:00 GMT"
+    first = StubResponse(Last_Modified=date, Content_Length="10")
+
+    assert same_body(first, StubResponse(Last_Modified=date, Content_Length="10"))
+    assert not same_body(first, StubResponse(ETag='"a"', Content_Length="10"))
+
+
+def test_same_body_without_a_validator_is_false():
+    assert not same_body(StubResponse(Content_Length="10"), StubResponse(Content_Length="10"))
+    assert not same_body(StubResponse(), StubResponse())
+
+
+@pytest.mark.parametrize("chunk_size", [1000, 7777, 100001])
+def test_a_broken_body_is_read_on_from_where_it_stopped(server, chunk_size):
+    server.headers = [{"ETag": '"v1"'}, {"ETag": '"v1"'}]
+
+    assert read(server, chunk_size) == BODY
+    assert len(server.requests) == 2
+
+
+def test_a_broken_body_that_changed_raises(server):
+    server.headers = [{"ETag": '"v1"'}, {"ETag": '"v2"'}]
+
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        read(server, 1000)
+    assert len(server.requests) == 2
+
+
+def test_a_broken_body_without_a_validator_raises(server):
+    server.headers = [{}, {}]
+
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        read(server, 1000)
@@ -0,0 +1,52 @@
+import json
+import threading
+from fan_out import ThreadExecutor, gather_results
+
+RELEASE = threading.Event()
+
+
+def handler(event, context=None):
+    if event["sub_parts"] == ["C"]:
+        RELEASE.wait(10)
+    if event["sub_parts"] == ["D"]:
+        return {"statusCode": 500, "body": json.dumps({"error": "boom"})}
+    body = {
+        "sub_parts": event["sub_parts"],
+        "failed_sections": [],
+        "failed_uploads": [],
+        "uploads": {"written": 2},
+        "bundles": [f"subpart-{event['sub_parts'][0]}.ndjson.gz"],
+    }
+    return {"statusCode": 200, "body": json.dumps(body)}
+
+
+def test_workers_still_running_at_the_timeout_are_remaining():
+    events = [{"sub_parts": [sub_part]} for sub_part in "BCAD"]
+    try:
+        outcomes = list(ThreadExecutor(handler, 4).map(events, timeout=0.5))
+    finally:
+        RELEASE.set()
+
+    assert sorted(event["sub_parts"][0] for event, _, _ in outcomes) == list("ABCD")
+    summary = gather_results(outcomes)
+    assert summary["remaining_sub_parts"] == ["C"]
+    assert summary["failed_units"] == [{"sub_parts": ["D"], "error": "boom"}]
+    assert summary["uploads"]["written"] == 4
+    assert summary["bundles"] == ["subpart-A.ndjson.gz", "subpart-B.ndjson.gz"]
+
+
+def test_earlier_failed_units_are_carried_over():
+    earlier = {
+        "failed_sections": ["482.1"],
+        "failed_uploads": [],
+        "uploads": {"written": 1},
+        "bundles": [],
+        "failed_units": [{"sub_parts": ["E"], "error": "boom"}],
+        "batch_records": 3,
+    }
+
+    summary = gather_results([({"sub_parts": []}, earlier, None)])
+
+    assert summary["failed_units"] == [{"sub_parts": ["E"], "error": "boom"}]
+    assert summary["failed_sections"] == ["482.1"]
+    assert summary["batch_records"] == 3
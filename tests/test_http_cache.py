@@ -0,0 +1,94 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+from http_cache import LocalHttpCache, cached_get, content_length, http_cache_key
+
+BODY = b"<DIV8>" + b"x" * 200000 + b"</DIV8>"
+ETAG = '"v1"'
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers))
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.send_header("ETag", ETAG)
+        self.end_headers()
+        self.wfile.write(BODY)
+
+
+@pytest.fixture
+def server():
+    stub = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    stub.requests = []
+    thread = threading.Thread(target=stub.serve_forever, daemon=True)
+    thread.start()
+    yield stub
+    stub.shutdown()
+    stub.server_close()
+
+
+@pytest.fixture
+def url(server):
+    return f"http://127.0.0.1:{server.server_port}/api/versioner/v1/full/2025-01-01/title-42.xml"
+
+
+def test_200_fills_the_cache(server, url, tmp_path):
+    cache = LocalHttpCache(tmp_path)
+    with requests.Session() as session:
+        with cached_get(session, url, cache=cache) as response:
+            assert not response.from_cache
+            assert content_length(response) == len(BODY)
+            assert response.content == BODY
+
+    meta, body = cache.get(http_cache_key(url, None))
+    with body:
+        assert body.read() == BODY
+    assert meta["etag"] == ETAG
+    assert meta["content_length"] == len(BODY)
+
+
+def test_304_is_served_from_the_cache(server, url, tmp_path):
+    cache = LocalHttpCache(tmp_path)
+    with requests.Session() as session:
+        with cached_get(session, url, cache=cache) as response:
+            response.content
+        with cached_get(session, url, cache=cache) as response:
+            assert response.from_cache
+            assert content_length(response) == len(BODY)
+            assert response.content == BODY
+
+    assert len(server.requests) == 2
+    assert server.requests[1]["If-None-Match"] == ETAG
+
+
+def test_immutable_hit_makes_no_request(server, url, tmp_path):
+    cache = LocalHttpCache(tmp_path)
+    with requests.Session() as session:
+        with cached_get(session, url, cache=cache, immutable=True) as response:
+            response.content
+        with cached_get(session, url, cache=cache, immutable=True) as response:
+            assert response.from_cache
+            assert response.content == BODY
+
+    assert len(server.requests) == 1
+
+
+def test_body_closed_before_the_end_is_not_cached(server, url, tmp_path):
+    cache = LocalHttpCache(tmp_path)
+    with requests.Session() as session:
+        with cached_get(session, url, cache=cache) as response:
+            chunks = response.iter_content(1024)
+            assert next(chunks) == BODY[:1024]
+
+    assert cache.get(http_cache_key(url, None)) is None
+    assert not list(tmp_path.glob("*.tmp"))
@@ -0,0 +1,117 @@
+import random
+import re
+import string
+from requirement_parser import LOWER, NUMBER, ROMAN, UPPER, build_contents, classify, sub_requirement
+
+# The patterns the paragraphs were matched with before classify, in the order they were tried
+OLD_PATTERNS = [
+    (LOWER, re.compile(r"^\([a-hj-uwyz]")),
+    (NUMBER, re.compile(r"^\([1-9]")),
+    (ROMAN, re.compile(r"^\([ivxlcdm]")),
+    (UPPER, re.compile(r"^\([A-Z]")),
+]
+
+
+def old_classify(text):
+    for kind, pattern in OLD_PATTERNS:
+        if pattern.match(text):
+            return kind
+    return None
+
+
+def old_sub_requirement(text, standard_code):
+    # create_a_sub_requirement as it was before sub_requirement replaced it
+    sub = {"code": "", "text": text.strip()}
+    while sub["text"][0] == "(" and len(sub["text"].split(" ", 1)) > 1:
+        code_number = sub["text"].split()[0].strip()
+        sub["code"] = standard_code + (
+            ""
+            if standard_code
+            and len(standard_code) > 1
+            and code_number
+            and len(code_number) > 1
+            and code_number[1] == standard_code[-2]
+            else code_number
+        )
+        sub["text"] = sub["text"].split(" ", 1)[1].strip()
+    return sub
+
+
+def random_paragraph(rng):
+    codes = ["(a)", "(b)", "(1)", "(12)", "(i)", "(iv)", "(A)", "(", "()", "(a)(1)", "x"]
+    spaces = [" ", "  ", "\t", " \n", ""]
+    parts = [rng.choice(codes) + rng.choice(spaces) for _ in range(rng.randint(0, 3))]
+    return "".join(parts) + rng.choice(["Text.", "(b) text", "", "T"])
+
+
+def test_classify_matches_the_old_patterns():
+    for character in string.printable:
+        text = "(" + character + " Text."
+        assert classify(text) == old_classify(text), text
+    assert classify("(") is None
+    assert classify("Text.") is None
+
+
+def test_sub_requirement_matches_the_old_code():
+    rng = random.Random(11)
+    for _ in range(5000):
+        text = random_paragraph(rng).strip()
+        if not text:
+            continue
+        standard_code = rng.choice(["482.12", "482.12(a)", "482.12(b)(1)", ""])
+        assert sub_requirement(text, standard_code) == old_sub_requirement(
+            text, standard_code
+        ), (text, standard_code)
+
+
+def test_build_contents_nests_the_levels():
+    paragraphs = [
+        {"#text": "(a) The staff.", "I": "Standard: Medical staff."},
+        "(1) Appoint members.",
+        "(i) Review them.",
+        "(A) Yearly.",
+        "(2) Keep records.",
+        "(b) (1) Letter and number on one line.",
+        "(2) Second.",
+        "Plain text.",
+    ]
+
+    contents = build_contents("482.12", paragraphs)
+
+    assert contents == [
+        {
+            "standard_code": "482.12(a)",
+            "requirement": "Standard: Medical staff",
+            "sub_requirements": [
+                {
+                    "code": "482.12(a)",
+                    "text": "The staff.",
+                    "sub_requirements": [
+                        {
+                            "code": "482.12(a)(1)",
+                            "text": "Appoint members.",
+                            "sub_requirements": [
+                                {
+                                    "code": "482.12(a)(1)(i)",
+                                    "text": "Review them.",
+                                    "sub_requirements": [
+                                        {"code": "482.12(a)(1)(i)(A)", "text": "Yearly."}
+                                    ],
+                                }
+                            ],
+                        },
+                        {"code": "482.12(a)(2)", "text": "Keep records."},
+                    ],
+                }
+            ],
+        },
+        {
+            "standard_code": "482.12(b)",
+            "requirement": "",
+            "sub_requirements": [
+                {"code": "482.12(b)(1)", "text": "Letter and number on one line."},
+                {"code": "482.12(b)(2)", "text": "Second."},
+                {"code": "", "text": "Plain text."},
+            ],
+        },
+    ]
@@ -0,0 +1,15 @@
+from requirement_parser import build_contents
+from requirements_table import flatten_section
+
+
+def test_flatten_section_skips_empty_paragraphs():
+    content = build_contents("482.1", ["(a) Foo bar.", "   ", "Plain text."])
+    # build_contents keeps the empty paragraph as None
+    assert None in content[0]["sub_requirements"]
+
+    rows = list(flatten_section({"code": "482.1", "content": content}))
+
+    assert [(row["code"], row["parent_code"], row["text"]) for row in rows] == [
+        ("482.1(a)", "482.1", "Foo bar."),
+        ("", "482.1(a)", "Plain text."),
+    ]
@@ -0,0 +1,81 @@
+from run_manifest import RunManifest, plan_incremental_run
+
+
+def version(identifier, date, subpart, removed=False, type="section"):
+    return {
+        "identifier": identifier,
+        "date": date,
+        "subpart": subpart,
+        "removed": removed,
+        "type": type,
+    }
+
+
+def manifest(date="2025-01-01"):
+    return RunManifest(
+        date,
+        {
+            "482.1": {"hash": "h1", "key": "k1", "subpart": "A"},
+            "482.11": {"hash": "h11", "key": "k11", "subpart": "B"},
+            "482.12": {"hash": "h12", "key": "k12", "subpart": "B"},
+        },
+    )
+
+
+def test_only_sub_parts_changed_since_the_manifest_are_run():
+    versions = [
+        version("482.1", "2024-06-01", "A"),
+        version("482.11", "2025-03-01", "B"),
+        version("482.21", "2025-02-01", "C"),
+        version("482", "2025-04-01", "A", type="part"),
+    ]
+
+    sub_parts, removed = plan_incremental_run(manifest(), versions, ["A", "B", "C"])
+
+    assert sub_parts == ["B", "C"]
+    assert removed == []
+
+
+def test_sub_parts_keep_the_configured_order_and_limit():
+    versions = [version("482.21", "2025-02-01", "C"), version("482.11", "2025-03-01", "B")]
+
+    sub_parts, _ = plan_incremental_run(manifest(), versions, ["C", "B"])
+    assert sub_parts == ["C", "B"]
+
+    sub_parts, _ = plan_incremental_run(manifest(), versions, ["A", "B"])
+    assert sub_parts == ["B"]
+
+
+def test_the_latest_version_of_a_section_wins():
+    versions = [
+        version("482.12", "2025-03-01", "B", removed=True),
+        version("482.12", "2024-01-01", "B"),
+        version("482.11", "2024-01-01", "B"),
+        version("482.11", "2025-03-01", "B", removed=True),
+        version("482.11", "2025-05-01", "B"),
+    ]
+
+    sub_parts, removed = plan_incremental_run(manifest(), versions, ["A", "B"])
+
+    assert sub_parts == ["B"]
+    assert removed == ["482.12"]
+
+
+def test_removed_sections_are_only_those_in_the_manifest():
+    versions = [
+        version("482.1", "2025-03-01", "A", removed=True),
+        version("482.99", "2025-03-01", "A", removed=True),
+    ]
+
+    sub_parts, removed = plan_incremental_run(manifest(), versions, ["A", "B"])
+
+    assert sub_parts == []
+    assert removed == ["482.1"]
+
+
+def test_a_manifest_without_a_date_runs_every_sub_part_with_sections():
+    versions = [version("482.1", "2020-01-01", "A"), version("482.11", "2020-01-01", "B")]
+
+    sub_parts, _ = plan_incremental_run(RunManifest(), versions, ["A", "B", "C"])
+
+    assert sub_parts == ["A", "B"]
@@ -0,0 +1,85 @@
+import json
+from botocore.exceptions import ClientError
+from s3_uploader import HASH_METADATA_KEY, compact_json, document_hash, put_if_changed
+
+
+class StubS3:
+    def __init__(self):
+        self.objects = dict()
+        self.puts = 0
+
+    def head_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {"Metadata": self.objects[Key][1]}
+
+    def put_object(self, Bucket, Key, Body, Metadata, **kwargs):
+        self.puts += 1
+        self.objects[Key] = (Body, Metadata)
+
+
+def section(extraction_date="2025-01-01", description="Compliance with laws."):
+    return {
+        "code": "482.11",
+        "title": "Condition of participation: Compliance with laws.",
+        "description": description,
+        "content": [{"standard_code": "482.11(a)", "requirement": "", "sub_requirements": []}],
+        "metadata": {"extraction_date": extraction_date, "source": "eCFR"},
+    }
+
+
+def indented(document):
+    return json.dumps(document, ensure_ascii=False, indent=2)
+
+
+def test_the_extraction_date_does_not_change_the_hash():
+    for serialize in (indented, compact_json):
+        first, second = section("2025-01-01"), section("2025-06-30")
+
+        assert document_hash(serialize(first), first) == document_hash(serialize(second), second)
+
+
+def test_the_hash_is_stable_across_calls():
+    document = section()
+    body = indented(document)
+
+    assert document_hash(body, document) == document_hash(body, document)
+    assert len(document_hash(body, document)) == 64
+
+
+def test_content_and_format_changes_change_the_hash():
+    document = section()
+    changed = section(description="Compliance with all laws.")
+
+    assert document_hash(indented(document), document) != document_hash(
+        indented(changed), changed
+    )
+    assert document_hash(compact_json(document), document) != document_hash(
+        compact_json(document), document, "compact"
+    )
+
+
+def test_only_the_metadata_date_is_left_out():
+    # The same date in the content is content, only the one in the metadata is volatile
+    first = section("2025-01-01", description='"2025-01-01"')
+    second = section("2025-06-30", description='"2025-01-01"')
+    third = section("2025-06-30", description='"2025-06-30"')
+
+    assert document_hash(indented(first), first) == document_hash(indented(second), second)
+    assert document_hash(indented(second), second) != document_hash(indented(third), third)
+
+
+def test_put_if_changed_skips_the_same_hash():
+    s3 = StubS3()
+    first, second = section("2025-01-01"), section("2025-06-30")
+
+    assert put_if_changed(
+        s3, "bucket", "482-11.json", indented(first), document_hash(indented(first), first)
+    )
+    assert not put_if_changed(
+        s3, "bucket", "482-11.json", indented(second), document_hash(indented(second), second)
+    )
+    assert s3.puts == 1
+    assert s3.objects["482-11.json"][1] == {
+        HASH_METADATA_KEY: document_hash(indented(first), first)
+    }
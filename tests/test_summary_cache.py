@@ -0,0 +1,73 @@
+import os
+import time
+import summary_cache
+from summary_cache import LocalSummaryCache, S3SummaryCache, create_summary_cache, summary_cache_key
+
+MODEL = "amazon.titan-text-express-v1"
+PROMPT = "Summarize: {text}"
+
+
+def test_the_key_changes_with_the_text_model_and_prompt():
+    key = summary_cache_key("text", MODEL, PROMPT)
+
+    assert key == summary_cache_key("text", MODEL, PROMPT)
+    assert key != summary_cache_key("text.", MODEL, PROMPT)
+    assert key != summary_cache_key("text", "other-model", PROMPT)
+    assert key != summary_cache_key("text", MODEL, PROMPT + " ")
+    # The parts are separated, so moving text between them changes the key
+    assert summary_cache_key("ab", MODEL, "c") != summary_cache_key("a", MODEL, "bc")
+
+
+def test_an_expired_summary_is_not_returned(tmp_path, monkeypatch):
+    cache = LocalSummaryCache(tmp_path, ttl_seconds=60)
+    key = summary_cache_key("text", MODEL, PROMPT)
+    cache.put(key, "A summary.", MODEL)
+    assert cache.get(key) == "A summary."
+
+    now = time.time()
+    monkeypatch.setattr(summary_cache.time, "time", lambda: now + 61)
+
+    assert cache.get(key) is None
+    assert not cache.path(key).exists()
+
+
+def test_without_a_ttl_summaries_never_expire(tmp_path, monkeypatch):
+    cache = LocalSummaryCache(tmp_path)
+    cache.put("ab12", "A summary.", MODEL)
+
+    now = time.time()
+    monkeypatch.setattr(summary_cache.time, "time", lambda: now + 10 * 365 * 86400)
+
+    assert cache.get("ab12") == "A summary."
+
+
+def test_evict_removes_the_expired_then_the_oldest(tmp_path, monkeypatch):
+    cache = LocalSummaryCache(tmp_path, ttl_seconds=60)
+    now = time.time()
+    for age, key in ((120, "aa01"), (30, "bb02"), (20, "cc03"), (10, "dd04")):
+        monkeypatch.setattr(summary_cache.time, "time", lambda: now - age)
+        cache.put(key, key, MODEL)
+        os.utime(cache.path(key), (now - age, now - age))
+    monkeypatch.setattr(summary_cache.time, "time", lambda: now)
+
+    cache.evict(max_entries=2)
+
+    assert sorted(path.stem for path in tmp_path.glob("*/*.json")) == ["cc03", "dd04"]
+
+
+def test_create_summary_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("SUMMARY_CACHE", "local")
+    monkeypatch.setenv("SUMMARY_CACHE_DIR", str(tmp_path))
+    monkeypatch.setenv("SUMMARY_CACHE_TTL_DAYS", "2")
+    cache = create_summary_cache(None, "bucket")
+    assert isinstance(cache, LocalSummaryCache)
+    assert cache.ttl_seconds == 2 * 86400
+
+    monkeypatch.setenv("SUMMARY_CACHE", "s3")
+    monkeypatch.setenv("SUMMARY_CACHE_TTL_DAYS", "")
+    cache = create_summary_cache(None, "bucket")
+    assert isinstance(cache, S3SummaryCache)
+    assert cache.ttl_seconds is None
+
+    monkeypatch.setenv("SUMMARY_CACHE", "off")
+    assert create_summary_cache(None, "bucket") is None
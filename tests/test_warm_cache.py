@@ -0,0 +1,61 @@
+from warm_cache import WarmCache, cache_budget, deep_size
+
+
+def test_the_least_recently_used_value_is_dropped():
+    cache = WarmCache(300)
+    cache.put("a", "A", size=100)
+    cache.put("b", "B", size=100)
+    cache.put("c", "C", size=100)
+    assert cache.get("a") == "A"
+
+    assert cache.put("d", "D", size=150)
+
+    assert cache.get("b") is None
+    assert cache.get("c") is None
+    assert cache.get("a") == "A"
+    assert cache.get("d") == "D"
+    stats = cache.stats()
+    assert (stats["entries"], stats["bytes"], stats["evictions"]) == (2, 250, 2)
+    assert (stats["hits"], stats["misses"]) == (3, 2)
+
+
+def test_a_value_bigger_than_the_cache_is_not_kept():
+    cache = WarmCache(100)
+    cache.put("a", "A", size=50)
+
+    assert not cache.put("b", "B", size=101)
+
+    assert cache.get("a") == "A"
+    assert cache.get("b") is None
+
+
+def test_putting_a_key_again_replaces_its_size():
+    cache = WarmCache(100)
+    cache.put("a", "A", size=60)
+    cache.put("a", "A2", size=30)
+
+    assert cache.put("b", "B", size=70)
+    assert cache.get("a") == "A2"
+    assert cache.stats()["bytes"] == 100
+
+
+def test_a_cache_of_zero_bytes_keeps_nothing():
+    cache = WarmCache(cache_budget(1024, 0.25, "0"))
+
+    assert not cache.enabled
+    assert not cache.put("a", "A")
+    assert cache.get("a") is None
+
+
+def test_cache_budget():
+    assert cache_budget(1024, 0.25) == 256 * 1024 * 1024
+    assert cache_budget(1024, 0.25, "64") == 64 * 1024 * 1024
+
+
+def test_deep_size_counts_what_the_value_holds():
+    shared = "x" * 1000
+    section = {"P": [shared, shared], "HEAD": "Heading"}
+
+    assert deep_size(section) > 1000
+    # The shared string is counted once
+    assert deep_size(section) < 2000
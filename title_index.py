@@ -0,0 +1,264 @@
+import json
+import mmap
+import os
+import re
+import tempfile
+from pathlib import Path
+
+# Bump when the index format changes, older index files are then built again
+INDEX_VERSION = 1
+
+# Size of the pieces a span of the title is read in
+CHUNK_SIZE = 64 * 1024
+
+# The start and end tags of parts (DIV5), sub parts (DIV6) and sections (DIV8). The elements of a
+# level never nest in each other, so an element ends at the first end tag of its level.
+_DIV_TAG = re.compile(rb"<(/?)DIV([568])\b([^>]*)>")
+_N_ATTRIBUTE = re.compile(rb'\bN="([^"]*)"')
+
+
+def title_file_name(title, date):
+    """
+    This returns the file name of a title's XML at an eCFR date, e.g. title-42-2025-10-01.xml.
+
+    :param title: The title number.
+    :param date: The eCFR up_to_date_as_of date.
+    """
+    return f"title-{title}-{date}.xml"
+
+
+def write_title(chunks, path):
+    """
+    This writes a downloaded title to path. It is written to a temporary file first and renamed,
+    so a half written file is never taken as the title. It returns the number of bytes written.
+
+    :param chunks: The bytes pieces of the XML, e.g. the iter_content of the response.
+    :param path: The path of the file.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    size = 0
+    fd, temporary = tempfile.mkstemp(dir=path.parent, suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                size += len(chunk)
+        os.replace(temporary, path)
+    except BaseException:
+        Path(temporary).unlink(missing_ok=True)
+        raise
+    return size
+
+
+def remove_other_dates(directory, title, keep):
+    """
+    This deletes the files and indexes of the title at other dates, ephemeral storage is small.
+
+    :param directory: The directory the titles are kept in.
+    :param title: The title number.
+    :param keep: The path of the file to keep.
+    """
+    keep = Path(keep)
+    for path in Path(directory).glob(f"title-{title}-*.xml*"):
+        if path != keep and path != index_path(keep):
+            path.unlink(missing_ok=True)
+
+
+def index_path(path):
+    """
+    This returns the path the offset index of a title file is saved to.
+
+    :param path: The path of the title XML.
+    """
+    path = Path(path)
+    return path.with_name(path.name + ".index.json")
+
+
+def build_offsets(data):
+    """
+    This finds the byte offsets of every part, sub part and section of a title. It returns a dict
+    of part number to its span, and the spans of its sub parts by letter and of its sections by
+    number. A span is the [start, end) offsets of the element's tags.
+
+    :param data: The bytes of the title XML, or an mmap of it.
+    """
+    parts = dict()
+    part = None
+    starts = dict()
+    for match in _DIV_TAG.finditer(data):
+        closing, level = match.group(1), match.group(2)
+        if not closing:
+            name = _N_ATTRIBUTE.search(match.group(3))
+            starts[level] = (match.start(), name.group(1).decode("utf-8") if name else None)
+            if level == b"5":
+                part = parts.setdefault(
+                    starts[level][1], {"span": None, "sub_parts": dict(), "sections": dict()}
+                )
+            continue
+
+        if level not in starts:
+            continue
+        start, name = starts.pop(level)
+        span = [start, match.end()]
+        if level == b"5":
+            part["span"] = span
+            part = None
+        elif part is not None and name is not None:
+            part["sub_parts" if level == b"6" else "sections"][name] = span
+    return parts
+
+
+class TitleSpan:
+    """
+    This reads a span of the memory-mapped title like a streamed download, so it can be parsed
+    with iter_response_sections or read whole.
+    """
+
+    def __init__(self, data, start, end):
+        """
+        :param data: The mmap of the title.
+        :param start: The offset of the first byte.
+        :param end: The offset after the last byte.
+        """
+        self._data = data
+        self.start = start
+        self.end = end
+
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        """
+        This yields the span in chunks, only the pages being read are loaded.
+
+        :param chunk_size: The number of bytes in each chunk.
+        """
+        for position in range(self.start, self.end, chunk_size):
+            yield self._data[position : min(position + chunk_size, self.end)]
+
+    @property
+    def content(self):
+        return self._data[self.start : self.end]
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8")
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class TitleIndex:
+    """
+    This finds the parts, sub parts and sections of a downloaded title XML by their byte
+    offsets, so any of them can be parsed without reading the rest of the document. The offsets
+    are found once and saved next to the file. The file is memory-mapped, so only the pages that
+    are read are loaded and the operating system can drop them again.
+    """
+
+    def __init__(self, path, parts):
+        """
+        :param path: The path of the title XML.
+        :param parts: The offsets from build_offsets.
+        """
+        self.path = Path(path)
+        self.parts = parts
+        self._file = open(self.path, "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    @classmethod
+    def open(cls, path):
+        """
+        This opens a title file with its saved index, building and saving the index if there is
+        none or it doesn't match the file.
+
+        :param path: The path of the title XML.
+        """
+        path = Path(path)
+        size = path.stat().st_size
+        try:
+            saved = json.loads(index_path(path).read_text(encoding="utf-8"))
+            if saved["version"] == INDEX_VERSION and saved["size"] == size:
+                return cls(path, saved["parts"])
+        except (FileNotFoundError, ValueError, KeyError) as e:
+            print("Building the index of", path.name, e.__class__.__name__)
+
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            parts = build_offsets(data)
+        index_path(path).write_text(
+            json.dumps({"version": INDEX_VERSION, "size": size, "parts": parts}),
+            encoding="utf-8",
+        )
+        return cls(path, parts)
+
+    def _part(self, part):
+        entry = self.parts.get(str(part))
+        if entry is None or entry["span"] is None:
+            raise KeyError(f"Part {part} is not in {self.path.name}")
+        return entry
+
+    def sub_parts(self, part):
+        """
+        This returns the sub part letters of a part, in document order.
+
+        :param part: The part number.
+        """
+        return list(self._part(part)["sub_parts"])
+
+    def open_part(self, part):
+        """
+        This returns the TitleSpan of a whole part, the DIV5 element.
+
+        :param part: The part number.
+        """
+        return TitleSpan(self._data, *self._part(part)["span"])
+
+    def open_sub_part(self, part, sub_part):
+        """
+        This returns the TitleSpan of a sub part, the DIV6 element. It is the same XML the
+        part and subpart query of the full endpoint returns, without the XML declaration.
+
+        :param part: The part number.
+        :param sub_part: The sub part letter.
+        """
+        span = self._part(part)["sub_parts"].get(sub_part)
+        if span is None:
+            raise KeyError(f"Subpart {sub_part} of part {part} is not in {self.path.name}")
+        return TitleSpan(self._data, *span)
+
+    def open_section(self, part, section_id):
+        """
+        This returns the TitleSpan of a section, the DIV8 element.
+
+        :param part: The part number.
+        :param section_id: The section number, e.g. 482.12.
+        """
+        span = self._part(part)["sections"].get(section_id)
+        if span is None:
+            raise KeyError(f"Section {section_id} is not in {self.path.name}")
+        return TitleSpan(self._data, *span)
+
+    def close(self):
+        self._data.close()
+        self._file.close()
+
+
+def open_title(directory, title, date, download):
+    """
+    This returns the TitleIndex of a title at an eCFR date, downloading it into directory the
+    first time. The copies of the title at other dates are deleted.
+
+    :param directory: The directory the titles are kept in, e.g. /tmp/ecfr-titles on Lambda.
+    :param title: The title number.
+    :param date: The eCFR up_to_date_as_of date.
+    :param download: The function that writes the title XML to the path it is given.
+    """
+    path = Path(directory) / title_file_name(title, date)
+    if not path.exists():
+        remove_other_dates(directory, title, path)
+        download(path)
+    return TitleIndex.open(path)
@@ -0,0 +1,139 @@
+import sys
+import threading
+from collections import OrderedDict
+
+
+def deep_size(value):
+    """
+    This estimates the memory a value takes, with everything it holds: the size of the objects
+    of the dicts, lists, tuples and sets in it, each counted once.
+
+    :param value: The value, e.g. a section parsed by xmltodict.
+    """
+    seen = set()
+    size = 0
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        size += sys.getsizeof(value)
+        if isinstance(value, dict):
+            stack.extend(value.keys())
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            stack.extend(value)
+    return size
+
+
+def cache_budget(memory_mb, fraction, override_mb=None):
+    """
+    This returns the most bytes the cache may hold: override_mb if it is set, otherwise a
+    fraction of the memory of the function.
+
+    :param memory_mb: The memory of the function in MB, e.g. AWS_LAMBDA_FUNCTION_MEMORY_SIZE.
+    :param fraction: The part of the memory the cache may use, e.g. 0.25.
+    :param override_mb: The size of the cache in MB, 0 turns it off.
+    """
+    if override_mb is not None:
+        return int(float(override_mb) * 1024 * 1024)
+    return int(memory_mb * fraction * 1024 * 1024)
+
+
+class WarmCache:
+    """
+    This keeps values in memory for the next invocations of a warm Lambda, e.g. parsed sub parts,
+    up to a number of bytes. When a new value doesn't fit, the least recently used ones are
+    dropped until it does; a value bigger than the whole cache is not kept. Shared by the
+    threads of the process.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        :param max_bytes: The most bytes the values may take together, 0 keeps nothing.
+        """
+        self.max_bytes = max(max_bytes, 0)
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, key):
+        """
+        This returns the value of a key, or None, and marks it as the most recently used.
+
+        :param key: The key, a tuple such as (title, part, sub part, date).
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size=None):
+        """
+        This keeps a value, dropping the least recently used ones if it doesn't fit. It returns
+        True if the value was kept.
+
+        :param key: The key of the value.
+        :param value: The value. It is shared with whoever gets it, so it must not be changed.
+        :param size: The bytes the value takes, estimated with deep_size if None.
+        """
+        if not self.enabled:
+            return False
+        size = deep_size(value) if size is None else size
+        with self._lock:
+            self._remove(key)
+            if size > self.max_bytes:
+                return False
+            while self._bytes + size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+            self._entries[key] = (value, size)
+            self._bytes += size
+            return True
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def discard(self, key):
+        """
+        This forgets the value of a key, if there is one.
+
+        :param key: The key of the value.
+        """
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """
+        This returns the number of values, their bytes, the limit and the hits, misses and
+        evictions since the process started.
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }